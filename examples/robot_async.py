@@ -0,0 +1,53 @@
+"""An example script that senses, drives and signals at the same time with robot_kit.aio"""
+from robot_kit.leds import NeoPixelStrip
+from robot_kit.vehicle import Vehicle
+from robot_kit.ultrasonic import Ultrasonic
+from robot_kit.aio import AsyncVehicle, AsyncUltrasonic, AsyncNeoPixelStrip
+import asyncio
+
+
+async def sense(sensor, state):
+    """Keep the latest distance up to date (10 times a second)"""
+    async for timestamp, distance in sensor.stream(rate_hz=10):
+        state['distance'] = distance
+        print(distance)
+
+
+async def signal(leds, state):
+    """Green when the way is clear, red when something is close"""
+    while True:
+        if state['distance'] < 30:
+            await leds.on(255, 0, 0)
+        else:
+            await leds.on(0, 255, 0)
+        await asyncio.sleep(0.2)
+
+
+async def drive(vehicle, state):
+    """Creep forward while the way is clear"""
+    for i in range(50):
+        if state['distance'] < 30:
+            await vehicle.stop()
+        else:
+            await vehicle.forward(0.4)
+        await asyncio.sleep(0.1)
+    await vehicle.stop()
+
+
+async def main():
+    state = {'distance': 0.0}
+    vehicle = AsyncVehicle(Vehicle())
+    sensor = AsyncUltrasonic(Ultrasonic())
+    leds = AsyncNeoPixelStrip(NeoPixelStrip())
+
+    # Driving decides when we're done, the sensing and signalling just get cancelled
+    tasks = [asyncio.ensure_future(sense(sensor, state)), asyncio.ensure_future(signal(leds, state))]
+    await drive(vehicle, state)
+    for task in tasks:
+        task.cancel()
+    await leds.off()
+
+
+if __name__ == '__main__':
+    """Run the sensing, LED and driving loops on one event loop"""
+    asyncio.run(main())
@@ -2,7 +2,7 @@
 
 import time
 import math
-import smbus
+import threading
 
 # ============================================================================
 # Raspi PCA9685 16-Channel PWM Servo Driver
@@ -20,49 +20,243 @@ class PCA9685:
   __LED0_ON_H          = 0x07
   __LED0_OFF_L         = 0x08
   __LED0_OFF_H         = 0x09
+  __LED15_OFF_H        = 0x45
   __ALLLED_ON_L        = 0xFA
   __ALLLED_ON_H        = 0xFB
   __ALLLED_OFF_L       = 0xFC
   __ALLLED_OFF_H       = 0xFD
+  __MODE1_AI           = 0x20   # Register auto-increment
+  __MODE1_SLEEP        = 0x10   # Oscillator off (every output off)
+  __MODE1_RESTART      = 0x80
+  __FULL_OFF           = 0x10   # LEDn_OFF_H bit 4: the channel is fully off whatever its duty
+  __BLOCK_MAX          = 32     # SMBus block transfers are limited to 32 bytes
+  __BRIDGE_CHANNELS    = 1      # Unchanged channels a block write may rewrite to avoid a new transaction
 
-  def __init__(self, address=0x40, debug=False):
-    self.bus = smbus.SMBus(1)
+  # Shared drivers, one per (bus, address), see shared()
+  _drivers = {}
+  _drivers_lock = threading.Lock()
+
+  @classmethod
+  def shared(cls, address=0x40, bus=None):
+    "The driver for this chip, created (bus reused, MODE1 written) on first use and shared after that"
+    if bus is None:
+      from robot_kit import hw
+      bus = hw.bus(1)
+    with cls._drivers_lock:
+      key = (id(bus), address)
+      if key not in cls._drivers:
+        cls._drivers[key] = (bus, cls(address, bus=bus))   # Holding the bus keeps its id from being reused
+      return cls._drivers[key][1]
+
+  def __init__(self, address=0x40, debug=False, bus=None):
+    "bus: any robot_kit.bus backend (defaults to I2C bus 1 from robot_kit.hw)"
+    if bus is None:
+      from robot_kit import hw
+      bus = hw.bus(1)
+    self.bus = bus
     self.address = address
     self.debug = debug
-    self.write(self.__MODE1, 0x00)
-    
+    self.stats = {'transactions': 0, 'writes': 0, 'suppressed': 0, 'reads': 0, 'cached_reads': 0,
+                  'submits': 0, 'flushes': 0, 'halted': 0}
+    self.halted = False                   # Set by all_off(), channel updates are dropped until resume()
+    self.halts = 0                        # all_off() count, so a block write can tell one ran during it
+    self.lock = threading.RLock()         # Serializes the bus traffic and the register shadow
+    self._pending = {}                    # Channel updates submitted but not yet flushed
+    self._pending_lock = threading.Lock()
+    self._local = threading.local()       # Per thread transaction count, see thread_transactions()
+    self.invalidate()
+    self.write(self.__MODE1, self.__MODE1_AI)
+
+  def invalidate(self):
+    "Forgets the register shadow, call this after a chip reset or if something else wrote the chip"
+    self._shadow = [None] * 256
+
+  def thread_transactions(self):
+    "Bus transactions made so far by the calling thread (other threads' traffic doesn't show up in it)"
+    return getattr(self._local, 'transactions', 0)
+
+  def _transaction(self):
+    "Internal: Count one bus transaction, for the chip and for the calling thread (call with the lock held)"
+    self.stats['transactions'] += 1
+    self._local.transactions = getattr(self._local, 'transactions', 0) + 1
+
+  def resync(self):
+    "Reloads the register shadow from the chip (MODE1..LED15_OFF_H in block reads, then PRESCALE)"
+    with self.lock:
+      self.invalidate()
+      mode = self.read(self.__MODE1)
+      if not mode & self.__MODE1_AI:
+        self.write(self.__MODE1, mode | self.__MODE1_AI)
+      for reg in range(0x00, self.__LED15_OFF_H + 1, self.__BLOCK_MAX):
+        count = min(self.__BLOCK_MAX, self.__LED15_OFF_H + 1 - reg)
+        data = self.bus.read_i2c_block_data(self.address, reg, count)
+        self._transaction()
+        self.stats['reads'] += count
+        self._shadow[reg:reg+count] = data
+      self._shadow[self.__MODE1] &= 0x7F
+      self._shadow[self.__PRESCALE] = None
+      self.read(self.__PRESCALE)
+
+  def _remember(self, reg, value):
+    "Internal: Record a value written to/read from the chip in the register shadow"
+    if reg == self.__MODE1:
+      self._shadow[reg] = value & 0x7F     # RESTART bit clears itself, never trust it
+    elif self.__ALLLED_ON_L <= reg <= self.__ALLLED_OFF_H:
+      # ALL_LED writes land on the same register of every channel
+      for channel_reg in range(self.__LED0_ON_L + reg - self.__ALLLED_ON_L, self.__LED15_OFF_H + 1, 4):
+        self._shadow[channel_reg] = value
+    else:
+      self._shadow[reg] = value
+
   def write(self, reg, value):
-    "Writes an 8-bit value to the specified register/address"
-    self.bus.write_byte_data(self.address, reg, value)
-      
+    "Writes an 8-bit value to the specified register/address (skipped if the shadow already matches)"
+    with self.lock:
+      if self._shadow[reg] == value:
+        self.stats['suppressed'] += 1
+        return
+      self.bus.write_byte_data(self.address, reg, value)
+      self._transaction()
+      self.stats['writes'] += 1
+      self._remember(reg, value)
+
+  def writeBlock(self, reg, data):
+    "Writes a list of bytes starting at the specified register (MODE1 auto-increment must be set)"
+    with self.lock:
+      self.bus.write_i2c_block_data(self.address, reg, data)
+      self._transaction()
+      self.stats['writes'] += len(data)
+      self._shadow[reg:reg+len(data)] = data
+
   def read(self, reg):
-    "Read an unsigned byte from the I2C device"
-    result = self.bus.read_byte_data(self.address, reg)
-    return result
-    
+    "Read an unsigned byte from the I2C device (served from the shadow when we know the value)"
+    with self.lock:
+      result = self._shadow[reg]
+      if result is not None:
+        self.stats['cached_reads'] += 1
+        return result
+      result = self.bus.read_byte_data(self.address, reg)
+      self._transaction()
+      self.stats['reads'] += 1
+      self._remember(reg, result)
+      return result
+
   def setPWMFreq(self, freq):
     "Sets the PWM frequency"
-    prescaleval = 25000000.0    # 25MHz
-    prescaleval /= 4096.0       # 12-bit
-    prescaleval /= float(freq)
-    prescaleval -= 1.0
-    prescale = math.floor(prescaleval + 0.5)
+    with self.lock:
+      prescaleval = 25000000.0    # 25MHz
+      prescaleval /= 4096.0       # 12-bit
+      prescaleval /= float(freq)
+      prescaleval -= 1.0
+      prescale = math.floor(prescaleval + 0.5)
 
+      # Nothing to do (and no need to sleep the oscillator) if the chip is already at this frequency
+      if self._shadow[self.__PRESCALE] == int(prescale):
+        self.stats['suppressed'] += 1
+        return
 
-    oldmode = self.read(self.__MODE1);
-    newmode = (oldmode & 0x7F) | 0x10        # sleep
-    self.write(self.__MODE1, newmode)        # go to sleep
-    self.write(self.__PRESCALE, int(math.floor(prescale)))
-    self.write(self.__MODE1, oldmode)
-    time.sleep(0.005)
-    self.write(self.__MODE1, oldmode | 0x80)
+      oldmode = self.read(self.__MODE1);
+      newmode = (oldmode & 0x7F) | 0x10        # sleep
+      self.write(self.__MODE1, newmode)        # go to sleep
+      self.write(self.__PRESCALE, int(math.floor(prescale)))
+      self.write(self.__MODE1, oldmode)
+      time.sleep(0.005)
+      self.write(self.__MODE1, oldmode | 0x80)
 
   def setPWM(self, channel, on, off):
     "Sets a single PWM channel"
-    self.write(self.__LED0_ON_L+4*channel, on & 0xFF)
-    self.write(self.__LED0_ON_H+4*channel, on >> 8)
-    self.write(self.__LED0_OFF_L+4*channel, off & 0xFF)
-    self.write(self.__LED0_OFF_H+4*channel, off >> 8)
+    self.set_pwm_many({channel: (on, off)})
+
+  def set_pwm_many(self, updates):
+    "Sets several PWM channels ({channel: (on, off)}), adjacent channels share one block write"
+    with self.lock:
+      if self.halted:
+        self.stats['halted'] += 1
+        return
+
+      # Channels the chip already has are dropped
+      changed = {}
+      for channel, (on, off) in updates.items():
+        regs = [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+        reg = self.__LED0_ON_L+4*channel
+        if self._shadow[reg:reg+4] == regs:
+          self.stats['suppressed'] += 4
+        else:
+          changed[channel] = regs
+
+      start = None
+      data = []
+      for channel in sorted(changed):
+        if data:
+          # Rewriting one unchanged channel (known from the shadow) is cheaper than another
+          # transaction, and keeps the whole update latched together on the same I2C STOP
+          end = start + len(data)//4
+          gap = self._shadow[self.__LED0_ON_L+4*end:self.__LED0_ON_L+4*channel]
+          if channel - end <= self.__BRIDGE_CHANNELS and None not in gap and len(data) + len(gap) < self.__BLOCK_MAX:
+            data += gap
+            self.stats['suppressed'] -= 4 * sum(1 for bridged in range(end, channel) if bridged in updates)
+          else:
+            if not self._write_channels(start, data):
+              return
+            data = []
+        if not data:
+          start = channel
+        data += changed[channel]
+      if data:
+        self._write_channels(start, data)
+
+  def _write_channels(self, start, data):
+    "Internal: One block write from channel start, unless all_off() got in first (e.g. from a signal handler mid update)"
+    if self.halted:
+      self.stats['halted'] += 1
+      return False
+    halts = self.halts
+    self.writeBlock(self.__LED0_ON_L+4*start, data)
+    if self.halts != halts:
+      # all_off() ran during the write (a signal handler on this thread), so its stop may have gone
+      # out before our block: stop again, and forget a shadow that can't say which write landed last
+      self.stats['halted'] += 1
+      self.invalidate()
+      self.write(self.__ALLLED_OFF_H, self.__FULL_OFF)
+      return False
+    return True
+
+  def submit(self, updates):
+    "Queues channel updates ({channel: (on, off)}) and flushes, updates from concurrent callers share one batch"
+    with self._pending_lock:
+      self._pending.update(updates)
+      self.stats['submits'] += 1
+    self.flush()
+
+  def flush(self):
+    "Writes every queued channel update in one set_pwm_many() (nothing to do if another caller got there first)"
+    with self.lock:
+      with self._pending_lock:
+        pending, self._pending = self._pending, {}
+      if pending:
+        self.stats['flushes'] += 1
+        self.set_pwm_many(pending)
+
+  def all_off(self, sleep=False):
+    "Emergency stop: every channel fully off in one transaction (ALL_LED_OFF_H), optionally sleeping the oscillator too"
+    with self.lock:
+      self.write(self.__ALLLED_OFF_H, self.__FULL_OFF)
+      # Latched once the write has landed, updates queued behind us on the lock are dropped (see resume())
+      self.halted = True
+      self.halts += 1
+      if sleep:
+        mode = self._shadow[self.__MODE1]
+        self.write(self.__MODE1, (self.__MODE1_AI if mode is None else mode) | self.__MODE1_SLEEP)
+
+  def resume(self):
+    "Accept channel updates again after all_off() (waking the oscillator if it was put to sleep)"
+    with self.lock:
+      mode = self.read(self.__MODE1)
+      if mode & self.__MODE1_SLEEP:
+        self.write(self.__MODE1, mode & ~self.__MODE1_SLEEP)
+        time.sleep(0.0005)                 # Oscillator start up
+        self.write(self.__MODE1, (mode & ~self.__MODE1_SLEEP) | self.__MODE1_RESTART)
+      self.halted = False
+
   def setMotorPwm(self,channel,duty):
     self.setPWM(channel,0,duty)
   def setServoPulse(self, channel, pulse):
@@ -70,7 +264,57 @@ class PCA9685:
     pulse = pulse*4096/20000        #PWM frequency is 50HZ,the period is 20000us
     self.setPWM(channel, 0, int(pulse))
 
+def test():
+  "Test for the shared driver: threads driving the same chip never interleave or tear a wheel's channels"
+  from robot_kit.bus import SimulatedBus
+  from robot_kit.wheels import Wheels
+
+  class CheckingBus(SimulatedBus):
+    "Fails if two transactions overlap or a wheel is ever driven both ways at once"
+    busy = False
+    def write_i2c_block_data(self, address, reg, data):
+      assert not self.busy, 'Overlapping bus transactions'
+      self.busy = True
+      super().write_i2c_block_data(address, reg, data)
+      registers = self.registers(address)
+      for reverse, forward in [(1, 0), (2, 3), (7, 6), (5, 4)]:
+        assert not (registers[0x08+4*reverse:0x0A+4*reverse] != b'\x00\x00' and
+                    registers[0x08+4*forward:0x0A+4*forward] != b'\x00\x00'), 'Torn wheel update'
+      time.sleep(0.0001)   # Widen the window for the other threads
+      self.busy = False
+
+  bus = CheckingBus()
+  wheels = [Wheels(bus=bus) for _ in range(4)]
+  assert all(w.pwm is wheels[0].pwm for w in wheels) and bus.stats['transactions'] == 5  # One chip setup
+
+  def drive(w, sign):
+    for i in range(200):
+      w.all(sign * (i % 10 + 1) / 10)
+  threads = [threading.Thread(target=drive, args=(w, 1 if i % 2 else -1)) for i, w in enumerate(wheels)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  stats = wheels[0].pwm.stats
+  print('{:d} submits in {:d} flushes'.format(stats['submits'], stats['flushes']))
+  assert stats['flushes'] <= stats['submits']
+  wheels[0].stop()
+  assert not any(bus.registers(0x40)[0x06:0x26])
+
+  # An all_off() in the middle of an update (e.g. a signal handler on this thread) drops the rest of it
+  class StoppingBus(SimulatedBus):
+    def write_i2c_block_data(self, address, reg, data):
+      super().write_i2c_block_data(address, reg, data)
+      if not pwm.halted:
+        pwm.all_off()
+  bus = StoppingBus()
+  pwm = PCA9685(bus=bus)
+  pwm.set_pwm_many({0: (0, 2000), 15: (0, 2000)})   # Too far apart to share a block write
+  assert pwm.halted and pwm.stats['halted'] == 1 and bus.registers(0x40)[0x06+4*15+2] == 0
+
 if __name__=='__main__':
-    pass
+
+  # Run the test
+  test()
     
       
@@ -0,0 +1,199 @@
+"""Asyncio versions of the robot_kit classes (blocking I/O runs on one worker thread per bus)"""
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# One single worker executor per bus/device, so transactions on a bus never interleave
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def bus_executor(bus):
+    """Return the (single worker) executor that owns all I/O for this bus/device object"""
+    with _executors_lock:
+        if bus not in _executors:
+            _executors[bus] = ThreadPoolExecutor(max_workers=1, thread_name_prefix='robot_kit_bus')
+        return _executors[bus]
+
+
+def shutdown_executors():
+    """Shutdown all of the bus executors (waiting for queued I/O to finish)"""
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=True)
+        _executors.clear()
+
+
+class _AsyncDevice:
+    """Internal: Base class that runs the wrapped device's methods on its bus executor"""
+    def __init__(self, device, bus):
+        self.device = device
+        self.executor = bus_executor(bus)
+
+    async def _run(self, method, *args):
+        """Internal: Run a blocking method on the bus executor and await the result"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, method, *args)
+
+
+class AsyncWheels(_AsyncDevice):
+    """Awaitable Wheels
+       Usage:
+            wheels = AsyncWheels(Wheels())
+            await wheels.all(0.5)
+            await wheels.stop()
+    """
+    def __init__(self, wheels):
+        """AsyncWheels Initialization"""
+        super().__init__(wheels, wheels.pwm.bus)
+
+    async def all(self, speed):
+        await self._run(self.device.all, speed)
+
+    async def stop(self):
+        await self._run(self.device.stop)
+
+    async def set_speeds(self, speeds):
+        await self._run(self.device.set_speeds, speeds)
+
+
+class AsyncVehicle(_AsyncDevice):
+    """Awaitable Vehicle maneuvers
+       Usage:
+            vehicle = AsyncVehicle(Vehicle())
+            await vehicle.forward(0.5)
+            await asyncio.sleep(1.0)
+            await vehicle.stop()
+    """
+    def __init__(self, vehicle):
+        """AsyncVehicle Initialization"""
+        super().__init__(vehicle, vehicle.wheels.pwm.bus)
+        self.wheels = AsyncWheels(vehicle.wheels)
+
+    async def drive(self, linear, angular, lateral=0.0):
+        await self._run(self.device.drive, linear, angular, lateral)
+
+    async def forward(self, speed):
+        await self._run(self.device.forward, speed)
+
+    async def backward(self, speed):
+        await self._run(self.device.backward, speed)
+
+    async def stop(self):
+        await self._run(self.device.stop)
+
+    async def turn_left(self, speed):
+        await self._run(self.device.turn_left, speed)
+
+    async def turn_right(self, speed):
+        await self._run(self.device.turn_right, speed)
+
+
+class AsyncUltrasonic(_AsyncDevice):
+    """Awaitable ultrasonic ranging
+       Usage:
+            sensor = AsyncUltrasonic(Ultrasonic())
+            distance = await sensor.get_distance()
+            async for timestamp, distance in sensor.stream(20):
+                ...
+    """
+    def __init__(self, ultrasonic):
+        """AsyncUltrasonic Initialization"""
+        super().__init__(ultrasonic, ultrasonic.gpio)
+
+    async def get_distance(self):
+        return await self._run(self.device.get_distance)
+
+    async def read_once(self):
+        return await self._run(self.device.read_once)
+
+    async def stream(self, rate_hz=20, filters=None, count=None):
+        """Async generator of (perf_counter_ns timestamp, distance) readings at a fixed rate
+           (same arguments as Ultrasonic.stream)
+        """
+        period = 1.0 / rate_hz
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        readings = 0
+        while count is None or readings < count:
+            timestamp = time.perf_counter_ns()
+            distance = await self.read_once()
+            if filters is not None:
+                distance = filters(distance)
+            yield timestamp, self.device.timeout_distance if distance is None else distance
+            readings += 1
+
+            # Sleep until the next deadline (skipping any the consumer made us miss)
+            deadline += period
+            now = loop.time()
+            if deadline > now:
+                await asyncio.sleep(deadline - now)
+            else:
+                deadline = now
+
+
+class AsyncNeoPixelStrip(_AsyncDevice):
+    """Awaitable NeoPixelStrip
+       Usage:
+            leds = AsyncNeoPixelStrip(NeoPixelStrip())
+            await leds.on(0, 255, 0)
+            await leds.off()
+    """
+    def __init__(self, strip):
+        """AsyncNeoPixelStrip Initialization"""
+        super().__init__(strip, strip.strip)
+
+    def get_rgb(self):
+        return self.device.get_rgb()
+
+    async def on(self, red, green, blue):
+        await self._run(self.device.on, red, green, blue)
+
+    async def off(self):
+        await self._run(self.device.off)
+
+
+def test():
+    """Test for the asyncio layer: sense and drive at independent rates on simulated hardware"""
+    from robot_kit.bus import SimulatedBus
+    from robot_kit.gpio import FakeGPIO
+    from robot_kit.vehicle import Vehicle
+    from robot_kit.ultrasonic import Ultrasonic
+    from robot_kit.filters import MedianFilter
+
+    gpio = FakeGPIO()
+    gpio.attach_sensor(27, 22, distance=60.0)
+    bus = SimulatedBus(realtime=True)
+    vehicle = AsyncVehicle(Vehicle(bus=bus))
+    sensor = AsyncUltrasonic(Ultrasonic(gpio=gpio))
+
+    async def sense(readings):
+        async for timestamp, distance in sensor.stream(rate_hz=20, filters=MedianFilter(3), count=10):
+            readings.append(distance)
+
+    async def drive(commands):
+        for speed in [0.3, 0.5, 0.7, 0.5, 0.3]:
+            await vehicle.forward(speed)
+            commands.append(speed)
+            await asyncio.sleep(0.1)
+        await vehicle.stop()
+
+    async def main():
+        readings, commands = [], []
+        start = time.perf_counter()
+        await asyncio.gather(sense(readings), drive(commands))
+        return readings, commands, time.perf_counter() - start
+
+    readings, commands, elapsed = asyncio.run(main())
+    print('{:d} readings and {:d} drive commands concurrently in {:.2f}s'.format(len(readings), len(commands), elapsed))
+    assert len(readings) == 10 and len(commands) == 5
+    assert all(abs(distance - 60.0) < 5.0 for distance in readings)
+    assert elapsed < 0.75  # Sequentially this would be at least 1.0s
+    shutdown_executors()
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
@@ -0,0 +1,239 @@
+"""Frame buffered LED animations for the NeoPixelStrip, rendered at a fixed frame rate"""
+import time
+import math
+import threading
+
+
+class Solid:
+    """Every pixel one color"""
+    def __init__(self, rgb):
+        self.rgb = bytes(rgb)
+
+    def render(self, frame, start, count, t):
+        frame[3*start:3*(start+count)] = self.rgb * count
+
+
+class Fade:
+    """Fade from one color to another over duration seconds (then hold)"""
+    def __init__(self, from_rgb, to_rgb, duration=1.0):
+        if duration <= 0:
+            raise ValueError('Fade duration must be positive')
+        self.from_rgb = from_rgb
+        self.to_rgb = to_rgb
+        self.duration = duration
+
+    def render(self, frame, start, count, t):
+        fraction = min(t / self.duration, 1.0)
+        rgb = bytes(int(a + (b - a) * fraction) for a, b in zip(self.from_rgb, self.to_rgb))
+        for pixel in range(start, start + count):
+            frame[3*pixel:3*pixel+3] = rgb
+
+
+class Chase:
+    """A block of width pixels running along the strip at speed pixels per second"""
+    def __init__(self, rgb, width=2, speed=8.0, background=(0, 0, 0)):
+        self.rgb = bytes(rgb)
+        self.width = width
+        self.speed = speed
+        self.background = bytes(background)
+
+    def render(self, frame, start, count, t):
+        head = int(t * self.speed) % count
+        for offset in range(count):
+            lit = (offset - head) % count < self.width
+            frame[3*(start+offset):3*(start+offset)+3] = self.rgb if lit else self.background
+
+
+class Pulse:
+    """Breathe a color in and out with the given period (seconds)"""
+    def __init__(self, rgb, period=2.0):
+        if period <= 0:
+            raise ValueError('Pulse period must be positive')
+        self.rgb = rgb
+        self.period = period
+
+    def render(self, frame, start, count, t):
+        level = 0.5 - 0.5 * math.cos(2 * math.pi * t / self.period)
+        rgb = bytes(int(value * level) for value in self.rgb)
+        for pixel in range(start, start + count):
+            frame[3*pixel:3*pixel+3] = rgb
+
+
+class Status:
+    """A repeating blink pattern of (rgb, seconds) steps, e.g. Status.ERROR"""
+    OK = [((0, 255, 0), 1.0)]
+    BUSY = [((0, 0, 255), 0.25), ((0, 0, 0), 0.25)]
+    WARNING = [((255, 128, 0), 0.5), ((0, 0, 0), 0.5)]
+    ERROR = [((255, 0, 0), 0.1), ((0, 0, 0), 0.1), ((255, 0, 0), 0.1), ((0, 0, 0), 0.7)]
+
+    def __init__(self, pattern):
+        self.pattern = [(bytes(rgb), seconds) for rgb, seconds in pattern]
+        self.period = sum(seconds for _, seconds in pattern)
+        if self.period <= 0:
+            raise ValueError('Status pattern must take some time')
+
+    def render(self, frame, start, count, t):
+        t %= self.period
+        for rgb, seconds in self.pattern:
+            if t < seconds:
+                break
+            t -= seconds
+        for pixel in range(start, start + count):
+            frame[3*pixel:3*pixel+3] = rgb
+
+
+class Animator:
+    """Renders effects into a frame buffer at a fixed frame rate and only refreshes the strip on change
+       Usage:
+            animator = Animator(NeoPixelStrip(), fps=30)
+            animator.play(Chase((0, 0, 255), width=2))  # Whole strip
+            animator.play(Status(Status.ERROR), start=0, count=2)  # Just the first two pixels
+            animator.start()
+            ...
+            animator.stats()  # Achieved fps, frames rendered, strip refreshes and dropped frames
+            animator.stop()
+
+       Effects are any object with render(frame, start, count, t) that write R, G, B bytes for
+       pixels start..start+count-1 into the frame bytearray (t is seconds since play()).
+       Strip refreshes take the NeoPixelStrip lock, so they don't interleave with a LedWorker blink.
+    """
+    def __init__(self, strip, fps=30):
+        """Animator Initialization"""
+        self.strip = strip
+        self.fps = fps
+        self.num_leds = strip.num_leds
+        self.frame = bytearray(3 * self.num_leds)
+        self.shown = bytearray(3 * self.num_leds)
+        self._blank = bytes(3 * self.num_leds)
+        self.layers = []
+        self.counts = {'frames': 0, 'shows': 0, 'dropped': 0}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._started_ns = 0
+        self._first_show = True
+
+    def play(self, effect, start=0, count=None):
+        """Play an effect on a range of pixels (replacing whatever effect covered exactly that range)"""
+        count = self.num_leds - start if count is None else count
+        if count <= 0 or start < 0 or start + count > self.num_leds:
+            raise ValueError('Pixels {:d} to {:d} are not on a {:d} LED strip'.format(start, start + count - 1, self.num_leds))
+        with self._lock:
+            self.layers = [layer for layer in self.layers if layer[1:3] != [start, count]]
+            self.layers.append([effect, start, count, time.perf_counter_ns()])
+
+    def clear(self):
+        """Remove all of the effects (the strip goes dark on the next frame)"""
+        with self._lock:
+            self.layers = []
+
+    def render(self):
+        """Render and (if it changed) show one frame, returns True if the strip was refreshed"""
+        now = time.perf_counter_ns()
+        with self._lock:
+            self.frame[:] = self._blank
+            for effect, start, count, started in self.layers:
+                effect.render(self.frame, start, count, (now - started) / 1e9)
+        self.counts['frames'] += 1
+        if self.frame == self.shown and not self._first_show:
+            return False
+        self.shown[:] = self.frame
+        self._first_show = False
+        self.strip.show_frame(self.shown)
+        self.counts['shows'] += 1
+        return True
+
+    def start(self):
+        """Render frames on a background thread"""
+        self._stop_event.clear()
+        self._started_ns = time.perf_counter_ns()
+        self.counts = {'frames': 0, 'shows': 0, 'dropped': 0}
+        self._thread = threading.Thread(target=self._run, name='robot_kit_animation', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the animation thread (the strip keeps the last frame)"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        """Dictionary of the achieved frame rate and the frame counters"""
+        elapsed = (time.perf_counter_ns() - self._started_ns) / 1e9 if self._started_ns else 0.0
+        stats = dict(self.counts)
+        stats['fps'] = self.counts['frames'] / elapsed if elapsed else 0.0
+        return stats
+
+    def _run(self):
+        """Internal: Frame thread, renders on absolute deadlines and counts the frames it had to skip"""
+        period_ns = int(1e9 / self.fps)
+        deadline = time.perf_counter_ns()
+        while not self._stop_event.is_set():
+            self.render()
+            deadline += period_ns
+            now = time.perf_counter_ns()
+            if deadline < now:
+                dropped = (now - deadline) // period_ns + 1
+                self.counts['dropped'] += dropped
+                deadline += dropped * period_ns
+            self._stop_event.wait((deadline - now) / 1e9)
+
+
+def test():
+    """Test for the Animator class (on the simulated strip)"""
+    from robot_kit import hw
+    previous = hw.backend()
+    hw.use('sim')
+    try:
+        _test()
+    finally:
+        hw.use(previous)
+
+
+def _test():
+    """Internal: The Animator test, on whatever backend is in use"""
+    from robot_kit.leds import NeoPixelStrip
+
+    animator = Animator(NeoPixelStrip(), fps=50)
+
+    # A solid color only refreshes the strip once
+    animator.play(Solid((0, 255, 0)))
+    animator.start()
+    time.sleep(0.5)
+    stats = animator.stats()
+    print('Solid: {:.1f} fps, {:d} frames {:d} shows {:d} dropped'.format(stats['fps'], stats['frames'], stats['shows'], stats['dropped']))
+    assert stats['shows'] == 1 and stats['frames'] > 20
+
+    # Moving effects refresh when they change
+    animator.play(Chase((0, 0, 255), width=2, speed=16.0))
+    animator.play(Status(Status.ERROR), start=0, count=1)
+    time.sleep(1.0)
+    animator.stop()
+    stats = animator.stats()
+    print('Chase: {:.1f} fps, {:d} frames {:d} shows {:d} dropped'.format(stats['fps'], stats['frames'], stats['shows'], stats['dropped']))
+    assert 1 < stats['shows'] < stats['frames']
+
+    # Fade and pulse by hand
+    for effect in [Fade((128, 0, 0), (0, 128, 128), duration=0.2), Pulse((255, 255, 255), period=0.2)]:
+        animator.clear()
+        animator.play(effect)
+        for _ in range(10):
+            animator.render()
+            time.sleep(0.02)
+    animator.strip.off()
+
+    # Arguments that would divide by zero
+    for bad in [lambda: Fade((0, 0, 0), (255, 0, 0), duration=0), lambda: Pulse((255, 0, 0), period=0),
+                lambda: animator.play(Chase((0, 0, 255)), start=0, count=0)]:
+        try:
+            bad()
+            assert False, 'Expected a ValueError'
+        except ValueError:
+            pass
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
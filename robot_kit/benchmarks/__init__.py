@@ -0,0 +1,63 @@
+"""Benchmarks for robot_kit (they run on the simulated backends from robot_kit.hw)
+
+   Usage:
+        python -m robot_kit.benchmarks --output results.json
+        python -m robot_kit.benchmarks --baseline results.json  # Exits 1 if anything regressed
+
+   Note: Each suite runs several times and every metric is the median of the runs. Counted (or
+         modeled) metrics are gated at the tolerance, wall clock ones at the looser wall_clock_tolerance.
+"""
+import statistics
+import importlib
+
+SUITES = ['drive', 'sensing', 'leds', 'scanning', 'mapping', 'multiproc', 'import_time']
+INFORMATIONAL = ('.dropped', '.timeouts', '.max_us', '.jitter_us')  # Too timing dependent to gate on
+COUNTED = ('.transactions', '.bytes', '.bus_us', '.shows')  # The same every run (bus_us is the bus model's time)
+
+
+def run(suites=None, repeat=3):
+    """Run the benchmark suites repeat times, returns {suite: {metric: median value}}
+       Note: Suites that need NumPy (scanning and mapping) are skipped if it's not installed
+    """
+    results = {}
+    for suite in suites or SUITES:
+        try:
+            module = importlib.import_module('robot_kit.benchmarks.' + suite)
+        except ImportError as error:
+            if error.name != 'numpy':
+                raise
+            print('NumPy not installed, skipping the {:s} benchmarks'.format(suite))
+            continue
+        runs = [module.run() for _ in range(repeat)]
+        results[suite] = {metric: statistics.median(result[metric] for result in runs) for metric in runs[0]}
+    return results
+
+
+def higher_is_better(metric):
+    """Rates are better higher, everything else (times, transactions, bytes) lower"""
+    return metric.endswith('_per_s') or metric.endswith('.fps')
+
+
+def compare(results, baseline, tolerance=0.2, wall_clock_tolerance=0.5):
+    """Compare results against a baseline (both {suite: {metric: value}})
+    Args:
+           tolerance: fraction a counted metric (see COUNTED) may get worse by before it counts as a regression
+           wall_clock_tolerance: the same for the timed metrics (times and rates), which are noisier
+    Returns:
+           list of (suite.metric, baseline value, value, change) for every regression
+    """
+    regressions = []
+    for suite, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(suite, {}).get(metric)
+            if old is None or old <= 0 or metric.endswith(INFORMATIONAL):
+                continue  # A zero baseline (e.g. an import too quick to measure) has no fraction to compare
+            allowed = tolerance if metric.endswith(COUNTED) else max(tolerance, wall_clock_tolerance)
+            if higher_is_better(metric):
+                worse = value < old * (1 - allowed)
+            else:
+                worse = value > old * (1 + allowed)
+            if worse:
+                change = (value - old) / old
+                regressions.append(('{:s}.{:s}'.format(suite, metric), old, value, change))
+    return regressions
@@ -0,0 +1,45 @@
+"""Run the robot_kit benchmarks, save the results as JSON and compare them against a baseline"""
+import sys
+import json
+import time
+import platform
+import argparse
+from robot_kit import hw
+from robot_kit.benchmarks import SUITES, run, compare
+
+
+def main():
+    parser = argparse.ArgumentParser(description='robot_kit benchmarks (on simulated hardware)')
+    parser.add_argument('--suites', default=','.join(SUITES), help='Comma separated suites to run')
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against the results in this JSON file')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per suite, each metric is the median (default 3)')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed fractional regression of the counted metrics (default 0.2)')
+    parser.add_argument('--wall-clock-tolerance', type=float, default=0.5,
+                        help='Allowed fractional regression of the timed metrics (default 0.5)')
+    args = parser.parse_args()
+
+    hw.use('sim')
+    results = run(args.suites.split(','), args.repeat)
+    report = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'machine': platform.machine(), 'results': results}
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)['results']
+        regressions = compare(results, baseline, args.tolerance, args.wall_clock_tolerance)
+        for metric, old, new, change in regressions:
+            print('REGRESSION {:s}: {:.3f} -> {:.3f} ({:+.0%})'.format(metric, old, new, change))
+        if regressions:
+            return 1
+        print('No regressions against {:s}'.format(args.baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""Benchmark: bus transactions, bytes, modeled bus time and wall time per Vehicle maneuver"""
+import json
+import time
+from robot_kit.bus import SimulatedBus
+from robot_kit.vehicle import Vehicle
+
+# Each maneuver is timed starting from a stopped vehicle (stop is timed from full speed forward)
+MANEUVERS = {
+    'forward': lambda vehicle: vehicle.forward(0.5),
+    'backward': lambda vehicle: vehicle.backward(0.5),
+    'turn_left': lambda vehicle: vehicle.turn_left(0.5),
+    'turn_right': lambda vehicle: vehicle.turn_right(0.5),
+    'arc': lambda vehicle: vehicle.drive(0.6, 0.2),
+    'stop': lambda vehicle: vehicle.stop(),
+}
+
+
+def run(repeat=200):
+    """Per maneuver transactions, bytes and bus time (on a 100kHz bus) plus best wall time (us)"""
+    bus = SimulatedBus()
+    vehicle = Vehicle(bus=bus)
+    results = {}
+    for name, maneuver in MANEUVERS.items():
+        wall = []
+        for _ in range(repeat):
+            if name == 'stop':
+                vehicle.forward(1.0)
+            else:
+                vehicle.stop()
+            bus.reset_stats()
+            start = time.perf_counter_ns()
+            maneuver(vehicle)
+            wall.append(time.perf_counter_ns() - start)
+        results[name + '.transactions'] = bus.stats['transactions']
+        results[name + '.bytes'] = bus.stats['bytes']
+        results[name + '.bus_us'] = bus.stats['bus_time'] * 1e6
+        results[name + '.wall_us'] = min(wall) / 1000
+
+    # A maneuver repeated with the same speed should cost nothing on the bus
+    vehicle.forward(0.5)
+    bus.reset_stats()
+    vehicle.forward(0.5)
+    results['repeat.transactions'] = bus.stats['transactions']
+    vehicle.stop()
+    return results
+
+
+if __name__ == '__main__':
+
+    # Run the benchmark
+    print(json.dumps(run(), indent=4))
@@ -0,0 +1,34 @@
+"""Benchmark: startup cost of importing the robot_kit modules in a fresh interpreter"""
+import sys
+import json
+import time
+import statistics
+import subprocess
+
+MODULES = ['robot_kit', 'robot_kit.PCA9685', 'robot_kit.wheels', 'robot_kit.vehicle',
+           'robot_kit.ultrasonic', 'robot_kit.leds', 'robot_kit.aio']
+
+
+def import_seconds(statement, repeat):
+    """Median wall time (seconds) of running a python -c statement in a fresh interpreter"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def run(repeat=5):
+    """Import time (ms, over a bare interpreter start) for each module (never below 0, it's a difference of noisy times)"""
+    baseline = import_seconds('pass', repeat)
+    results = {'interpreter_ms': baseline * 1000}
+    for module in MODULES:
+        results[module] = max(import_seconds('import ' + module, repeat) - baseline, 0.0) * 1000
+    return results
+
+
+if __name__ == '__main__':
+
+    # Run the benchmark
+    print(json.dumps(run(), indent=4))
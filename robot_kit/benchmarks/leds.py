@@ -0,0 +1,63 @@
+"""Benchmark: LED strip refresh cost and Animator frame rate on the simulated NeoPixel strip"""
+import json
+import time
+from robot_kit import hw
+from robot_kit.animation import Animator, Chase, Solid
+
+
+def best_us(function, count=200, rounds=5):
+    """Best (over rounds) average time per call (us) of count calls to function(i)"""
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter_ns()
+        for i in range(count):
+            function(i)
+        elapsed = (time.perf_counter_ns() - start) / count / 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(duration=1.0, fps=30):
+    """Per call cost of on()/show_frame()/render() (us) and the achieved Animator frame rate"""
+    hw.use('sim')
+    from robot_kit.leds import NeoPixelStrip
+    strip = NeoPixelStrip()
+    results = {}
+
+    # Strip calls (on() alternates colors, so every call refreshes the strip)
+    results['on.us'] = best_us(lambda i: strip.on(255 * (i & 1), 0, 0))
+    frame = bytearray(3 * strip.num_leds)
+
+    def show(i):
+        frame[0] = i & 0xFF
+        strip.show_frame(frame)
+    results['show_frame.us'] = best_us(show)
+
+    # Rendering a moving effect, flat out
+    animator = Animator(strip, fps=fps)
+    animator.play(Chase((0, 0, 255), width=2, speed=16.0))
+    results['render.us'] = best_us(lambda i: animator.render())
+
+    # The frame thread
+    animator.start()
+    time.sleep(duration)
+    animator.stop()
+    stats = animator.stats()
+    results['animator.fps'] = stats['fps']
+    results['animator.dropped'] = stats['dropped']
+
+    # A static effect shouldn't refresh the strip again
+    animator.play(Solid((0, 255, 0)))
+    animator.render()
+    shows = animator.counts['shows']
+    for _ in range(100):
+        animator.render()
+    results['static.shows'] = animator.counts['shows'] - shows
+    strip.off()
+    return results
+
+
+if __name__ == '__main__':
+
+    # Run the benchmark
+    print(json.dumps(run(), indent=4))
@@ -0,0 +1,46 @@
+"""Benchmark: occupancy grid updates and queries at several grid sizes"""
+import json
+import time
+import numpy as np
+from robot_kit.mapping import OccupancyGrid
+
+SIZES = [100, 200, 400]  # Cells per side (5cm cells, so 5m, 10m and 20m windows)
+ANGLES = np.arange(30.0, 151.0, 5.0)  # One Scanner sweep
+
+
+def run(duration=0.5):
+    """Readings per second integrated (one sweep per batch), plus recenter and free space query times (us)"""
+    rng = np.random.default_rng(0)
+    distances = rng.uniform(20.0, 300.0, len(ANGLES))
+    distances[::6] = np.nan  # Some sweeps see nothing
+    headings = np.radians(np.arange(-90.0, 91.0, 10.0))
+    results = {}
+    for size in SIZES:
+        grid = OccupancyGrid(size=size, resolution=5.0)
+        name = 'grid_{:d}'.format(size)
+
+        readings = 0
+        pose = 0.0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            grid.integrate_scan((pose, 0.0, pose / 100.0), ANGLES, distances)
+            readings += len(ANGLES)
+            pose += 1.0
+        results[name + '.readings_per_s'] = readings / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for step in range(100):
+            grid.recenter(step * 10.0, 0.0)
+        results[name + '.recenter_us'] = (time.perf_counter() - start) / 100 * 1e6
+
+        start = time.perf_counter()
+        for _ in range(100):
+            grid.free_distance(0.0, 0.0, headings, width=20.0)
+        results[name + '.free_distance_us'] = (time.perf_counter() - start) / 100 * 1e6
+    return results
+
+
+if __name__ == '__main__':
+
+    # Run the benchmark
+    print(json.dumps(run(), indent=4))
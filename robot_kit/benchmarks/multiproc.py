@@ -0,0 +1,119 @@
+"""Benchmark: drive command jitter with the ultrasonic and LED load in one process vs the multiprocess Runtime"""
+import json
+import time
+import threading
+from robot_kit import hw
+from robot_kit.bus import SimulatedBus
+from robot_kit.gpio import FakeGPIO
+from robot_kit.histogram import LatencyHistogram
+from robot_kit.leds import NeoPixelStrip
+from robot_kit.multiproc import Runtime
+from robot_kit.ultrasonic import Ultrasonic
+from robot_kit.vehicle import Vehicle
+
+RATE_HZ = 50  # Drive commands
+SENSOR_HZ = 50  # Busy wait pings (100cm, so ~6ms of spinning each)
+LED_HZ = 100  # LED updates
+
+
+def _realtime_bus():
+    """Worker setup: the simulated bus spends its modeled time, like the real one"""
+    hw.register('bus', 'sim', lambda bus_number: SimulatedBus(realtime=True))
+
+
+def _summary(name, latency, missed):
+    """Internal: Latency percentiles (us) and the jitter (p99 - p50)"""
+    summary = latency.summary()
+    return {name + '.p50_us': summary['p50'] / 1000, name + '.p99_us': summary['p99'] / 1000,
+            name + '.max_us': summary['max'] / 1000, name + '.jitter_us': (summary['p99'] - summary['p50']) / 1000,
+            name + '.dropped': missed}
+
+
+def _ticks(duration):
+    """Internal: Absolute RATE_HZ deadlines (perf_counter_ns) for duration seconds, sleeping until each one"""
+    period = int(1e9 / RATE_HZ)
+    deadline = time.perf_counter_ns() + period
+    end = deadline + int(duration * 1e9)
+    while deadline < end:
+        now = time.perf_counter_ns()
+        if deadline > now:
+            time.sleep((deadline - now) / 1e9)
+        yield deadline
+        deadline += period
+
+
+def single(duration):
+    """End to end latency (scheduled tick to wheels written) with everything sharing one GIL"""
+    gpio = FakeGPIO()
+    gpio.attach_sensor(27, 22, distance=100.0)
+    sensor = Ultrasonic(gpio=gpio)
+    vehicle = Vehicle(bus=SimulatedBus(realtime=True))
+    strip = NeoPixelStrip()
+    stop = threading.Event()
+
+    def ranging():
+        for reading in sensor.stream(SENSOR_HZ):
+            if stop.is_set():
+                return
+
+    def leds():
+        while not stop.wait(1 / LED_HZ):
+            strip.on(0, int(time.monotonic() * 1000) % 256, 0)
+    threads = [threading.Thread(target=ranging), threading.Thread(target=leds)]
+    for thread in threads:
+        thread.start()
+
+    latency = LatencyHistogram()
+    for tick, deadline in enumerate(_ticks(duration)):
+        vehicle.drive(0.5, 0.1 if tick % 2 else -0.1)
+        latency.record(time.perf_counter_ns() - deadline)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    vehicle.stop()
+    return _summary('single', latency, 0)
+
+
+def multi(duration):
+    """End to end latency (scheduled tick to wheels written by the wheels worker) with the Runtime"""
+    runtime = Runtime(setup=_realtime_bus, options={'ultrasonic': {'rate_hz': SENSOR_HZ}})
+    runtime.start()
+    time.sleep(0.5)  # Let the workers start up
+    stop = threading.Event()
+
+    def leds():
+        while not stop.wait(1 / LED_HZ):
+            runtime.leds(0, int(time.monotonic() * 1000) % 256, 0)
+    thread = threading.Thread(target=leds)
+    thread.start()
+
+    latency = LatencyHistogram()
+    sent = None
+    missed = 0
+    for tick, deadline in enumerate(_ticks(duration)):
+        if sent is not None:
+            sequence, (command, applied) = runtime.slots.applied.read()
+            if command == sent[0]:
+                latency.record(applied - sent[1])
+            else:
+                missed += 1
+        runtime.drive(0.5, 0.1 if tick % 2 else -0.1)
+        sent = (runtime.slots.drive.read()[1][0], deadline)
+    stop.set()
+    thread.join()
+    runtime.shutdown()
+    return _summary('multi', latency, missed)
+
+
+def run(duration=2.0):
+    """Drive latency and jitter (us) at RATE_HZ under the same sensor and LED load, both ways"""
+    hw.use('sim')
+    results = single(duration)
+    results.update(multi(duration))
+    return results
+
+
+if __name__ == '__main__':
+
+    # Run the benchmark
+    print(json.dumps(run(), indent=4))
@@ -0,0 +1,50 @@
+"""Benchmark: servo swept ultrasonic scanning, pipelined Scanner vs a naive move, wait, get_distance() loop"""
+import json
+import time
+from robot_kit.bus import SimulatedBus
+from robot_kit.gpio import FakeGPIO
+from robot_kit.PCA9685 import PCA9685
+from robot_kit.ultrasonic import Ultrasonic
+from robot_kit.scanner import Scanner, SimulatedServo, angle_to_pulse
+
+STEP = 5.0  # degrees, 25 angles from 30 to 150
+DISTANCE = 80.0  # cm, a 4.7ms echo
+NAIVE_WAIT = 0.1  # seconds, the usual 'give the servo time to get there' sleep
+
+
+def run(sweeps=3):
+    """Sweeps per second (and pings per second) at STEP degrees for the Scanner and the naive loop"""
+    bus = SimulatedBus()
+    servo = SimulatedServo(bus)
+    gpio = FakeGPIO()
+    gpio.attach_sensor(27, 22, distance=DISTANCE)
+    sensor = Ultrasonic(gpio=gpio)
+    scanner = Scanner(PCA9685.shared(bus=bus), sensor, start=30, stop=150, step=STEP, degrees_per_second=servo.degrees_per_second)
+    results = {}
+
+    # Pipelined
+    scanner.sweep()  # Get the servo to the start of the sweep
+    start = time.perf_counter()
+    for timestamp, distances in scanner.sweeps(sweeps):
+        pass
+    elapsed = time.perf_counter() - start
+    results['pipelined.sweeps_per_s'] = sweeps / elapsed
+    results['pipelined.pings_per_s'] = sweeps * len(scanner.angles) / elapsed
+    results['pipelined.timeouts'] = scanner.stats['timeouts']
+    scanner.close()
+
+    # Naive, one sweep is plenty
+    start = time.perf_counter()
+    for angle in scanner.angles:
+        scanner.pwm.setServoPulse(scanner.channel, angle_to_pulse(angle))
+        time.sleep(NAIVE_WAIT)
+        sensor.get_distance()
+    elapsed = time.perf_counter() - start
+    results['naive.sweeps_per_s'] = 1 / elapsed
+    return results
+
+
+if __name__ == '__main__':
+
+    # Run the benchmark
+    print(json.dumps(run(), indent=4))
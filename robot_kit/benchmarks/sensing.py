@@ -0,0 +1,46 @@
+"""Benchmark: ultrasonic reading throughput and CPU cost, polled and edge driven"""
+import json
+import time
+from robot_kit.gpio import FakeGPIO
+from robot_kit.ultrasonic import Ultrasonic, UltrasonicRanger
+
+DISTANCE = 50.0  # cm, a 2.9ms echo
+
+
+def run(duration=1.0):
+    """Readings per second and CPU time per reading (us) for read_once() polling and the UltrasonicRanger
+       Note: CPU time is for the whole process, so it includes the FakeGPIO scheduler thread
+    """
+    gpio = FakeGPIO()
+    gpio.attach_sensor(27, 22, distance=DISTANCE)
+    sensor = Ultrasonic(gpio=gpio)
+    results = {}
+
+    # Polling, back to back
+    readings = 0
+    cpu = time.process_time()
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        sensor.read_once()
+        readings += 1
+    elapsed = time.perf_counter() - start
+    results['poll.readings_per_s'] = readings / elapsed
+    results['poll.cpu_us_per_reading'] = (time.process_time() - cpu) / readings * 1e6
+
+    # Edge driven at 20Hz (CPU is what matters here, the rate is fixed)
+    ranger = UltrasonicRanger(sensor, rate_hz=20)
+    cpu = time.process_time()
+    ranger.start()
+    time.sleep(duration)
+    ranger.stop()
+    readings = max(ranger.stats['readings'], 1)
+    results['ranger.readings_per_s'] = ranger.stats['readings'] / duration
+    results['ranger.cpu_us_per_reading'] = (time.process_time() - cpu) / readings * 1e6
+    results['ranger.timeouts'] = ranger.stats['timeouts']
+    return results
+
+
+if __name__ == '__main__':
+
+    # Run the benchmark
+    print(json.dumps(run(), indent=4))
@@ -0,0 +1,269 @@
+"""I2C bus backends: the real SMBus, a simulated PCA9685 and a recording/replay pair"""
+import time
+import json
+
+
+class SMBusBackend:
+    """The real I2C bus (a thin wrapper around smbus.SMBus)
+       Usage:
+            bus = SMBusBackend(1)
+            pwm = PCA9685(0x40, bus=bus)
+    """
+    def __init__(self, bus_number=1):
+        """SMBusBackend Initialization"""
+        import smbus  # Only on the Pi, so import it when we actually open the bus
+        self.bus_number = bus_number
+        self.bus = smbus.SMBus(bus_number)
+
+    def write_byte_data(self, address, reg, value):
+        self.bus.write_byte_data(address, reg, value)
+
+    def read_byte_data(self, address, reg):
+        return self.bus.read_byte_data(address, reg)
+
+    def write_i2c_block_data(self, address, reg, data):
+        self.bus.write_i2c_block_data(address, reg, data)
+
+    def read_i2c_block_data(self, address, reg, count):
+        return self.bus.read_i2c_block_data(address, reg, count)
+
+
+class SimulatedBus:
+    """An in-process I2C bus with PCA9685 register files behind every address
+       Usage:
+            bus = SimulatedBus(realtime=True)  # Actually spend the modeled bus time
+            vehicle = Vehicle(bus=bus)
+            vehicle.forward(0.5)
+            print(bus.stats)  # {'transactions': 1, 'bytes': 32, 'bus_time': 0.0031...}
+            print(bus.registers(0x40)[0x06:0x0A])
+
+       Timing: Each transaction costs 'overhead' seconds plus 9 bit times for every byte on the
+               wire (address, register and data), at the given bitrate (100kHz is the Pi default)
+    """
+    MODE1 = 0x00
+    MODE1_RESTART = 0x80
+    MODE1_AI = 0x20
+    LED0_ON_L = 0x06
+    LED15_OFF_H = 0x45
+    ALLLED_ON_L = 0xFA
+    ALLLED_OFF_H = 0xFD
+
+    def __init__(self, bitrate=100000, overhead=0.00005, realtime=False):
+        """SimulatedBus Initialization"""
+        self.bitrate = bitrate
+        self.overhead = overhead
+        self.realtime = realtime
+        self.devices = {}
+        self.listeners = []
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Zero the transaction counters"""
+        self.stats = {'transactions': 0, 'bytes': 0, 'bus_time': 0.0}
+
+    def add_listener(self, callback):
+        """Call callback(address, reg, data) after every write transaction (e.g. to simulate what the chip drives)"""
+        self.listeners.append(callback)
+
+    def registers(self, address):
+        """Return the register file (a bytearray) for the device at this address"""
+        if address not in self.devices:
+            self.devices[address] = bytearray(256)
+        return self.devices[address]
+
+    def write_byte_data(self, address, reg, value):
+        self._transaction(1)
+        self._store(address, reg, value)
+        for listener in self.listeners:
+            listener(address, reg, [value])
+
+    def read_byte_data(self, address, reg):
+        self._transaction(1)
+        return self.registers(address)[reg]
+
+    def write_i2c_block_data(self, address, reg, data):
+        self._transaction(len(data))
+        start = reg
+        for value in data:
+            self._store(address, reg, value)
+            reg = self._next_reg(address, reg)
+        for listener in self.listeners:
+            listener(address, start, data)
+
+    def read_i2c_block_data(self, address, reg, count):
+        self._transaction(count)
+        registers = self.registers(address)
+        data = []
+        for _ in range(count):
+            data.append(registers[reg])
+            reg = self._next_reg(address, reg)
+        return data
+
+    def _next_reg(self, address, reg):
+        """Internal: The register pointer only moves when MODE1 auto-increment is set"""
+        if self.registers(address)[self.MODE1] & self.MODE1_AI:
+            return (reg + 1) & 0xFF
+        return reg
+
+    def _store(self, address, reg, value):
+        """Internal: Write a register the way the PCA9685 does"""
+        registers = self.registers(address)
+        if reg == self.MODE1:
+            value &= ~self.MODE1_RESTART & 0xFF  # RESTART clears itself
+        elif self.ALLLED_ON_L <= reg <= self.ALLLED_OFF_H:
+            # ALL_LED registers fan out to the same register of every channel
+            offset = reg - self.ALLLED_ON_L
+            for channel_reg in range(self.LED0_ON_L + offset, self.LED15_OFF_H + 1, 4):
+                registers[channel_reg] = value
+            return
+        registers[reg] = value
+
+    def _transaction(self, data_bytes):
+        """Internal: Account (and optionally wait) for one bus transaction"""
+        duration = self.overhead + (data_bytes + 2) * 9.0 / self.bitrate
+        self.stats['transactions'] += 1
+        self.stats['bytes'] += data_bytes
+        self.stats['bus_time'] += duration
+        if self.realtime:
+            # Spin instead of sleep, time.sleep() can't do tens of microseconds, but let other
+            # threads run while we wait (like the real ioctl, which releases the GIL)
+            end = time.perf_counter() + duration
+            while time.perf_counter() < end:
+                time.sleep(0)
+
+
+class RecordingBus:
+    """Wraps another bus and records every transaction
+       Usage:
+            bus = RecordingBus(SMBusBackend(1))
+            vehicle = Vehicle(bus=bus)
+            vehicle.forward(0.5)
+            bus.save('drive.json')
+    """
+    def __init__(self, bus):
+        """RecordingBus Initialization"""
+        self.bus = bus
+        self.records = []
+
+    def write_byte_data(self, address, reg, value):
+        self.bus.write_byte_data(address, reg, value)
+        self._record('write_byte_data', address, reg, value, None)
+
+    def read_byte_data(self, address, reg):
+        result = self.bus.read_byte_data(address, reg)
+        self._record('read_byte_data', address, reg, None, result)
+        return result
+
+    def write_i2c_block_data(self, address, reg, data):
+        self.bus.write_i2c_block_data(address, reg, data)
+        self._record('write_i2c_block_data', address, reg, list(data), None)
+
+    def read_i2c_block_data(self, address, reg, count):
+        result = self.bus.read_i2c_block_data(address, reg, count)
+        self._record('read_i2c_block_data', address, reg, count, list(result))
+        return result
+
+    def _record(self, op, address, reg, arg, result):
+        """Internal: Append a transaction to the record list"""
+        self.records.append({'time': time.perf_counter(), 'op': op, 'address': address,
+                             'reg': reg, 'arg': arg, 'result': result})
+
+    def save(self, filename):
+        """Save the recorded transactions to a JSON file"""
+        with open(filename, 'w') as fp:
+            json.dump(self.records, fp)
+
+
+class ReplayBus:
+    """Plays back recorded transactions, checking that writes match and answering reads
+       Usage:
+            bus = ReplayBus.load('drive.json')
+            vehicle = Vehicle(bus=bus)
+            vehicle.forward(0.5)  # Raises ReplayMismatch if the drive stack does something different
+    """
+    def __init__(self, records, strict=True):
+        """ReplayBus Initialization"""
+        self.records = records
+        self.strict = strict
+        self.position = 0
+
+    @classmethod
+    def load(cls, filename, strict=True):
+        """Create a ReplayBus from a file written by RecordingBus.save()"""
+        with open(filename) as fp:
+            return cls(json.load(fp), strict=strict)
+
+    def done(self):
+        """Have all of the recorded transactions been replayed?"""
+        return self.position >= len(self.records)
+
+    def write_byte_data(self, address, reg, value):
+        self._next('write_byte_data', address, reg, value)
+
+    def read_byte_data(self, address, reg):
+        return self._next('read_byte_data', address, reg, None)
+
+    def write_i2c_block_data(self, address, reg, data):
+        self._next('write_i2c_block_data', address, reg, list(data))
+
+    def read_i2c_block_data(self, address, reg, count):
+        return self._next('read_i2c_block_data', address, reg, count)
+
+    def _next(self, op, address, reg, arg):
+        """Internal: Check the next recorded transaction against this one"""
+        if self.done():
+            raise ReplayMismatch('Replay exhausted at {:s}(0x{:02x}, 0x{:02x})'.format(op, address, reg))
+        record = self.records[self.position]
+        self.position += 1
+        if self.strict and (record['op'], record['address'], record['reg'], record['arg']) != (op, address, reg, arg):
+            raise ReplayMismatch('Transaction {:d}: expected {:s}(0x{:02x}, 0x{:02x}, {!r}) got {:s}(0x{:02x}, 0x{:02x}, {!r})'.format(
+                self.position - 1, record['op'], record['address'], record['reg'], record['arg'], op, address, reg, arg))
+        return record['result']
+
+
+class ReplayMismatch(Exception):
+    """Raised when a ReplayBus sees a transaction that doesn't match the recording"""
+    pass
+
+
+def test():
+    """Test for the bus backends: drive the full stack against the simulated PCA9685"""
+    from robot_kit.vehicle import Vehicle
+
+    bus = SimulatedBus(realtime=True)
+    recorder = RecordingBus(bus)
+    vehicle = Vehicle(bus=recorder)
+    pwm = vehicle.wheels.pwm
+
+    # Transaction counts and end-to-end latency for each maneuver
+    for name, command in [('forward', lambda: vehicle.forward(0.5)), ('backward', lambda: vehicle.backward(0.5)),
+                          ('turn_left', lambda: vehicle.turn_left(0.5)), ('turn_right', lambda: vehicle.turn_right(0.5)),
+                          ('stop', vehicle.stop)]:
+        bus.reset_stats()
+        start = time.perf_counter()
+        command()
+        elapsed = time.perf_counter() - start
+        print('{:s}: {:d} transactions {:.1f}us'.format(name, bus.stats['transactions'], elapsed*1e6))
+        assert bus.stats['transactions'] <= 2  # Was 32 single byte writes per maneuver
+
+    # The simulated chip holds what we wrote (left front is channels 1/0)
+    vehicle.forward(1.0)
+    registers = bus.registers(0x40)
+    assert registers[0x06 + 4*0 + 2] | registers[0x06 + 4*0 + 3] << 8 == 4095
+    assert pwm.read(0x00) == registers[0x00]
+
+    # Replay the recording through a fresh stack
+    replay = ReplayBus(recorder.records)
+    replay_vehicle = Vehicle(bus=replay)
+    for command in [lambda: replay_vehicle.forward(0.5), lambda: replay_vehicle.backward(0.5),
+                    lambda: replay_vehicle.turn_left(0.5), lambda: replay_vehicle.turn_right(0.5),
+                    replay_vehicle.stop, lambda: replay_vehicle.forward(1.0)]:
+        command()
+    assert replay.done()
+    print('Replayed {:d} transactions'.format(len(recorder.records)))
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
@@ -0,0 +1,185 @@
+"""Per wheel calibration: dead zone and gain for each direction, compiled into duty lookup tables"""
+import json
+import time
+
+
+class WheelCalibration:
+    """Per wheel, per direction speed -> duty curves
+       Usage:
+            calibration = WheelCalibration.load('wheels.json')
+            wheels = Wheels(calibration=calibration)
+            wheels.all(0.1)  # Even low speeds clear each motor's dead zone
+
+       Curve: duty = dead_zone + |speed| * (gain*4095 - dead_zone) for any non-zero speed, so the
+              smallest speed starts the wheel turning and full speed is scaled down (gain) to
+              match the weakest motor.
+    """
+    MAX_DUTY = 4095
+    DIRECTIONS = ('forward', 'backward')
+
+    def __init__(self, curves=None):
+        """WheelCalibration Initialization
+        Args:
+               curves: {wheel: {'forward': {'dead_zone': int, 'gain': float}, 'backward': {...}}}
+        """
+        self.curves = curves or {}
+
+    def set_curve(self, wheel, direction, dead_zone, gain):
+        """Set the dead zone (duty) and gain (0 to 1) for one wheel and direction"""
+        self.curves.setdefault(wheel, {})[direction] = {'dead_zone': int(dead_zone), 'gain': float(gain)}
+
+    def duty(self, wheel, speed):
+        """The signed duty for a wheel speed (-1 to 1) on this calibration's curve"""
+        if speed == 0:
+            return 0
+        curve = self.curves.get(wheel, {}).get('forward' if speed > 0 else 'backward', {'dead_zone': 0, 'gain': 1.0})
+        top = curve['gain'] * self.MAX_DUTY
+        duty = int(curve['dead_zone'] + abs(speed) * (top - curve['dead_zone']) + 0.5)
+        duty = min(duty, self.MAX_DUTY)
+        return duty if speed > 0 else -duty
+
+    def compile(self, steps, wheels=None):
+        """Dense lookup tables {wheel: [duty for speed in -1..1 at 1/steps resolution]} (see Wheels._speed_index)
+           Wheels without a curve get a plain linear table.
+        """
+        return {wheel: [self.duty(wheel, index/steps - 1.0) for index in range(2*steps + 1)]
+                for wheel in (wheels or self.curves)}
+
+    def save(self, filename):
+        """Save the calibration to a JSON file"""
+        with open(filename, 'w') as fp:
+            json.dump(self.curves, fp, indent=4, sort_keys=True)
+
+    @classmethod
+    def load(cls, filename):
+        """Load a calibration saved with save()"""
+        with open(filename) as fp:
+            return cls(json.load(fp))
+
+
+def calibrate(wheels, measure, settle=0.3, duty_step=32, threshold=0.05):
+    """Build a WheelCalibration by driving each wheel and measuring how fast it actually turns
+    Args:
+           wheels: the Wheels to calibrate (any bus backend, so this works recorded or simulated)
+           measure: function(wheel) -> that wheel's current speed (any unit, e.g. encoder ticks/s)
+           settle: seconds to let a wheel settle after each duty change
+           duty_step: duty increment while searching for the dead zone
+           threshold: measured speed that counts as 'turning' (in the measure() unit)
+    Returns:
+           WheelCalibration where every wheel's full speed matches the slowest wheel's full speed
+    Raises:
+           ValueError if a wheel doesn't turn even at full duty
+    """
+    dead_zones = {}
+    top_speeds = {}
+    for wheel in wheels._wheel_channels:
+        for direction, sign in zip(WheelCalibration.DIRECTIONS, (1, -1)):
+            # Creep up the duty until the wheel starts turning
+            dead_zone = WheelCalibration.MAX_DUTY
+            for duty in range(0, WheelCalibration.MAX_DUTY, duty_step):
+                wheels.set_duties({wheel: sign * duty})
+                time.sleep(settle)
+                if abs(measure(wheel)) > threshold:
+                    dead_zone = max(duty - duty_step, 0)
+                    break
+
+            # And how fast it goes flat out
+            wheels.set_duties({wheel: sign * WheelCalibration.MAX_DUTY})
+            time.sleep(settle)
+            top_speeds[(wheel, direction)] = abs(measure(wheel))
+            dead_zones[(wheel, direction)] = dead_zone
+            wheels.set_duties({wheel: 0})
+
+    # A wheel that never turns would scale everyone down to nothing
+    stalled = sorted('{:s} {:s}'.format(wheel, direction) for (wheel, direction), speed in top_speeds.items()
+                     if speed <= threshold)
+    if stalled:
+        raise ValueError('These wheels never turned, check the wiring and measure(): {:s}'.format(', '.join(stalled)))
+
+    # Scale everyone's full speed down to the slowest wheel (assuming speed is linear above the dead zone)
+    target = min(top_speeds.values())
+    calibration = WheelCalibration()
+    for (wheel, direction), top_speed in top_speeds.items():
+        dead_zone = dead_zones[(wheel, direction)]
+        fraction = target / top_speed if top_speed else 1.0
+        top_duty = dead_zone + fraction * (WheelCalibration.MAX_DUTY - dead_zone)
+        calibration.set_curve(wheel, direction, dead_zone, top_duty / WheelCalibration.MAX_DUTY)
+    return calibration
+
+
+class SimulatedMotors:
+    """Simulated motors behind a SimulatedBus: each wheel's speed comes from the duty in the chip registers
+       Usage:
+            motors = SimulatedMotors(bus, wheels, {'left_front': (600, 1.1), ...})  # (dead zone, top speed)
+            calibration = calibrate(wheels, motors.measure, settle=0.0)
+    """
+    def __init__(self, bus, wheels, models):
+        """SimulatedMotors Initialization"""
+        self.registers = bus.registers(wheels.address)
+        self.wheels = wheels
+        self.models = models
+
+    def _off(self, channel):
+        """Internal: The OFF (duty) value of a PWM channel (0 when its full off bit is set)"""
+        reg = 0x06 + 4*channel + 2
+        if self.registers[reg + 1] & 0x10:
+            return 0
+        return self.registers[reg] | self.registers[reg + 1] << 8
+
+    def measure(self, wheel):
+        """The simulated speed of a wheel (positive is forward)"""
+        reverse_channel, forward_channel = self.wheels._wheel_channels[wheel]
+        duty = self._off(forward_channel) - self._off(reverse_channel)
+        dead_zone, top_speed = self.models[wheel]
+        if abs(duty) <= dead_zone:
+            return 0.0
+        speed = (abs(duty) - dead_zone) / (WheelCalibration.MAX_DUTY - dead_zone) * top_speed
+        return speed if duty > 0 else -speed
+
+
+def test():
+    """Test for the calibration: calibrate mismatched simulated motors and check they now track"""
+    import os
+    import tempfile
+    from robot_kit.bus import SimulatedBus
+    from robot_kit.wheels import Wheels
+
+    bus = SimulatedBus()
+    wheels = Wheels(bus=bus)
+    motors = SimulatedMotors(bus, wheels, {'left_front': (1200, 1.0), 'left_rear': (1000, 1.1),
+                                           'right_front': (1400, 0.9), 'right_rear': (1100, 1.05)})
+
+    # Uncalibrated: slow speeds don't move anything and the car pulls to one side
+    wheels.all(0.2)
+    assert all(motors.measure(wheel) == 0.0 for wheel in motors.models)
+    wheels.all(0.8)
+    print('Uncalibrated at 0.8: ' + ', '.join('{:.3f}'.format(motors.measure(wheel)) for wheel in motors.models))
+
+    # Calibrate, save and load
+    calibration = calibrate(wheels, motors.measure, settle=0.0, duty_step=16)
+    filename = os.path.join(tempfile.mkdtemp(), 'wheels.json')
+    calibration.save(filename)
+    wheels.set_calibration(WheelCalibration.load(filename))
+
+    # Every wheel moves at low speed and they all agree (within the dead zone search step)
+    for speed in [0.1, 0.5, 0.8, -0.5]:
+        wheels.all(speed)
+        measured = [motors.measure(wheel) for wheel in motors.models]
+        print('Calibrated at {:.1f}: '.format(speed) + ', '.join('{:.3f}'.format(value) for value in measured))
+        assert all(value * speed > 0 for value in measured)
+        assert max(measured) - min(measured) < 0.02
+    wheels.stop()
+
+    # A dead motor is an error, not a reason to slow every wheel down to nothing
+    motors.models['right_rear'] = (WheelCalibration.MAX_DUTY, 1.0)
+    try:
+        calibrate(wheels, motors.measure, settle=0.0, duty_step=256)
+        assert False, 'calibrate() should refuse a wheel that never turns'
+    except ValueError as error:
+        print(error)
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
@@ -0,0 +1,161 @@
+"""A fixed rate control loop scheduler with deadline miss accounting"""
+import os
+import time
+import threading
+from robot_kit.histogram import LatencyHistogram
+
+
+class ControlTask:
+    """One periodic task in a ControlLoop (see ControlLoop.add_task)"""
+    def __init__(self, name, function, rate_hz):
+        """ControlTask Initialization"""
+        self.name = name
+        self.function = function
+        self.period_ns = int(1e9 / rate_hz)
+        self.release_ns = 0
+        self.runs = 0
+        self.misses = 0  # Runs that finished after the next release was due
+        self.skipped = 0  # Releases dropped because a run overran them
+        self.execution = LatencyHistogram()
+        self.lateness = LatencyHistogram()  # How late each run started (the jitter)
+
+    def stats(self):
+        """Dictionary of this task's counters and histogram summaries"""
+        return {'rate_hz': 1e9 / self.period_ns, 'runs': self.runs, 'misses': self.misses, 'skipped': self.skipped,
+                'execution': self.execution.summary(), 'lateness': self.lateness.summary()}
+
+
+class ControlLoop:
+    """Runs registered tasks at fixed rates on one thread, using absolute (monotonic) deadlines
+       Usage:
+            loop = ControlLoop()
+            loop.add_task('ultrasonic', ranging_step, rate_hz=20)
+            loop.add_task('wheels', drive_step, rate_hz=50)
+            loop.add_task('leds', led_step, rate_hz=10)
+            loop.start()  # Background thread (or loop.run(duration) in the foreground)
+            ...
+            loop.stats()  # Per task runs, deadline misses and execution/lateness histograms (ns)
+            loop.stop()
+
+       Note: A task that overruns its period misses a deadline; releases it overran are skipped
+             (not queued up) so the task stays on its original phase.
+    """
+    def __init__(self, cpu=None, priority=None, spin_us=200):
+        """ControlLoop Initialization
+        Args:
+               cpu: pin the loop thread to this CPU core (Linux only)
+               priority: SCHED_FIFO priority (1-99) for the loop thread, needs root (Linux only)
+               spin_us: busy-wait this long before each release instead of sleeping (better accuracy)
+        """
+        self.cpu = cpu
+        self.priority = priority
+        self.spin_ns = spin_us * 1000
+        self.tasks = []
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add_task(self, name, function, rate_hz):
+        """Register a function to be called rate_hz times a second"""
+        task = ControlTask(name, function, rate_hz)
+        self.tasks.append(task)
+        return task
+
+    def start(self):
+        """Run the loop in a background thread"""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, name='robot_kit_control', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the loop (and wait for the background thread)"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        """Dictionary of task name -> task stats, safe to call while the loop runs"""
+        return {task.name: task.stats() for task in self.tasks}
+
+    def run(self, duration=None):
+        """Run the loop in this thread until stop() (or for duration seconds)"""
+        self._set_realtime()
+        now = time.perf_counter_ns()
+        end = None if duration is None else now + int(duration * 1e9)
+        for task in self.tasks:
+            task.release_ns = now
+        while not self._stop_event.is_set() and self.tasks:
+            # Next task due (there are only a handful of tasks, so a linear scan beats a heap)
+            task = min(self.tasks, key=lambda t: t.release_ns)
+            if end is not None and task.release_ns >= end:
+                break
+            self._wait_until(task.release_ns)
+            if self._stop_event.is_set():
+                break
+
+            # Run it, timing both the start lateness and the execution time
+            start = time.perf_counter_ns()
+            task.function()
+            finish = time.perf_counter_ns()
+            task.runs += 1
+            task.lateness.record(start - task.release_ns)
+            task.execution.record(finish - start)
+
+            # Move to the next release, skipping any this run overran
+            task.release_ns += task.period_ns
+            if finish > task.release_ns:
+                task.misses += 1
+                overrun = (finish - task.release_ns) // task.period_ns + 1
+                task.skipped += overrun
+                task.release_ns += overrun * task.period_ns
+
+    def _wait_until(self, deadline_ns):
+        """Internal: Sleep until just before the deadline, then spin to it"""
+        remaining = deadline_ns - time.perf_counter_ns()
+        if remaining > self.spin_ns:
+            self._stop_event.wait((remaining - self.spin_ns) / 1e9)
+        while time.perf_counter_ns() < deadline_ns:
+            pass
+
+    def _set_realtime(self):
+        """Internal: Apply the CPU pinning and realtime priority to the loop thread"""
+        if self.cpu is not None:
+            try:
+                os.sched_setaffinity(0, {self.cpu})
+            except (AttributeError, OSError) as error:
+                print('Could not pin the control loop to CPU {:d}: {:s}'.format(self.cpu, str(error)))
+        if self.priority is not None:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+            except (AttributeError, OSError) as error:
+                print('Could not set SCHED_FIFO priority {:d}: {:s}'.format(self.priority, str(error)))
+
+
+def test():
+    """Test for the ControlLoop class"""
+    loop = ControlLoop()
+    counts = {'fast': 0, 'slow': 0}
+
+    def fast():
+        counts['fast'] += 1
+
+    def slow():
+        counts['slow'] += 1
+        time.sleep(0.15 if counts['slow'] == 3 else 0.001)  # One overrun
+
+    loop.add_task('fast', fast, rate_hz=50)
+    loop.add_task('slow', slow, rate_hz=10)
+    loop.run(duration=1.0)
+    stats = loop.stats()
+    for name, task_stats in stats.items():
+        print('{:s}: runs {:d} misses {:d} p99 lateness {:.0f}us'.format(
+            name, task_stats['runs'], task_stats['misses'], task_stats['lateness']['p99']/1000))
+    assert stats['slow']['misses'] == 1 and stats['slow']['skipped'] == 1
+    assert stats['slow']['runs'] == 9
+    assert stats['fast']['runs'] >= 40  # The slow overrun delays (and costs a few runs of) the fast task too
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
@@ -0,0 +1,220 @@
+"""Emergency stop: a one transaction PCA9685 stop for signals, atexit and a heartbeat watchdog"""
+import os
+import time
+import atexit
+import signal
+import threading
+
+
+class EmergencyStop:
+    """Stops every PWM channel at once (PCA9685.all_off) and keeps them stopped until release()
+       Usage:
+            estop = EmergencyStop(vehicle.wheels.pwm)
+            estop.install()  # Stop on SIGINT/SIGTERM and at interpreter exit (call from the main thread)
+            ...
+            estop.stop()  # From anywhere, any thread
+            estop.release()  # Wheel commands work again
+
+       Note: stop() doesn't allocate or wait on anything but the driver's (reentrant) lock, so it's
+             safe in a signal handler even if the main thread was in the middle of a wheel update.
+    """
+    def __init__(self, pwm, sleep=False):
+        """EmergencyStop Initialization
+        Args:
+               pwm: the PCA9685 driving the wheels (e.g. vehicle.wheels.pwm)
+               sleep: also put the chip's oscillator to sleep (a second transaction)
+        """
+        self.pwm = pwm
+        self.sleep = sleep
+        self.stops = 0
+        self._previous = {}
+
+    @property
+    def stopped(self):
+        """Is the emergency stop engaged?"""
+        return self.pwm.halted
+
+    def stop(self):
+        """Turn every channel fully off, and ignore channel updates until release()"""
+        self.pwm.all_off(self.sleep)
+        self.stops += 1
+
+    def release(self):
+        """Disengage the emergency stop (the wheels stay off until they're next commanded)"""
+        self.pwm.resume()
+
+    def install(self, signals=(signal.SIGINT, signal.SIGTERM)):
+        """Stop on these signals (then hand them to the previous handler) and at interpreter exit"""
+        for signum in signals:
+            self._previous[signum] = signal.signal(signum, self._on_signal)
+        atexit.register(self.stop)
+
+    def uninstall(self):
+        """Put the previous signal handlers back and drop the atexit stop"""
+        for signum, handler in self._previous.items():
+            signal.signal(signum, handler)
+        self._previous = {}
+        atexit.unregister(self.stop)
+
+    def _on_signal(self, signum, frame):
+        """Internal: Signal handler, stop first and then do whatever the signal did before"""
+        self.stop()
+        previous = self._previous.get(signum)
+        if callable(previous):
+            previous(signum, frame)
+        elif previous == signal.SIG_DFL:
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+
+class Watchdog:
+    """Engages an EmergencyStop if the control loop stops calling heartbeat()
+       Usage:
+            watchdog = Watchdog(EmergencyStop(vehicle.wheels.pwm), timeout=0.2)
+            watchdog.start()
+            while driving:
+                ...
+                watchdog.heartbeat()
+            watchdog.shutdown()
+
+       Note: After a trip the stop stays engaged (heartbeats don't release it), call estop.release()
+    """
+    def __init__(self, estop, timeout=0.2):
+        """Watchdog Initialization"""
+        self.estop = estop
+        self.timeout_ns = int(timeout * 1e9)
+        self.trips = 0
+        self._last_ns = time.perf_counter_ns()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def heartbeat(self):
+        """The control loop is alive"""
+        self._last_ns = time.perf_counter_ns()
+
+    def start(self):
+        """Start watching (counts as a heartbeat)"""
+        self.heartbeat()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='robot_kit_watchdog', daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        """Stop watching"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """Internal: Wake up at the heartbeat deadline, trip if there wasn't a newer heartbeat"""
+        tripped = False
+        while not self._stop_event.is_set():
+            deadline = self._last_ns + self.timeout_ns
+            now = time.perf_counter_ns()
+            if now < deadline:
+                tripped = False
+                self._stop_event.wait((deadline - now) / 1e9)
+            elif not tripped:
+                self.estop.stop()
+                self.trips += 1
+                tripped = True
+            else:
+                self._stop_event.wait(self.timeout_ns / 1e9)
+
+
+def test():
+    """Test for the emergency stop: transactions and latency on the simulated bus, signals and the watchdog"""
+    from robot_kit.bus import SimulatedBus
+    from robot_kit.vehicle import Vehicle
+
+    def outputs_off(bus):
+        """Every wheel channel has a zero duty or its full off bit set"""
+        registers = bus.registers(0x40)
+        offs = [(registers[0x08 + 4*channel], registers[0x09 + 4*channel]) for channel in range(8)]
+        return all(high & 0x10 or not (low or high) for low, high in offs)
+
+    bus = SimulatedBus(realtime=True)
+    vehicle = Vehicle(bus=bus)
+    estop = EmergencyStop(vehicle.wheels.pwm)
+
+    # The normal stop vs the fast path (from full speed turning, the worst case for stop())
+    for name, command in [('vehicle.stop', vehicle.stop), ('estop.stop', estop.stop)]:
+        vehicle.turn_left(1.0)
+        bus.reset_stats()
+        start = time.perf_counter()
+        command()
+        elapsed = time.perf_counter() - start
+        print('{:s}: {:d} transactions {:d} bytes {:.1f}us'.format(name, bus.stats['transactions'], bus.stats['bytes'], elapsed*1e6))
+        assert outputs_off(bus)
+    assert bus.stats['transactions'] == 1
+
+    # Latched: wheel commands are ignored until release
+    vehicle.forward(0.5)
+    assert outputs_off(bus) and estop.stopped
+    estop.release()
+    vehicle.forward(0.5)
+    assert not outputs_off(bus)
+
+    # Sleeping the oscillator too, and waking it up again
+    estop.sleep = True
+    bus.reset_stats()
+    estop.stop()
+    assert bus.stats['transactions'] == 2 and bus.registers(0x40)[0x00] & 0x10
+    estop.release()
+    assert not bus.registers(0x40)[0x00] & 0x10
+    estop.sleep = False
+
+    # A stop that lands in the middle of a wheel update (a signal handler before the block write goes out)
+    class InterruptedBus(SimulatedBus):
+        interrupt = False
+
+        def write_i2c_block_data(self, address, reg, data):
+            if self.interrupt:
+                self.interrupt = False
+                estop.stop()
+            super().write_i2c_block_data(address, reg, data)
+    interrupted = InterruptedBus()
+    interrupted_vehicle = Vehicle(bus=interrupted)
+    estop = EmergencyStop(interrupted_vehicle.wheels.pwm)
+    interrupted.interrupt = True
+    interrupted_vehicle.turn_left(1.0)
+    assert estop.stopped and outputs_off(interrupted), interrupted.registers(0x40)[0x06:0x26]
+    estop.release()
+    interrupted_vehicle.forward(0.5)
+    assert not outputs_off(interrupted)  # The forgotten shadow doesn't swallow the next command
+    estop = EmergencyStop(vehicle.wheels.pwm)
+
+    # A signal stops the wheels and still reaches the previous handler
+    received = []
+    previous = signal.signal(signal.SIGUSR1, lambda signum, frame: received.append(signum))
+    vehicle.forward(0.5)
+    estop.install(signals=(signal.SIGUSR1,))
+    os.kill(os.getpid(), signal.SIGUSR1)
+    time.sleep(0.01)
+    assert outputs_off(bus) and received == [signal.SIGUSR1]
+    estop.uninstall()
+    signal.signal(signal.SIGUSR1, previous)
+    estop.release()
+
+    # The watchdog trips when the heartbeats stop
+    watchdog = Watchdog(estop, timeout=0.1)
+    watchdog.start()
+    vehicle.forward(0.5)
+    for _ in range(20):
+        watchdog.heartbeat()
+        time.sleep(0.01)
+    assert not estop.stopped and watchdog.trips == 0
+    stopped_at = time.perf_counter()
+    while watchdog.trips == 0:  # Counted once the stop has been written
+        time.sleep(0.001)
+    print('Watchdog tripped {:.0f}ms after the last heartbeat'.format((time.perf_counter() - stopped_at) * 1000))
+    assert outputs_off(bus) and watchdog.trips == 1
+    watchdog.shutdown()
+    estop.release()
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
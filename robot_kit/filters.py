@@ -0,0 +1,205 @@
+"""Composable filter stages for streams of sensor readings (None means a missed reading)"""
+import bisect
+
+
+class RingBuffer:
+    """A fixed size ring buffer of floats (storage is allocated once up front)
+       Usage:
+            ring = RingBuffer(5)
+            ring.append(1.0)
+            ring.oldest()  # The value the next append will overwrite (once full)
+    """
+    def __init__(self, size):
+        """RingBuffer Initialization"""
+        self.size = size
+        self.values = [0.0] * size
+        self.index = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def full(self):
+        """Is the ring buffer full?"""
+        return self.count == self.size
+
+    def oldest(self):
+        """The oldest value in the buffer"""
+        return self.values[self.index if self.full() else 0]
+
+    def append(self, value):
+        """Add a value, overwriting the oldest one when full"""
+        self.values[self.index] = value
+        self.index = (self.index + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def clear(self):
+        """Empty the buffer (the storage is kept)"""
+        self.index = 0
+        self.count = 0
+
+
+class MedianFilter:
+    """Median of the last N readings, kept in a sorted window that's updated in place"""
+    def __init__(self, size=5):
+        """MedianFilter Initialization"""
+        self.ring = RingBuffer(size)
+        self.ordered = []
+
+    def __call__(self, value):
+        if value is None:
+            return None
+        if self.ring.full():
+            del self.ordered[bisect.bisect_left(self.ordered, self.ring.oldest())]
+        self.ring.append(value)
+        bisect.insort(self.ordered, value)
+        return self.ordered[len(self.ordered)//2]
+
+    def reset(self):
+        self.ring.clear()
+        del self.ordered[:]
+
+
+class EMAFilter:
+    """Exponential moving average (alpha is the weight of the newest reading)"""
+    def __init__(self, alpha=0.5):
+        """EMAFilter Initialization"""
+        self.alpha = alpha
+        self.value = None
+
+    def __call__(self, value):
+        if value is None:
+            return None
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class OutlierFilter:
+    """Rejects readings that jump more than max_jump (cm) from the median of the recent accepted
+       readings, holding the last accepted value instead. After max_rejects rejections in a row the
+       new reading is accepted (the world really did change, e.g. something stepped in front of us).
+    """
+    def __init__(self, max_jump=50.0, size=5, max_rejects=3):
+        """OutlierFilter Initialization"""
+        self.max_jump = max_jump
+        self.max_rejects = max_rejects
+        self.median = MedianFilter(size)
+        self.reference = None
+        self.last = None
+        self.rejects = 0
+
+    def __call__(self, value):
+        if value is None:
+            return None
+        if self.reference is not None and abs(value - self.reference) > self.max_jump and self.rejects < self.max_rejects:
+            self.rejects += 1
+            return self.last
+        if self.rejects:
+            self.median.reset()  # Accepting a jump, so the old reference is meaningless
+        self.rejects = 0
+        self.reference = self.median(value)
+        self.last = value
+        return value
+
+    def reset(self):
+        self.median.reset()
+        self.reference = None
+        self.last = None
+        self.rejects = 0
+
+
+class TimeoutHold:
+    """Holds the last good reading through up to max_hold missed readings in a row"""
+    def __init__(self, max_hold=3):
+        """TimeoutHold Initialization"""
+        self.max_hold = max_hold
+        self.last = None
+        self.misses = 0
+
+    def __call__(self, value):
+        if value is not None:
+            self.last = value
+            self.misses = 0
+            return value
+        self.misses += 1
+        if self.misses > self.max_hold:
+            return None
+        return self.last
+
+    def reset(self):
+        self.last = None
+        self.misses = 0
+
+
+class FilterChain:
+    """Runs a reading through a list of filter stages in order
+       Usage:
+            chain = FilterChain(TimeoutHold(3), OutlierFilter(50.0), MedianFilter(5), EMAFilter(0.3))
+            for timestamp, distance in sensor.stream(20, filters=chain):
+                ...
+    """
+    def __init__(self, *stages):
+        """FilterChain Initialization"""
+        self.stages = stages
+
+    def __call__(self, value):
+        for stage in self.stages:
+            value = stage(value)
+        return value
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+
+def test():
+    """Test for the filter stages"""
+
+    # Median (with the sorted window staying the same size)
+    median = MedianFilter(3)
+    assert [median(v) for v in [5.0, 1.0, 3.0, 100.0, 4.0]] == [5.0, 5.0, 3.0, 3.0, 4.0]
+    assert len(median.ordered) == 3
+    assert median(None) is None
+
+    # EMA
+    ema = EMAFilter(0.5)
+    assert [ema(v) for v in [10.0, 20.0, None, 20.0]] == [10.0, 15.0, None, 17.5]
+
+    # Outlier rejection, a single spike is dropped but a real change gets through
+    outlier = OutlierFilter(max_jump=20.0, max_rejects=2)
+    assert [outlier(v) for v in [50.0, 51.0, 500.0, 52.0]] == [50.0, 51.0, 51.0, 52.0]
+    assert [outlier(v) for v in [10.0, 10.0, 10.0, 11.0]] == [52.0, 52.0, 10.0, 11.0]
+
+    # Timeout hold
+    hold = TimeoutHold(2)
+    assert [hold(v) for v in [30.0, None, None, None, 31.0]] == [30.0, 30.0, 30.0, None, 31.0]
+
+    # Whole chain on a stream from a simulated sensor
+    from robot_kit.gpio import FakeGPIO
+    from robot_kit.ultrasonic import Ultrasonic
+    gpio = FakeGPIO()
+    gpio.attach_sensor(27, 22, distance=40.0)
+    sensor = Ultrasonic(gpio=gpio)
+    chain = FilterChain(TimeoutHold(3), OutlierFilter(50.0), MedianFilter(5), EMAFilter(0.3))
+    readings = list(sensor.stream(rate_hz=50, filters=chain, count=20))
+    timestamps = [timestamp for timestamp, _ in readings]
+    periods = [(b - a)/1e6 for a, b in zip(timestamps, timestamps[1:])]
+    print('Stream periods (ms): {:.2f}-{:.2f}'.format(min(periods), max(periods)))  # Wall clock jitter, just for information
+
+    # The deadlines are absolute, so the stream can run late but never faster than its rate
+    assert timestamps[-1] - timestamps[0] >= 19 * 20e6 * 0.99
+    distances = sorted(distance for _, distance in readings)
+    assert abs(distances[len(distances) // 2] - 40.0) < 2.0, distances
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
@@ -0,0 +1,219 @@
+"""A fake RPi.GPIO module with simulated HC-SR04 ultrasonic sensors"""
+import time
+import heapq
+import threading
+
+
+class FakeGPIO:
+    """Stands in for the RPi.GPIO module (same functions/constants) so the sensing code runs without a Pi
+       Usage:
+            gpio = FakeGPIO()
+            gpio.attach_sensor(trigger_pin=27, echo_pin=22, distance=42.0)
+            sensor = Ultrasonic(gpio=gpio)
+            sensor.get_distance()  # ~42.0
+
+            gpio.set_distance(22, None)  # Nothing in range, the echo never comes back
+
+       Timing: A falling edge on a sensor's trigger pin raises its echo pin after 'echo_delay' seconds
+               and drops it again after the round trip time for the current distance (58us per cm).
+               Edges are delivered from a scheduler thread, like the RPi.GPIO callback thread.
+    """
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+
+    def __init__(self, echo_delay=0.0005, time_distance_factor=0.000058):
+        """FakeGPIO Initialization"""
+        self.echo_delay = echo_delay
+        self.time_distance_factor = time_distance_factor
+        self.mode = None
+        self.levels = {}
+        self.directions = {}
+        self.callbacks = {}
+        self.sensors = {}  # trigger pin -> echo pin
+        self.distances = {}  # echo pin -> distance in cm, None for no echo (or a function returning either)
+        self.triggers = []  # (perf_counter_ns, trigger pin) of every trigger pulse
+        self.pulses = {}  # echo pin -> (rise, fall) perf_counter_ns of the latest echo
+        self.overlaps = 0  # Pings sent while another sensor's echo was still in flight (crosstalk)
+
+        # Scheduled pin changes, serviced by a daemon thread
+        self._events = []
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # RPi.GPIO API
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction, pull_up_down=None, initial=LOW):
+        self.directions[pin] = direction
+        self.levels.setdefault(pin, initial)
+
+    def output(self, pin, value):
+        old = self.levels.get(pin, self.LOW)
+        self.levels[pin] = value
+        if pin in self.sensors and old and not value:
+            self._ping(pin)
+
+    def input(self, pin):
+        if pin in self.pulses:
+            # Echo pins answer from the pulse timing, so polling doesn't depend on the scheduler thread
+            rise, fall = self.pulses[pin]
+            return self.HIGH if rise <= time.perf_counter_ns() < fall else self.LOW
+        return self.levels.get(pin, self.LOW)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = [edge, [callback] if callback else []]
+
+    def add_event_callback(self, pin, callback):
+        self.callbacks[pin][1].append(callback)
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def cleanup(self, pin=None):
+        if pin is None:
+            self.callbacks.clear()
+        else:
+            self.callbacks.pop(pin, None)
+
+    # Simulation controls
+    def attach_sensor(self, trigger_pin, echo_pin, distance=100.0):
+        """Wire up a simulated ultrasonic sensor at the given distance (cm) from an obstacle"""
+        self.sensors[trigger_pin] = echo_pin
+        self.distances[echo_pin] = distance
+        self.levels.setdefault(echo_pin, self.LOW)
+
+    def set_distance(self, echo_pin, distance):
+        """Move the obstacle in front of a sensor (None means nothing in range)
+           distance can also be a function, called at each ping (e.g. for a sensor on a moving servo)
+        """
+        self.distances[echo_pin] = distance
+
+    def schedule(self, delay, pin, level):
+        """Set a pin to a level after the given delay (seconds)"""
+        when = time.perf_counter_ns() + int(delay * 1e9)
+        with self._condition:
+            self._sequence += 1
+            heapq.heappush(self._events, (when, self._sequence, pin, level))
+            self._condition.notify()
+
+    def _ping(self, trigger_pin):
+        """Internal: A trigger pulse just ended, schedule the echo"""
+        now = time.perf_counter_ns()
+        self.triggers.append((now, trigger_pin))
+        echo_pin = self.sensors[trigger_pin]
+        self.overlaps += sum(1 for pin, (rise, fall) in self.pulses.items() if pin != echo_pin and fall > now)
+        distance = self.distances.get(echo_pin)
+        if callable(distance):
+            distance = distance()
+        if distance is None:
+            return
+        rise = self.echo_delay
+        fall = self.echo_delay + distance * self.time_distance_factor
+        now = time.perf_counter_ns()
+        self.pulses[echo_pin] = (now + int(rise * 1e9), now + int(fall * 1e9))
+        self.schedule(rise, echo_pin, self.HIGH)
+        self.schedule(fall, echo_pin, self.LOW)
+
+    def _run(self):
+        """Internal: Scheduler thread, applies pin changes on time and fires the edge callbacks"""
+        while True:
+            with self._condition:
+                while not self._events:
+                    self._condition.wait()
+                when = self._events[0][0]
+                wait = (when - time.perf_counter_ns()) / 1e9
+                if wait > 0.0002:
+                    # Sleep most of the way, then spin the rest for better than scheduler accuracy
+                    self._condition.wait(wait - 0.0002)
+                    continue
+                if wait > 0:
+                    continue
+                _, _, pin, level = heapq.heappop(self._events)
+            self._set_level(pin, level)
+
+    def _set_level(self, pin, level):
+        """Internal: Change a pin level and fire any matching edge callbacks"""
+        old = self.levels.get(pin, self.LOW)
+        self.levels[pin] = level
+        if old == level or pin not in self.callbacks:
+            return
+        edge, callbacks = self.callbacks[pin]
+        if edge == self.BOTH or (edge == self.RISING) == bool(level):
+            for callback in callbacks:
+                callback(pin)
+
+
+def test():
+    """Test for the FakeGPIO class: blocking and edge driven ranging without a Pi"""
+    from robot_kit.ultrasonic import Ultrasonic, UltrasonicRanger, UltrasonicArray, test_cache
+
+    gpio = FakeGPIO()
+    gpio.attach_sensor(27, 22, distance=50.0)
+    sensor = Ultrasonic(gpio=gpio)
+
+    # Blocking five shot reading
+    distance = sensor.get_distance()
+    print('get_distance: {:.1f}'.format(distance))
+    assert abs(distance - 50.0) < 5.0
+
+    # Edge driven ranging in the background
+    ranger = UltrasonicRanger(sensor, rate_hz=20)
+    ranger.start()
+    time.sleep(0.5)
+    start = time.perf_counter_ns()
+    distance = ranger.distance
+    print('ranger.distance: {:.1f} (read in {:d}ns)'.format(distance, time.perf_counter_ns() - start))
+    assert abs(distance - 50.0) < 2.0
+
+    # Move the obstacle and lose it entirely
+    gpio.set_distance(22, 20.0)
+    time.sleep(0.5)
+    assert abs(ranger.distance - 20.0) < 2.0
+    gpio.set_distance(22, None)
+    time.sleep(0.5)
+    assert ranger.distance == sensor.timeout_distance
+    ranger.stop()
+    print(ranger.stats)
+
+    # Three sensors taking turns: right distances, round robin triggers and no crosstalk
+    gpio = FakeGPIO()
+    pins = [(27, 22), (23, 24), (5, 6)]
+    for (trigger, echo), distance in zip(pins, [30.0, 60.0, 90.0]):
+        gpio.attach_sensor(trigger, echo, distance=distance)
+    array = UltrasonicArray([Ultrasonic(trigger, echo, gpio=gpio) for trigger, echo in pins], max_distance=200.0)
+    readings = [[], [], []]
+    array.add_listener(lambda index, timestamp, distance: readings[index].append(distance))
+    array.start()
+    time.sleep(0.5)
+    array.stop()
+    medians = [sorted(distances)[len(distances) // 2] for distances in readings]  # Ignoring the odd late edge
+    print('array.distances: {:s} ({:d} cycles, {:.0f} readings/s)'.format(
+        str(['{:.1f}'.format(distance) for distance in medians]), array.stats['cycles'], array.stats['readings'] / 0.5))
+    assert all(abs(distance - expected) < 3.0 for distance, expected in zip(medians, [30.0, 60.0, 90.0])), readings
+    order = [pin for _, pin in gpio.triggers]
+    assert order[:9] == [27, 23, 5] * 3 and gpio.overlaps == 0
+
+    # Readings shared by several consumers through a DistanceCache
+    test_cache()
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
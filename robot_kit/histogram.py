@@ -0,0 +1,115 @@
+"""A fixed size, log-linear (HDR style) latency histogram"""
+
+
+class LatencyHistogram:
+    """Records latencies in nanoseconds into log-linear buckets (16 per power of two, ~6% precision)
+       Usage:
+            histogram = LatencyHistogram()
+            histogram.record(time.perf_counter_ns() - start)
+            histogram.percentile(99)  # Nanoseconds
+            histogram.summary()  # {'count': ..., 'min': ..., 'mean': ..., 'p50': ..., 'p99': ..., 'max': ...}
+
+       Note: The bucket counts are allocated once, so record() never allocates
+    """
+    SUB_BITS = 5
+    HALF = 1 << (SUB_BITS - 1)
+    BUCKETS = (1 << SUB_BITS) + (64 - SUB_BITS) * HALF
+
+    def __init__(self):
+        """LatencyHistogram Initialization"""
+        self.counts = [0] * self.BUCKETS
+        self.reset()
+
+    def reset(self):
+        """Clear all of the recorded values"""
+        for i in range(self.BUCKETS):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        """Record a latency (integer nanoseconds)"""
+        value = int(value) if value > 0 else 0
+        shift = value.bit_length() - self.SUB_BITS
+        if shift <= 0:
+            self.counts[value] += 1
+        else:
+            self.counts[shift * self.HALF + (value >> shift)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @classmethod
+    def bucket_value(cls, index):
+        """The lowest value that lands in the given bucket"""
+        if index < (1 << cls.SUB_BITS):
+            return index
+        shift = (index - (1 << cls.SUB_BITS)) // cls.HALF + 1
+        return (index - shift * cls.HALF) << shift
+
+    def mean(self):
+        """The mean of the recorded values"""
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        """The value at the given percentile (to bucket precision, clamped to the recorded min/max)"""
+        if not self.count:
+            return 0
+        if percent >= 100:
+            return self.max
+        target = max(1, int(self.count * percent / 100.0 + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(max(self.bucket_value(index), self.min), self.max)
+        return self.max
+
+    def merge(self, other):
+        """Add another histogram's counts into this one"""
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def summary(self):
+        """A dictionary of count, min, mean, p50/p90/p99/p99.9 and max (nanoseconds)"""
+        return {'count': self.count, 'min': self.min or 0, 'mean': self.mean(),
+                'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99),
+                'p99.9': self.percentile(99.9), 'max': self.max or 0}
+
+
+def test():
+    """Test for the LatencyHistogram class"""
+    histogram = LatencyHistogram()
+
+    # Small values are exact, bucket boundaries round trip
+    for value in range(1000):
+        histogram.record(value)
+    assert histogram.count == 1000 and histogram.min == 0 and histogram.max == 999
+    assert abs(histogram.percentile(50) - 500) <= 500 * 0.07
+    for index in range(LatencyHistogram.BUCKETS - 1):
+        assert LatencyHistogram.bucket_value(index) < LatencyHistogram.bucket_value(index + 1)
+
+    # Big values keep ~6% precision
+    histogram.reset()
+    for value in [1000000, 2000000, 3000000, 50000000]:
+        histogram.record(value)
+    assert abs(histogram.percentile(50) - 2000000) <= 2000000 * 0.07
+    assert histogram.percentile(100) == 50000000
+    print(histogram.summary())
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
@@ -0,0 +1,173 @@
+"""Hardware backend registry: resolves the real (Pi) or simulated bus, GPIO and NeoPixel backends
+
+   The hardware libraries (smbus, RPi.GPIO, board/neopixel) are only imported when a device first
+   asks for its backend, so robot_kit imports quickly and works on machines without them.
+
+   Usage:
+        import robot_kit.hw as hw
+        hw.use('sim')  # Or set ROBOT_KIT_HW=sim in the environment (the default is 'real')
+        vehicle = Vehicle()  # Drives a SimulatedBus
+        sensor = Ultrasonic()  # Pings a FakeGPIO sensor
+        hw.gpio().set_distance(22, 30.0)
+
+        # Register your own backend (use() only switches the kinds that have it, the rest stay as they are)
+        hw.register('bus', 'mybus', lambda bus_number: MyBus(bus_number))
+        hw.use('mybus')
+"""
+import os
+import threading
+
+
+def _real_bus(bus_number):
+    from robot_kit.bus import SMBusBackend
+    return SMBusBackend(bus_number)
+
+
+def _real_gpio():
+    import RPi.GPIO as GPIO
+    return GPIO
+
+
+def _real_neopixel(pin, num_leds, brightness, auto_write):
+    import board
+    import neopixel
+    return neopixel.NeoPixel(board.D18 if pin is None else pin, num_leds, brightness=brightness, auto_write=auto_write)
+
+
+def _sim_bus(bus_number):
+    from robot_kit.bus import SimulatedBus
+    return SimulatedBus()
+
+
+def _sim_gpio():
+    from robot_kit.gpio import FakeGPIO
+    gpio = FakeGPIO()
+    gpio.attach_sensor(27, 22, distance=100.0)  # The kit's ultrasonic sensor
+    return gpio
+
+
+def _sim_neopixel(pin, num_leds, brightness, auto_write):
+    from robot_kit.leds import SimulatedNeoPixel
+    return SimulatedNeoPixel(pin, num_leds, brightness=brightness, auto_write=auto_write)
+
+
+_factories = {
+    'bus': {'real': _real_bus, 'sim': _sim_bus},
+    'gpio': {'real': _real_gpio, 'sim': _sim_gpio},
+    'neopixel': {'real': _real_neopixel, 'sim': _sim_neopixel},
+}
+_backends = {kind: os.environ.get('ROBOT_KIT_HW', 'real') for kind in _factories}
+_instances = {}
+_lock = threading.Lock()
+
+
+def register(kind, name, factory):
+    """Register a backend factory for a kind of hardware ('bus', 'gpio' or 'neopixel')"""
+    _factories[kind][name] = factory
+
+
+def use(name):
+    """Switch the kinds of hardware that have the named backend to it (for devices created from now on)
+    Args:
+           name: a backend name, or a {kind: name} selection as returned by backend()
+    """
+    selection = name if isinstance(name, dict) else {kind: name for kind in _factories if name in _factories[kind]}
+    if not selection:
+        raise ValueError('No backend named {:s}'.format(name))
+    for kind, kind_name in selection.items():
+        if kind_name not in _factories[kind]:
+            raise ValueError('No {:s} backend named {:s}'.format(kind, kind_name))
+    _backends.update(selection)
+
+
+def backend(kind=None):
+    """The name of the backend in use for kind, or with no kind the {kind: name} selection (use() takes it back)"""
+    return dict(_backends) if kind is None else _backends[kind]
+
+
+def _shared(kind, key, *args):
+    """Internal: One instance per (backend, kind, key), created on first use"""
+    with _lock:
+        instance_key = (_backends[kind], kind, key)
+        if instance_key not in _instances:
+            _instances[instance_key] = _factories[kind][_backends[kind]](*args)
+        return _instances[instance_key]
+
+
+def bus(bus_number=1):
+    """The I2C bus (shared, opened on first use)"""
+    return _shared('bus', bus_number, bus_number)
+
+
+def gpio():
+    """The GPIO module (shared, imported on first use)"""
+    return _shared('gpio', None)
+
+
+def neopixel(pin=None, num_leds=8, brightness=1.0, auto_write=False):
+    """A new NeoPixel strip object (pin None means the kit's board.D18)"""
+    return _factories['neopixel'][_backends['neopixel']](pin, num_leds, brightness, auto_write)
+
+
+def reset():
+    """Forget the shared instances (the next bus()/gpio() call creates new ones)"""
+    with _lock:
+        _instances.clear()
+
+
+def test():
+    """Test for the hardware registry: the whole kit on simulated backends"""
+    from robot_kit import hw  # Not this module's globals, which are __main__'s when run as a script
+    previous = hw.backend()
+    hw.use('sim')
+    try:
+        _test()
+    finally:
+        hw.use(previous)
+        hw.reset()
+
+
+def _test():
+    """Internal: The test body, run on the simulated backends by test()"""
+    from robot_kit.vehicle import Vehicle
+    from robot_kit.ultrasonic import Ultrasonic
+    from robot_kit.leds import NeoPixelStrip, test_worker
+    from robot_kit import hw  # Not this module's globals, which are __main__'s when run as a script
+
+    vehicle = Vehicle()
+    vehicle.forward(0.5)
+    assert hw.bus().stats['transactions'] > 0
+    sensor = Ultrasonic()
+    hw.gpio().set_distance(22, 30.0)
+    assert abs(sensor.get_distance() - 30.0) < 3.0
+    leds = NeoPixelStrip()
+    leds.on(0, 255, 0)
+    assert leds.strip[0] == (0, 255, 0)
+    leds.off()
+    test_worker()
+
+    # A backend for one kind of hardware: selecting it leaves the other kinds on theirs
+    from robot_kit.bus import SimulatedBus
+    sim_bus = hw.bus()
+    hw.register('bus', 'test_bus', lambda bus_number: SimulatedBus())
+    hw.use('test_bus')
+    assert hw.backend('bus') == 'test_bus' and hw.backend('gpio') == 'sim' and hw.backend('neopixel') == 'sim'
+    assert hw.bus() is not sim_bus and hw.gpio() is sensor.gpio
+    transactions = sim_bus.stats['transactions']
+    Vehicle().forward(0.5)
+    assert hw.bus().stats['transactions'] > 0 and sim_bus.stats['transactions'] == transactions
+    assert abs(sensor.get_distance() - 30.0) < 3.0  # Still the simulated GPIO
+    try:
+        hw.use('no_such_backend')
+        assert False, 'use() should reject a name no kind has'
+    except ValueError:
+        pass
+    hw.use('sim')
+    del hw._factories['bus']['test_bus']
+    print('Simulated kit OK ({:d} bus transactions)'.format(hw.bus().stats['transactions']))
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
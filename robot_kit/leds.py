@@ -1,7 +1,8 @@
 """A lightweight wrapper around the NeoPixel LED Strip"""
-import board
-import neopixel
 import time
+import functools
+import threading
+from robot_kit import hw
 
 
 class NeoPixelStrip():
@@ -12,22 +13,29 @@ class NeoPixelStrip():
             time.sleep(1)
             led_strip.off()
     """
-    # Singleton Object Pattern
+    # Singleton Object Pattern (one per hw backend, a hw.use() switch builds a new strip)
     __instance = None
+    backend = None
+    lock = threading.RLock()  # The strip is shared (LedWorker, Animator, ...), one writer at a time
 
-    def __new__(cls, led_pin=board.D18, num_leds=8, brightness=1.0):
-        if NeoPixelStrip.__instance is None:
-            NeoPixelStrip.__instance = object.__new__(cls)
-            NeoPixelStrip.__instance.__class_init__(led_pin, num_leds, brightness)
-        return NeoPixelStrip.__instance
+    def __new__(cls, led_pin=None, num_leds=8, brightness=1.0):
+        with NeoPixelStrip.lock:
+            if NeoPixelStrip.__instance is None or NeoPixelStrip.backend != hw.backend('neopixel'):
+                instance = object.__new__(cls)
+                instance.__class_init__(led_pin, num_leds, brightness)
+                NeoPixelStrip.__instance = instance  # Only once the strip is up, so a failure can be retried
+            return NeoPixelStrip.__instance
 
     @classmethod
-    def __class_init__(cls, led_pin=board.D18, num_leds=8, brightness=1.0):
-        """NeoPixelStrip Initialization"""
+    def __class_init__(cls, led_pin=None, num_leds=8, brightness=1.0):
+        """NeoPixelStrip Initialization (led_pin None means board.D18, see robot_kit.hw)"""
+        strip = hw.neopixel(led_pin, num_leds, brightness=brightness, auto_write=False)
         cls.led_pin = led_pin
         cls.num_leds = num_leds
         cls.brightness = brightness
-        cls.strip = neopixel.NeoPixel(cls.led_pin, cls.num_leds, brightness=cls.brightness)
+        cls.strip = strip
+        cls.backend = hw.backend('neopixel')
+        cls.shown_rgb = None  # What the strip is showing (None for a per pixel frame)
 
     def __init__(self):
         self.current_rgb = (0, 0, 0)
@@ -43,12 +51,33 @@ class NeoPixelStrip():
                green: green value (0-255)
                blue: blue value (0-255)
         """
-        self.strip.fill((red, green, blue))
         self.current_rgb = (red, green, blue)
+        with self.lock:
+            self._fill(self.current_rgb)
 
     def off(self):
         """Turn all the LEDs off"""
-        self.strip.fill((0, 0, 0))
+        with self.lock:
+            self._fill((0, 0, 0))
+
+    def show_frame(self, frame):
+        """Show a frame of per pixel colors
+        Args:
+               frame: bytearray (or bytes) of R, G, B values for each LED
+        """
+        with self.lock:
+            for index in range(self.num_leds):
+                self.strip[index] = (frame[3*index], frame[3*index+1], frame[3*index+2])
+            self.strip.show()
+            NeoPixelStrip.shown_rgb = None
+
+    def _fill(self, rgb):
+        """Internal: Set every LED to one color, skipping the strip refresh if it's already showing it (call with the lock held)"""
+        if rgb == self.shown_rgb:
+            return
+        self.strip.fill(rgb)
+        self.strip.show()
+        NeoPixelStrip.shown_rgb = rgb
 
     def cleanup(self):
         """Method that's called when class is destroyed"""
@@ -57,22 +86,160 @@ class NeoPixelStrip():
         self.strip.deinit()
 
 
+class SimulatedNeoPixel:
+    """Stands in for neopixel.NeoPixel (see robot_kit.hw), keeping the pixels in memory"""
+    def __init__(self, pin, n, brightness=1.0, auto_write=True):
+        """SimulatedNeoPixel Initialization"""
+        self.pin = pin
+        self.n = n
+        self.brightness = brightness
+        self.auto_write = auto_write
+        self.pixels = [(0, 0, 0)] * n
+        self.shows = 0  # Number of strip refreshes
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        return self.pixels[index]
+
+    def __setitem__(self, index, rgb):
+        self.pixels[index] = tuple(rgb)
+        if self.auto_write:
+            self.show()
+
+    def fill(self, rgb):
+        self.pixels = [tuple(rgb)] * self.n
+        if self.auto_write:
+            self.show()
+
+    def show(self):
+        self.shows += 1
+
+    def deinit(self):
+        pass
+
+
+class LedWorker:
+    """Background thread that owns the activity blink, so callers never wait on the strip
+       Usage:
+            worker = LedWorker(NeoPixelStrip())
+            worker.begin()  # LEDs on (returns immediately)
+            ...
+            worker.end(0.1)  # LEDs off 0.1s from now, unless another begin() comes first
+
+       Note: Overlapping or rapid begin()/end() pairs coalesce into a single blink
+    """
+    # One worker per process (the strip is a singleton anyway)
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        """The shared LedWorker on the NeoPixelStrip singleton"""
+        with cls.__instance_lock:
+            if cls.__instance is None:
+                cls.__instance = cls(NeoPixelStrip())
+            return cls.__instance
+
+    def __init__(self, strip, rgb=(0, 0, 255)):
+        """LedWorker Initialization"""
+        self.strip = strip
+        self.rgb = rgb
+        self.counts = {'requests': 0, 'blinks': 0, 'errors': 0}
+        self._active = 0
+        self._off_at = 0.0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='robot_kit_leds', daemon=True)
+        self._thread.start()
+
+    def begin(self):
+        """A command started: make sure the LEDs are on"""
+        with self._condition:
+            self._active += 1
+            self.counts['requests'] += 1
+            self._condition.notify()
+
+    def end(self, hold=0.1):
+        """A command finished: LEDs off after hold seconds (if nothing else is running by then)"""
+        with self._condition:
+            self._active -= 1
+            self._off_at = max(self._off_at, time.monotonic() + hold)
+            self._condition.notify()
+
+    def _lit(self):
+        """Internal: Should the LEDs be on (call with the condition held)"""
+        return self._active > 0 or time.monotonic() < self._off_at
+
+    def _run(self):
+        """Internal: Worker thread, does all the strip writes"""
+        while True:
+            with self._condition:
+                while not self._lit():
+                    self._condition.wait()
+            self._write(self.strip.on, *self.rgb)
+            self.counts['blinks'] += 1
+            with self._condition:
+                while self._lit():
+                    self._condition.wait(None if self._active else self._off_at - time.monotonic())
+            self._write(self.strip.off)
+
+    def _write(self, method, *args):
+        """Internal: One strip write, a failure is reported but never ends the worker thread"""
+        try:
+            method(*args)
+        except Exception as error:
+            self.counts['errors'] += 1
+            print('LedWorker: strip write failed: {!r}'.format(error))
+
+
 class CommandBlink:
+    """Decorator that blinks the LEDs while a command runs (plus a short hold so quick commands show)
+       Usage:
+            @CommandBlink
+            def forward(speed):
+                ...
+
+            @CommandBlink
+            async def forward(speed):
+                ...
+
+       Note: The LED writes happen on the LedWorker thread, so the decorated function returns its
+             result as soon as it's done (no added latency)
+    """
+    hold = 0.1
 
     def __init__(self, function):
-        self.led_strip = NeoPixelStrip()
+        import inspect  # Slow to import, and only needed once a function is decorated
         self.function = function
+        self.is_coroutine = inspect.iscoroutinefunction(function)
+        functools.update_wrapper(self, function)
+
+    @property
+    def worker(self):
+        return LedWorker.instance()
 
     def __call__(self, *args, **kwargs):
-        # Turn LEDs blue
-        self.led_strip.on(0, 0, 255)
+        if self.is_coroutine:
+            return self._call_async(*args, **kwargs)
+        self.worker.begin()
+        try:
+            return self.function(*args, **kwargs)
+        finally:
+            self.worker.end(self.hold)
 
-        # Call the function
-        self.function(*args, **kwargs)
+    async def _call_async(self, *args, **kwargs):
+        self.worker.begin()
+        try:
+            return await self.function(*args, **kwargs)
+        finally:
+            self.worker.end(self.hold)
 
-        # Turn LEDs Off
-        time.sleep(0.1)  # Quick sleep in case function didn't take long
-        self.led_strip.off()
+    def __get__(self, instance, owner):
+        """Decorating methods works too"""
+        if instance is None:
+            return self
+        return functools.partial(self.__call__, instance)
 
 
 def test():
@@ -113,6 +280,56 @@ def test():
     led_strip.cleanup()
 
 
+
+def test_worker():
+    """Test for the LedWorker and CommandBlink classes (on the simulated strip, robot_kit.hw's test runs it)"""
+    from robot_kit import hw  # Not this module's globals, which are __main__'s when run as a script
+    previous = hw.backend()
+    hw.use('sim')
+    try:
+        _test_worker()
+    finally:
+        hw.use(previous)
+
+
+def _test_worker():
+    """Internal: The LedWorker/CommandBlink test body, run on the simulated strip by test_worker()"""
+    from robot_kit.leds import NeoPixelStrip, LedWorker, CommandBlink
+    strip = NeoPixelStrip()
+
+    # Rapid decorated calls return right away and coalesce into one blink
+    @CommandBlink
+    def foo(a):
+        return a * 2
+    worker = LedWorker.instance()
+    counts = dict(worker.counts)
+    start = time.perf_counter()
+    results = [foo(i) for i in range(10)]
+    print('10 decorated calls in {:.1f}us'.format((time.perf_counter() - start)*1e6))
+    assert results == [i * 2 for i in range(10)]
+    time.sleep(CommandBlink.hold + 0.2)
+    assert worker.counts['requests'] - counts['requests'] == 10
+    assert 1 <= worker.counts['blinks'] - counts['blinks'] < 10, worker.counts
+    assert strip.strip[0] == (0, 0, 0)  # Off again after the hold
+    print(worker.counts)
+
+    # A strip write that fails is counted, and the worker keeps going
+    class BrokenStrip:
+        def on(self, red, green, blue):
+            raise OSError('SPI error')
+
+        def off(self):
+            pass
+    broken = LedWorker(BrokenStrip())
+    broken.begin()
+    broken.end(0.02)
+    time.sleep(0.1)
+    broken.begin()
+    broken.end(0.02)
+    time.sleep(0.1)
+    assert broken.counts['errors'] == 2 and broken.counts['blinks'] == 2 and broken._thread.is_alive(), broken.counts
+
+
 if __name__ == '__main__':
 
     # Run the test
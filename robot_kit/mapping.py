@@ -0,0 +1,240 @@
+"""Mapping: a fixed size, NumPy log-odds occupancy grid built from ultrasonic readings"""
+import numpy as np
+
+
+class OccupancyGrid:
+    """A square log-odds occupancy grid around the robot, updated with the ultrasonic cone model
+       Usage:
+            grid = OccupancyGrid(size=200, resolution=5.0)  # 10m x 10m of 5cm cells, centered on (0, 0)
+            grid.integrate((x, y, heading), distance)  # One reading (cm and radians, NaN for no echo)
+            grid.integrate(poses, distances, bearings)  # A batch, poses is (N, 3) or one (x, y, heading)
+            grid.integrate_scan((x, y, heading), scanner.angles, distances)  # A Scanner sweep
+            grid.recenter(x, y)  # Keep the robot in the middle (nothing is reallocated)
+            grid.free_distance(x, y, heading)  # cm of free space along a heading (or an array of headings)
+
+       Coordinates: cm, x and y in the world frame, headings in radians counterclockwise from +x.
+                    The vehicle has no odometry, so the poses come from the caller.
+
+       Rolling window: World cell (i, j) lives at log_odds[i % size, j % size]. Recentering only
+                       clears the rows and columns that leave the window, so log_odds is never
+                       reallocated (use to_array() for a copy in world order).
+    """
+    def __init__(self, size=200, resolution=5.0, beam_width=15.0, max_range=400.0,
+                 hit=0.85, miss=-0.4, limit=5.0):
+        """OccupancyGrid Initialization
+        Args:
+               size: cells per side
+               resolution: cm per cell
+               beam_width: the sensor's cone (degrees, the HC-SR04 is ~15)
+               max_range: the furthest reading (cm) we trust, no echo marks the cone free out to here
+               hit, miss: log-odds added to cells at the end of / inside the cone
+               limit: log-odds are clamped to +/- limit (so the map can change its mind)
+        """
+        self.size = size
+        self.resolution = resolution
+        self.max_range = max_range
+        self.hit = hit
+        self.miss = miss
+        self.limit = limit
+        self.thickness = resolution  # Depth of the occupied arc at the end of the cone
+        self.cos_half_beam = np.cos(np.radians(beam_width / 2))
+        self.log_odds = np.zeros((size, size), dtype=np.float32)
+        self._flat = self.log_odds.reshape(-1)  # A view, for the batched updates
+        self.origin = (-(size // 2), -(size // 2))  # World cell at the window's low corner
+        self.stats = {'readings': 0, 'batches': 0, 'recenters': 0}
+
+        # Every cell offset the cone can reach, sorted by bearing (so each reading only looks at its
+        # sector), plus the cells near the sensor (where its position in its cell changes the bearing a lot)
+        reach = int(np.ceil((max_range + self.thickness) / resolution)) + 1
+        i, j = np.mgrid[-reach:reach + 1, -reach:reach + 1]
+        i, j = i.ravel(), j.ravel()
+        ranges = np.hypot(i, j) * resolution
+        keep = ranges <= max_range + self.thickness + resolution
+        margin = np.radians(5.0)
+        near = keep & (ranges <= resolution * (0.75 / np.sin(margin) + 1))
+        far = keep & ~near
+        self._near = (i[near], j[near])
+        bearings = np.arctan2(j[far], i[far])
+        order = np.argsort(bearings, kind='stable')
+        self._far_bearing = np.concatenate([bearings[order], bearings[order] + 2 * np.pi])  # Twice round, for the wrap
+        self._far = (np.tile(i[far][order], 2), np.tile(j[far][order], 2))
+        self._sector = np.radians(beam_width / 2) + margin
+
+    @property
+    def bounds(self):
+        """The window in world coordinates: (x_min, y_min, x_max, y_max) in cm"""
+        low_i, low_j = self.origin
+        return (low_i * self.resolution, low_j * self.resolution,
+                (low_i + self.size) * self.resolution, (low_j + self.size) * self.resolution)
+
+    def cell(self, x, y):
+        """World cell (i, j) holding a point (cm)"""
+        return int(np.floor(x / self.resolution)), int(np.floor(y / self.resolution))
+
+    def integrate(self, poses, distances, bearings=0.0):
+        """Integrate a batch of readings
+        Args:
+               poses: sensor (x, y, heading) per reading, shape (N, 3), or one pose for all of them
+               distances: cm per reading (NaN, None or >= max_range for no echo)
+               bearings: sensor angle (radians) relative to the pose heading, per reading or one for all
+        """
+        distances = np.asarray(distances, dtype=float).reshape(-1)
+        count = len(distances)
+        poses = np.broadcast_to(np.asarray(poses, dtype=float), (count, 3))
+        headings = poses[:, 2] + np.broadcast_to(np.asarray(bearings, dtype=float), (count,))
+        x, y = poses[:, 0], poses[:, 1]
+        hit = np.isfinite(distances) & (distances < self.max_range)
+        reach = np.where(hit, distances, self.max_range)
+
+        # The candidate cells for each reading: its sector of the far cells and all of the near cells
+        start = (headings - self._sector + np.pi) % (2 * np.pi) - np.pi
+        low = np.searchsorted(self._far_bearing, start)
+        lengths = np.searchsorted(self._far_bearing, start + 2 * self._sector, side='right') - low
+        near = len(self._near[0])
+        far_index = np.arange(lengths.sum()) + np.repeat(low - (np.cumsum(lengths) - lengths), lengths)
+        reading = np.concatenate([np.repeat(np.arange(count), lengths), np.repeat(np.arange(count), near)])
+        offset_i = np.concatenate([self._far[0][far_index], np.tile(self._near[0], count)])
+        offset_j = np.concatenate([self._far[1][far_index], np.tile(self._near[1], count)])
+        i = np.floor(x / self.resolution).astype(np.int64)[reading] + offset_i
+        j = np.floor(y / self.resolution).astype(np.int64)[reading] + offset_j
+        dx = (i + 0.5) * self.resolution - x[reading]
+        dy = (j + 0.5) * self.resolution - y[reading]
+        ranges = np.hypot(dx, dy)
+
+        # The cone model: free inside the cone, occupied on the arc at the measured distance
+        half = self.thickness / 2
+        in_cone = dx * np.cos(headings)[reading] + dy * np.sin(headings)[reading] >= ranges * self.cos_half_beam
+        reach = reach[reading]
+        free = in_cone & (ranges < reach - half)
+        occupied = in_cone & hit[reading] & (np.abs(ranges - reach) <= half)
+        updates = free | occupied
+        i, j, occupied = i[updates], j[updates], occupied[updates]
+
+        # Scatter the updates into the window (toroidal storage, cells outside the window are dropped)
+        inside = (i >= self.origin[0]) & (i < self.origin[0] + self.size) & (j >= self.origin[1]) & (j < self.origin[1] + self.size)
+        index = (i[inside] % self.size) * self.size + j[inside] % self.size
+        weights = np.where(occupied[inside], self.hit, self.miss).astype(np.float32)
+        np.add.at(self._flat, index, weights)
+        self._flat[index] = np.clip(self._flat[index], -self.limit, self.limit)
+        self.stats['readings'] += count
+        self.stats['batches'] += 1
+
+    def integrate_scan(self, pose, angles, distances):
+        """Integrate a Scanner sweep: angles in degrees (90 is straight ahead), distances in cm"""
+        self.integrate(pose, distances, np.radians(np.asarray(angles, dtype=float) - 90.0))
+
+    def recenter(self, x, y):
+        """Move the window so it's centered on (x, y), forgetting the cells that fall off the edge"""
+        center_i, center_j = self.cell(x, y)
+        origin = (center_i - self.size // 2, center_j - self.size // 2)
+        for axis in (0, 1):
+            old, new = self.origin[axis], origin[axis]
+            if abs(new - old) >= self.size:
+                self.log_odds[:] = 0.0
+                break
+            leaving = np.arange(old, new) if new > old else np.arange(new + self.size, old + self.size)
+            if axis == 0:
+                self.log_odds[leaving % self.size, :] = 0.0
+            else:
+                self.log_odds[:, leaving % self.size] = 0.0
+        if origin != self.origin:
+            self.origin = origin
+            self.stats['recenters'] += 1
+
+    def value(self, x, y):
+        """Log-odds at a point (cm), 0.0 (unknown) outside the window"""
+        i, j = self.cell(x, y)
+        if not (0 <= i - self.origin[0] < self.size and 0 <= j - self.origin[1] < self.size):
+            return 0.0
+        return float(self.log_odds[i % self.size, j % self.size])
+
+    def free_distance(self, x, y, heading, max_distance=None, threshold=0.0, width=0.0):
+        """Distance (cm) from (x, y) along a heading to the first occupied cell (or the window edge)
+        Args:
+               heading: radians, or an array of headings (returns an array)
+               max_distance: the furthest to look (defaults to max_range)
+               threshold: log-odds above this count as occupied (0.0: anything more likely than not)
+               width: also check parallel rays this far (cm) either side (e.g. the width of the car)
+        """
+        max_distance = self.max_range if max_distance is None else max_distance
+        headings = np.asarray(heading, dtype=float)
+        steps = np.arange(self.resolution / 2, max_distance, self.resolution / 2)
+        lateral = np.array([-width / 2, 0.0, width / 2]) if width else np.zeros(1)
+        cos, sin = np.cos(headings)[..., None, None], np.sin(headings)[..., None, None]
+        px = x + steps * cos - lateral[:, None] * sin
+        py = y + steps * sin + lateral[:, None] * cos
+        i = np.floor(px / self.resolution).astype(np.int64) - self.origin[0]
+        j = np.floor(py / self.resolution).astype(np.int64) - self.origin[1]
+        inside = (i >= 0) & (i < self.size) & (j >= 0) & (j < self.size)
+        values = self.log_odds[(i + self.origin[0]) % self.size, (j + self.origin[1]) % self.size]
+        blocked = ((values > threshold) | ~inside).any(axis=-2)
+        first = np.argmax(blocked, axis=-1)
+        distances = np.where(blocked.any(axis=-1), steps[first] - self.resolution / 2, max_distance)
+        return float(distances) if distances.ndim == 0 else distances
+
+    def probabilities(self):
+        """Occupancy probabilities (0.5 is unknown) in storage order, see to_array() for world order"""
+        return 1.0 / (1.0 + np.exp(-self.log_odds))
+
+    def to_array(self):
+        """A copy of the log-odds in world order: [0, 0] is the window's low corner (see bounds)"""
+        return np.roll(self.log_odds, (-(self.origin[0] % self.size), -(self.origin[1] % self.size)), axis=(0, 1))
+
+    def reset(self):
+        """Forget everything"""
+        self.log_odds[:] = 0.0
+
+
+def test():
+    """Test for the OccupancyGrid: scan a wall, query the free space, then roll the window past it"""
+    import time
+
+    # A wall 200cm in front of the robot (x = 200), the sensor sees out to 400cm
+    grid = OccupancyGrid(size=200, resolution=5.0)
+    angles = np.arange(30.0, 151.0, 5.0)
+    bearings = np.radians(angles - 90.0)
+    distances = np.where(np.abs(bearings) < np.radians(60), 200.0 / np.cos(bearings), np.nan)
+    data = grid.log_odds
+    for _ in range(5):
+        grid.integrate_scan((0.0, 0.0, 0.0), angles, distances)
+    assert grid.value(202.0, 0.0) > 2.0 and grid.value(100.0, 0.0) < -1.0 and grid.value(-100.0, 0.0) == 0.0
+    ahead = grid.free_distance(0.0, 0.0, 0.0)
+    assert 190.0 <= ahead <= 200.0, ahead
+
+    # Many headings at once: the wall is further away off to the side
+    headings = np.radians([-30.0, 0.0, 30.0])
+    free = grid.free_distance(0.0, 0.0, headings)
+    assert free[1] < free[0] and free[1] < free[2], free
+    assert grid.free_distance(0.0, 0.0, 0.0, width=30.0) <= ahead
+
+    # One batch of readings from several poses is the same as one reading at a time
+    poses = np.array([[0.0, 0.0, 0.0], [50.0, -30.0, 0.3], [20.0, 40.0, -0.2]])
+    batch, single = OccupancyGrid(size=100), OccupancyGrid(size=100)
+    batch.integrate(poses, [150.0, np.nan, 120.0])
+    for pose, distance in zip(poses, [150.0, np.nan, 120.0]):
+        single.integrate(pose, distance)
+    assert np.allclose(batch.log_odds, single.log_odds)
+
+    # Roll the window 6m forward: the wall stays (it's still inside), what's behind us is forgotten
+    grid.integrate((0.0, 0.0, np.pi), 150.0)
+    assert grid.value(-100.0, 0.0) < 0.0
+    grid.recenter(600.0, 0.0)
+    assert grid.log_odds is data and grid.bounds[0] == 100.0
+    assert grid.value(202.0, 0.0) > 2.0 and grid.value(-100.0, 0.0) == 0.0
+    assert np.all(grid.log_odds[grid.cell(-100.0, 0.0)[0] % grid.size] == 0.0)
+    i, j = grid.cell(202.0, 0.0)
+    assert grid.to_array()[i - grid.origin[0], j - grid.origin[1]] == grid.value(202.0, 0.0)
+
+    # Speed
+    start = time.perf_counter()
+    for _ in range(20):
+        grid.integrate_scan((600.0, 0.0, np.pi), angles, distances)
+    elapsed = time.perf_counter() - start
+    print('{:.0f} readings/s ({:d} cell grid), free ahead {:.0f}cm, stats {:s}'.format(
+        20 * len(angles) / elapsed, grid.size, ahead, str(grid.stats)))
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
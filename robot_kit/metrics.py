@@ -0,0 +1,307 @@
+"""Opt-in instrumentation: per operation counts and latency histograms for the bus, sensor, LED and vehicle calls
+
+   Nothing is measured (and nothing costs anything) until enable() is called: it swaps timing
+   wrappers in for the instrumented methods and disable() puts the originals back.
+
+   Usage:
+        from robot_kit import metrics
+        metrics.enable()
+        ...  # Drive around
+        metrics.snapshot()  # {'pca9685.write': {'count': ..., 'p99': ..., ...}, 'vehicle.forward': {...}, ...}
+        metrics.start_dump(interval=10.0)  # Print a summary line per operation every 10 seconds
+        metrics.stop_dump()
+        metrics.disable()
+"""
+import time
+import functools
+import importlib
+import threading
+from robot_kit.histogram import LatencyHistogram
+
+
+class Operation:
+    """Counters and a latency histogram (nanoseconds) for one instrumented operation"""
+    def __init__(self, name):
+        """Operation Initialization"""
+        self.name = name
+        self.latency = LatencyHistogram()
+        self.reset()
+
+    def reset(self):
+        """Clear the counters and the histogram"""
+        self.latency.reset()
+        self.timeouts = 0
+        self.transactions = 0
+
+    def stats(self):
+        """Dictionary of the count, timeouts, bus transactions and latency summary"""
+        stats = self.latency.summary()
+        count = stats['count']
+        stats['timeouts'] = self.timeouts
+        stats['timeout_rate'] = self.timeouts / count if count else 0.0
+        stats['transactions'] = self.transactions
+        stats['transactions_per_call'] = self.transactions / count if count else 0.0
+        return stats
+
+
+# What gets instrumented: (module, class, method, operation name, what else to count)
+INSTRUMENTED = [
+    ('robot_kit.PCA9685', 'PCA9685', 'write', 'pca9685.write', None),
+    ('robot_kit.PCA9685', 'PCA9685', 'writeBlock', 'pca9685.write_block', None),
+    ('robot_kit.ultrasonic', 'Ultrasonic', '_wait_for_echo', 'ultrasonic.echo', 'timeouts'),
+    ('robot_kit.ultrasonic', 'Ultrasonic', 'get_distance', 'ultrasonic.get_distance', None),
+    ('robot_kit.ultrasonic', 'DistanceCache', 'get_distance', 'ultrasonic.cached_get_distance', None),
+    ('robot_kit.leds', 'NeoPixelStrip', 'on', 'leds.on', None),
+    ('robot_kit.leds', 'NeoPixelStrip', 'show_frame', 'leds.show_frame', None),
+    ('robot_kit.vehicle', 'Vehicle', 'drive', 'vehicle.drive', 'transactions'),
+    ('robot_kit.vehicle', 'Vehicle', 'forward', 'vehicle.forward', 'transactions'),
+    ('robot_kit.vehicle', 'Vehicle', 'backward', 'vehicle.backward', 'transactions'),
+    ('robot_kit.vehicle', 'Vehicle', 'stop', 'vehicle.stop', 'transactions'),
+    ('robot_kit.vehicle', 'Vehicle', 'turn_left', 'vehicle.turn_left', 'transactions'),
+    ('robot_kit.vehicle', 'Vehicle', 'turn_right', 'vehicle.turn_right', 'transactions'),
+]
+
+operations = {}
+_originals = []
+_lock = threading.Lock()
+_dump_stop = threading.Event()
+_dump_thread = None
+_local = threading.local()  # Per thread: inside an instrumented vehicle call?
+
+
+def operation(name):
+    """The Operation for a name (created on first use, so your own code can record into it too)"""
+    with _lock:
+        if name not in operations:
+            operations[name] = Operation(name)
+        return operations[name]
+
+
+def record(name, latency_ns, timeout=False, transactions=0):
+    """Record one call of an operation"""
+    op = operation(name)
+    with _lock:
+        op.latency.record(latency_ns)
+        op.timeouts += timeout
+        op.transactions += transactions
+
+
+def _timed(name, method, counts):
+    """Internal: Wrap a method so each call records its latency (and timeouts or bus transactions)"""
+    op = operation(name)
+    perf_counter_ns = time.perf_counter_ns
+
+    if counts == 'timeouts':
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = perf_counter_ns()
+            result = method(self, *args, **kwargs)
+            latency = perf_counter_ns() - start
+            with _lock:
+                op.latency.record(latency)
+                op.timeouts += result == -1
+            return result
+    elif counts == 'transactions':
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            # Nested calls (forward() calls drive()) are part of the outer call, only it records
+            if getattr(_local, 'vehicle_call', False):
+                return method(self, *args, **kwargs)
+            pwm = self.wheels.pwm
+            _local.vehicle_call = True
+            try:
+                # This thread's transactions only, so other threads' bus traffic isn't counted against the call
+                transactions = pwm.thread_transactions()
+                start = perf_counter_ns()
+                result = method(self, *args, **kwargs)
+                latency = perf_counter_ns() - start
+                transactions = pwm.thread_transactions() - transactions
+            finally:
+                _local.vehicle_call = False
+            with _lock:
+                op.latency.record(latency)
+                op.transactions += transactions
+            return result
+    else:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = perf_counter_ns()
+            result = method(self, *args, **kwargs)
+            latency = perf_counter_ns() - start
+            with _lock:
+                op.latency.record(latency)
+            return result
+    return wrapper
+
+
+def enable():
+    """Start instrumenting (affects every instance, existing and new)"""
+    if _originals:
+        return
+    for module_name, class_name, method_name, name, counts in INSTRUMENTED:
+        cls = getattr(importlib.import_module(module_name), class_name)
+        method = cls.__dict__[method_name]
+        _originals.append((cls, method_name, method))
+        setattr(cls, method_name, _timed(name, method, counts))
+
+
+def disable():
+    """Stop instrumenting (the original methods are put back, the recorded metrics are kept)"""
+    while _originals:
+        cls, method_name, method = _originals.pop()
+        setattr(cls, method_name, method)
+
+
+def enabled():
+    """Is the instrumentation on?"""
+    return bool(_originals)
+
+
+def snapshot(reset=False):
+    """Dictionary of {operation name: stats} for every operation that has been called
+    Args:
+           reset: clear the metrics after taking the snapshot (so each snapshot covers an interval)
+    """
+    with _lock:
+        stats = {name: op.stats() for name, op in operations.items() if op.latency.count}
+        if reset:
+            for op in operations.values():
+                op.reset()
+    return stats
+
+
+def format_snapshot(stats):
+    """One line per operation: count, timeout rate, transactions per call and latency percentiles (us)"""
+    lines = []
+    for name, op in sorted(stats.items()):
+        line = '{:s}: {:d} calls  p50 {:.1f}us  p99 {:.1f}us  p99.9 {:.1f}us  max {:.1f}us'.format(
+            name, op['count'], op['p50'] / 1000, op['p99'] / 1000, op['p99.9'] / 1000, op['max'] / 1000)
+        if op['timeouts']:
+            line += '  timeouts {:.1%}'.format(op['timeout_rate'])
+        if op['transactions']:
+            line += '  {:.1f} transactions/call'.format(op['transactions_per_call'])
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def start_dump(interval=10.0, output=None, reset=True):
+    """Periodically hand a snapshot to output(stats) (defaults to printing format_snapshot())
+    Args:
+           interval: seconds between dumps
+           output: function called with each snapshot
+           reset: each snapshot covers just the last interval (otherwise they're cumulative)
+    """
+    global _dump_thread
+    stop_dump()
+    output = output or (lambda stats: print(format_snapshot(stats)))
+
+    def run():
+        deadline = time.monotonic()
+        while True:
+            deadline += interval
+            if _dump_stop.wait(max(deadline - time.monotonic(), 0.0)):
+                return
+            output(snapshot(reset=reset))
+    _dump_stop.clear()
+    _dump_thread = threading.Thread(target=run, name='robot_kit_metrics', daemon=True)
+    _dump_thread.start()
+
+
+def stop_dump():
+    """Stop the periodic dump"""
+    global _dump_thread
+    _dump_stop.set()
+    if _dump_thread is not None:
+        _dump_thread.join()
+        _dump_thread = None
+
+
+def test():
+    """Test for the metrics: instrument a simulated kit, then check disabling restores the originals"""
+    from robot_kit import hw  # Not this module's globals, which are __main__'s when run as a script
+    previous = hw.backend()
+    hw.use('sim')
+    try:
+        _test()
+    finally:
+        hw.use(previous)
+        hw.reset()
+
+
+def _test():
+    """Internal: The test body, run on the simulated backends by test()"""
+    from robot_kit import metrics  # Not this module's globals, which are __main__'s when run as a script
+    from robot_kit.bus import SimulatedBus
+    from robot_kit.gpio import FakeGPIO
+    from robot_kit.vehicle import Vehicle
+    from robot_kit.ultrasonic import Ultrasonic
+    from robot_kit.leds import NeoPixelStrip
+    from robot_kit.PCA9685 import PCA9685
+
+    write = PCA9685.write
+    vehicle = Vehicle(bus=SimulatedBus())
+    gpio = FakeGPIO()
+    gpio.attach_sensor(27, 22, distance=50.0)
+    sensor = Ultrasonic(gpio=gpio)
+    leds = NeoPixelStrip()
+
+    # Off: nothing is wrapped and nothing is recorded
+    vehicle.forward(0.5)
+    assert PCA9685.write is write and not metrics.snapshot()
+
+    # On: existing instances are measured
+    metrics.enable()
+    dumps = []
+    metrics.start_dump(interval=0.2, output=dumps.append, reset=False)
+    for speed in [0.3, 0.6, 0.9]:
+        vehicle.forward(speed)
+        vehicle.turn_left(speed)
+        sensor.get_distance()
+        leds.on(0, int(255 * speed), 0)
+    gpio.set_distance(22, None)  # No echo
+    sensor.get_distance()
+    vehicle.stop()
+    leds.off()
+    time.sleep(0.3)
+    metrics.stop_dump()
+    stats = metrics.snapshot()
+    print(metrics.format_snapshot(stats))
+    assert dumps and stats['vehicle.forward']['count'] == 3 and stats['leds.on']['count'] == 3
+    assert stats['vehicle.forward']['transactions_per_call'] >= 1
+    assert stats['ultrasonic.echo']['count'] == 16 and stats['ultrasonic.echo']['timeouts'] == 1
+    assert 'vehicle.drive' not in stats  # Only called from inside forward(), turn_left() and stop()
+
+    # Another thread's bus traffic isn't counted against our calls
+    def speed_up(busy):
+        stop = threading.Event()
+
+        def other():
+            while not stop.is_set():
+                vehicle.wheels.pwm.write(0xFE, 121)  # PRESCALE, a real write every other time
+                vehicle.wheels.pwm.write(0xFE, 3)
+        thread = threading.Thread(target=other)
+        if busy:
+            thread.start()
+        vehicle.stop()
+        metrics.snapshot(reset=True)
+        for speed in [0.2, 0.4, 0.6, 0.8]:
+            vehicle.forward(speed)
+            time.sleep(0.001)
+        stop.set()
+        if busy:
+            thread.join()
+        return metrics.snapshot()['vehicle.forward']['transactions']
+    assert speed_up(busy=True) == speed_up(busy=False)
+
+    # Off again
+    metrics.disable()
+    metrics.snapshot(reset=True)
+    vehicle.forward(0.5)
+    assert PCA9685.write is write and not metrics.snapshot()
+    vehicle.stop()
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
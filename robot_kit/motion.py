@@ -0,0 +1,179 @@
+"""Speed ramping for the Wheels: acceleration limited motion profiles stepped by a background ticker"""
+import time
+import threading
+
+
+class MotionProfile:
+    """Ramps each wheel toward its target speed at a limited acceleration, one batched update per tick
+       Usage:
+            profile = MotionProfile(Wheels(), acceleration=2.0, rate_hz=50, shape='scurve')
+            profile.start()
+            profile.all(0.6)  # Ramp every wheel up to 0.6 (0.3s at 2.0/s)
+            profile.set_targets({'left_front': -0.5, 'left_rear': -0.5})  # Preempts the ramp in progress
+            profile.stop()  # Ramp down to zero
+            profile.halt()  # Zero right now (no ramp)
+            profile.shutdown()
+
+       Note: Instead of start() you can register profile.step with a robot_kit.control.ControlLoop
+             Shapes: 'linear' ramps at the acceleration limit, 'scurve' eases in and out
+                     (smoothstep) with a peak acceleration of the limit.
+    """
+    SCURVE_STEPS = 256
+
+    def __init__(self, wheels, acceleration=2.0, rate_hz=50, shape='linear'):
+        """MotionProfile Initialization
+        Args:
+               wheels: the Wheels to drive
+               acceleration: maximum change in speed per second (speed is -1 to 1)
+               rate_hz: ticker rate
+               shape: 'linear' or 'scurve'
+        """
+        if shape not in ('linear', 'scurve'):
+            raise ValueError('Unknown motion profile shape: {:s}'.format(shape))
+        if acceleration <= 0 or rate_hz <= 0:
+            raise ValueError('Acceleration and rate_hz must be positive')
+        self.wheels = wheels
+        self.acceleration = acceleration
+        self.rate_hz = rate_hz
+        self.shape = shape
+
+        # Smoothstep lookup (position along the ramp for each fraction of its duration)
+        self._scurve = [3*u*u - 2*u*u*u for u in (i/self.SCURVE_STEPS for i in range(self.SCURVE_STEPS + 1))]
+
+        # Ramp state per wheel: [start speed, target speed, start time (ns), duration (ns)]
+        wheel_names = list(wheels._wheel_channels)
+        self.speeds = {wheel: 0.0 for wheel in wheel_names}
+        self._ramps = {wheel: [0.0, 0.0, 0, 0] for wheel in wheel_names}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def set_targets(self, targets):
+        """Start ramping the given wheels ({wheel: speed}) from wherever they are right now"""
+        now = time.perf_counter_ns()
+        with self._lock:
+            for wheel, target in targets.items():
+                target = min(max(target, -1.0), 1.0)
+                ramp = self._ramps[wheel]
+                start = self._speed_at(ramp, now)
+                duration = abs(target - start) / self.acceleration
+                if self.shape == 'scurve':
+                    duration *= 1.5  # Smoothstep peaks at 1.5x the average slope
+                ramp[:] = [start, target, now, int(duration * 1e9)]
+        self._wake.set()
+
+    def all(self, speed):
+        """Ramp all of the wheels to the given speed"""
+        self.set_targets({wheel: speed for wheel in self._ramps})
+
+    def stop(self):
+        """Ramp all of the wheels down to zero"""
+        self.all(0.0)
+
+    def halt(self):
+        """Stop all of the wheels immediately (no ramp)"""
+        with self._lock:
+            for wheel, ramp in self._ramps.items():
+                ramp[:] = [0.0, 0.0, 0, 0]
+                self.speeds[wheel] = 0.0
+            self.wheels.stop()
+
+    def ramping(self):
+        """Are any of the wheels still ramping?"""
+        return any(speed != ramp[1] for speed, ramp in zip(self.speeds.values(), self._ramps.values()))
+
+    def step(self):
+        """Move every ramping wheel along its profile and send one batched update (called every tick)"""
+        now = time.perf_counter_ns()
+        with self._lock:
+            changed = {}
+            for wheel, ramp in self._ramps.items():
+                speed = self._speed_at(ramp, now)
+                if speed != self.speeds[wheel]:
+                    self.speeds[wheel] = changed[wheel] = speed
+            if changed:
+                self.wheels.set_speeds(changed)
+
+    def start(self):
+        """Step the profile on a background ticker thread"""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='robot_kit_motion', daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        """Stop the ticker thread (the wheels keep their current speed, call halt() to stop them)"""
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _speed_at(self, ramp, now):
+        """Internal: Where a ramp is at the given time"""
+        start, target, start_ns, duration_ns = ramp
+        elapsed = now - start_ns
+        if elapsed >= duration_ns:
+            return target
+        fraction = elapsed / duration_ns
+        if self.shape == 'scurve':
+            fraction = self._scurve[int(fraction * self.SCURVE_STEPS)]
+        return start + (target - start) * fraction
+
+    def _run(self):
+        """Internal: Ticker thread, steps on absolute deadlines and sleeps while nothing is ramping"""
+        period_ns = int(1e9 / self.rate_hz)
+        deadline = time.perf_counter_ns()
+        while not self._stop_event.is_set():
+            self.step()
+            if not self.ramping():
+                self._wake.clear()
+                if not self.ramping():
+                    self._wake.wait()
+                deadline = time.perf_counter_ns()
+                continue
+            deadline += period_ns
+            now = time.perf_counter_ns()
+            if deadline < now:
+                deadline = now
+            self._stop_event.wait((deadline - now) / 1e9)
+
+
+def test():
+    """Test for the MotionProfile class on the simulated bus"""
+    from robot_kit.bus import SimulatedBus
+    from robot_kit.wheels import Wheels
+
+    bus = SimulatedBus()
+    wheels = Wheels(bus=bus)
+    for shape in ['linear', 'scurve']:
+        profile = MotionProfile(wheels, acceleration=2.0, rate_hz=50, shape=shape)
+        profile.start()
+
+        # Ramp up to 0.6 (0.3s linear, 0.45s scurve) and check we're only part way there early on
+        bus.reset_stats()
+        profile.all(0.6)
+        time.sleep(0.1)
+        assert 0.0 < profile.speeds['left_front'] < 0.6
+        time.sleep(0.5)
+        assert profile.speeds['left_front'] == 0.6 and not profile.ramping()
+        ticks = bus.stats['transactions']
+
+        # Preempt a ramp down with a new target
+        profile.stop()
+        time.sleep(0.1)
+        profile.all(0.3)
+        time.sleep(0.5)
+        assert profile.speeds['right_rear'] == 0.3
+        profile.halt()
+        profile.shutdown()
+        print('{:s}: ramp to 0.6 took {:d} transactions'.format(shape, ticks))
+
+        # The chip has the duty for zero
+        assert not any(bus.registers(0x40)[0x06:0x06+4*8])
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
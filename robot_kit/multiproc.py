@@ -0,0 +1,485 @@
+"""Multiprocess runtime: the wheels, ultrasonic sensor and LEDs each in their own process (and GIL)
+
+   The processes exchange the latest drive command, distance reading and LED color through seqlock
+   slots in one shared memory block (no queues, no pickling, readers never block the writer), and a
+   supervisor thread in the parent restarts workers that die and stops the wheels when one does.
+
+   Usage:
+        runtime = Runtime()  # Uses robot_kit.hw's backend ('real' on the Pi, or hw.use('sim'))
+        runtime.start()
+        runtime.drive(0.5, 0.1)  # Returns immediately, the wheels worker applies the latest command
+        runtime.leds(0, 255, 0)
+        timestamp_ns, distance = runtime.reading  # Latest ultrasonic reading
+        runtime.stats()  # Restarts, fast stops, ...
+        runtime.shutdown()  # Wheels stopped, workers joined, shared memory released
+
+   Note: Timestamps are time.perf_counter_ns(), which is CLOCK_MONOTONIC on Linux and so comparable
+         across the processes.
+"""
+import os
+import time
+import math
+import struct
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from robot_kit import hw
+
+SEQUENCE = struct.Struct('<Q')
+SLOT_SIZE = 64  # One cache line per slot, so writers in different processes don't share lines
+ALL_LED_OFF_H = 0xFD  # PCA9685 register, FULL_OFF turns every channel off in one write
+FULL_OFF = 0x10
+
+# Slot name -> payload layout (every payload starts with a perf_counter_ns timestamp)
+LAYOUT = {
+    'drive': '<qfff',  # command time, linear, angular, lateral
+    'applied': '<qq',  # command time, time the wheels worker finished applying it
+    'distance': '<qd',  # reading time, distance (cm, the sensor's timeout_distance for no echo)
+    'leds': '<qBBB',  # command time, red, green, blue
+    'heartbeat.wheels': '<q',
+    'heartbeat.ultrasonic': '<q',
+    'heartbeat.leds': '<q',
+}
+WORKERS = ['wheels', 'ultrasonic', 'leds']
+
+
+class Slot:
+    """A seqlock protected record at an offset in a shared buffer: one writer, any number of readers
+       Usage:
+            slot = Slot(buffer, 0, '<qd')
+            slot.write(time.perf_counter_ns(), 42.0)  # Writer (one process only, its threads take turns)
+            sequence, (timestamp, distance) = slot.read()  # Readers, sequence changes on every write
+
+       The writer bumps the sequence number to odd, writes the payload and bumps it to even. A reader
+       that sees an odd sequence, or a different one after reading the payload, raced a write and
+       tries again, so readers never see a torn record and never make the writer wait.
+
+       Note: A writer that dies mid-write leaves the sequence odd: readers give up after a timeout
+             (TimeoutError) and attaching the slot again (e.g. the restarted writer) rounds it up to even.
+    """
+    def __init__(self, buffer, offset, layout):
+        """Slot Initialization"""
+        self.buffer = buffer
+        self.offset = offset
+        self.payload = struct.Struct(layout)
+        if SEQUENCE.size + self.payload.size > SLOT_SIZE:
+            raise ValueError('Slot layout {:s} is bigger than {:d} bytes'.format(layout, SLOT_SIZE))
+        self.retries = 0
+        self._write_lock = threading.Lock()  # e.g. Runtime.drive() and the supervisor's fast_stop()
+        self._sequence = SEQUENCE.unpack_from(buffer, offset)[0]
+        if self._sequence & 1:
+            self._sequence += 1
+            SEQUENCE.pack_into(buffer, offset, self._sequence)
+
+    def write(self, *values):
+        """Publish a new record"""
+        with self._write_lock:
+            SEQUENCE.pack_into(self.buffer, self.offset, self._sequence + 1)
+            self.payload.pack_into(self.buffer, self.offset + SEQUENCE.size, *values)
+            self._sequence += 2
+            SEQUENCE.pack_into(self.buffer, self.offset, self._sequence)
+
+    def read(self, timeout=0.1):
+        """The latest record as (sequence, values), sequence 0 means nothing was written yet
+        Args:
+               timeout: seconds to keep retrying a write that doesn't finish before raising TimeoutError
+        """
+        deadline = None
+        while True:
+            before = SEQUENCE.unpack_from(self.buffer, self.offset)[0]
+            if not before & 1:
+                values = self.payload.unpack_from(self.buffer, self.offset + SEQUENCE.size)
+                if SEQUENCE.unpack_from(self.buffer, self.offset)[0] == before:
+                    return before, values
+            self.retries += 1
+            time.sleep(0)  # Let a writer in this process (which the GIL may have paused mid-write) finish
+            if deadline is None:
+                deadline = time.perf_counter() + timeout
+            elif time.perf_counter() > deadline:
+                raise TimeoutError('Slot at offset {:d} is stuck mid-write (did its writer die?)'.format(self.offset))
+
+
+class Slots:
+    """All of the LAYOUT slots in one shared memory block (created in the parent, attached by name in the workers)"""
+    def __init__(self, name=None):
+        """Slots Initialization (name None creates the block)"""
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=SLOT_SIZE * len(LAYOUT))
+        if self.owner:
+            self.memory.buf[:] = bytes(len(self.memory.buf))
+        self.name = self.memory.name
+        for index, (slot, layout) in enumerate(LAYOUT.items()):
+            setattr(self, slot.replace('.', '_'), Slot(self.memory.buf, index * SLOT_SIZE, layout))
+
+    def __getitem__(self, slot):
+        return getattr(self, slot.replace('.', '_'))
+
+    def close(self):
+        """Detach (and release the block, if we created it)"""
+        for slot in LAYOUT:
+            self[slot].buffer = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def _worker_setup(name, backend, setup):
+    """Internal: Common worker start up, returns the attached Slots"""
+    if setup is not None:
+        setup()
+    hw.use(backend)
+    hw.reset()  # A forked worker mustn't share the parent's bus/GPIO objects (or their simulated state)
+    return Slots(name)
+
+
+def wheels_worker(name, backend, stop_event, setup=None, address=0x40, poll_interval=0.001, command_timeout=0.5):
+    """Wheels process: applies the latest drive command, stopping if the commands stop coming
+    Args:
+           name: the shared memory block (Slots.name)
+           backend: robot_kit.hw backend name (or a {kind: name} selection, see hw.backend())
+           stop_event: multiprocessing.Event that ends the worker (the wheels are stopped on the way out)
+           setup: optional module level function called first (e.g. to register a hw backend)
+           poll_interval: seconds between checks for a new command
+           command_timeout: stop the wheels if no new command comes in this long (None to never)
+    """
+    from robot_kit.vehicle import Vehicle
+    slots = _worker_setup(name, backend, setup)
+    vehicle = Vehicle(address=address)
+    vehicle.stop()
+    applied = 0
+    moving = False
+    try:
+        while not stop_event.is_set():
+            now = time.perf_counter_ns()
+            slots.heartbeat_wheels.write(now)
+            sequence, (timestamp, linear, angular, lateral) = slots.drive.read()
+            if sequence != applied:
+                applied = sequence
+                vehicle.drive(linear, angular, lateral)
+                moving = bool(linear or angular or lateral)
+                slots.applied.write(timestamp, time.perf_counter_ns())
+            elif moving and command_timeout is not None and now - timestamp > command_timeout * 1e9:
+                vehicle.stop()
+                moving = False
+            time.sleep(poll_interval)
+    finally:
+        vehicle.stop()
+        slots.close()
+
+
+def ultrasonic_worker(name, backend, stop_event, setup=None, rate_hz=20):
+    """Ultrasonic process: publishes every reading (the busy wait ranging only costs this process its GIL)"""
+    from robot_kit.ultrasonic import Ultrasonic
+    slots = _worker_setup(name, backend, setup)
+    try:
+        for timestamp, distance in Ultrasonic().stream(rate_hz):
+            slots.distance.write(timestamp, distance)
+            slots.heartbeat_ultrasonic.write(time.perf_counter_ns())
+            if stop_event.is_set():
+                break
+    finally:
+        slots.close()
+
+
+def leds_worker(name, backend, stop_event, setup=None, poll_interval=0.01):
+    """LEDs process: shows the latest color"""
+    from robot_kit.leds import NeoPixelStrip
+    slots = _worker_setup(name, backend, setup)
+    strip = NeoPixelStrip()
+    shown = 0
+    try:
+        while not stop_event.is_set():
+            slots.heartbeat_leds.write(time.perf_counter_ns())
+            sequence, (timestamp, red, green, blue) = slots.leds.read()
+            if sequence != shown:
+                shown = sequence
+                strip.on(red, green, blue)
+            time.sleep(poll_interval)
+    finally:
+        strip.off()
+        slots.close()
+
+
+class Runtime:
+    """Runs the kit's subsystems in worker processes, supervised from this one (see the module docstring)"""
+    TARGETS = {'wheels': wheels_worker, 'ultrasonic': ultrasonic_worker, 'leds': leds_worker}
+
+    def __init__(self, backend=None, workers=None, setup=None, options=None, address=0x40,
+                 heartbeat_timeout=1.0, max_restarts=5, supervise_interval=0.01):
+        """Runtime Initialization
+        Args:
+               backend: robot_kit.hw backend for the workers (defaults to this process's)
+               workers: which of WORKERS to run (defaults to all of them)
+               setup: optional module level function each worker calls first (e.g. to register a hw backend)
+               options: {worker: {keyword: value}} extra arguments for the worker functions
+               address: I2C address of the wheels' PCA9685 (for the workers and the fast stop)
+               heartbeat_timeout: a worker that hasn't checked in for this long (seconds) is restarted
+               max_restarts: per worker, after that the wheels are stopped and the worker stays down
+               supervise_interval: seconds between supervisor checks
+        """
+        self.backend = hw.backend() if backend is None else backend
+        self.workers = list(WORKERS if workers is None else workers)
+        self.setup = setup
+        self.options = options or {}
+        self.address = address
+        self.heartbeat_timeout_ns = int(heartbeat_timeout * 1e9)
+        self.max_restarts = max_restarts
+        self.supervise_interval = supervise_interval
+        self.restarts = {worker: 0 for worker in self.workers}
+        self.failed = []  # Workers that ran out of restarts
+        self.fast_stops = 0
+        self.slots = None
+        self.processes = {}
+        self._started_ns = {}
+        self._context = multiprocessing.get_context()
+        self._stop_event = self._context.Event()
+        self._supervising = threading.Event()
+        self._supervisor = None
+
+    @property
+    def reading(self):
+        """The latest ultrasonic reading: (perf_counter_ns timestamp, distance in cm), (0, NaN) before the first"""
+        sequence, reading = self.slots.distance.read()
+        return reading if sequence else (0, math.nan)
+
+    @property
+    def distance(self):
+        """The latest ultrasonic distance (cm)"""
+        return self.reading[1]
+
+    def drive(self, linear, angular, lateral=0.0):
+        """Send a drive command (see Vehicle.drive) to the wheels worker"""
+        self.slots.drive.write(time.perf_counter_ns(), linear, angular, lateral)
+
+    def stop(self):
+        """Stop the wheels"""
+        self.drive(0.0, 0.0)
+
+    def leds(self, red, green, blue):
+        """Set the LED color"""
+        self.slots.leds.write(time.perf_counter_ns(), red, green, blue)
+
+    def start(self):
+        """Create the shared slots, start the workers and the supervisor"""
+        self.slots = Slots()
+        self._stop_event.clear()
+        for worker in self.workers:
+            self._spawn(worker)
+        self._supervising.clear()
+        self._supervisor = threading.Thread(target=self._supervise, name='robot_kit_supervisor', daemon=True)
+        self._supervisor.start()
+
+    def shutdown(self, timeout=2.0):
+        """Stop the wheels and the workers (terminating any that don't exit in time), release the slots"""
+        self._supervising.set()
+        if self._supervisor is not None:
+            self._supervisor.join()
+            self._supervisor = None
+        self.stop()
+        self._stop_event.set()
+        deadline = time.monotonic() + timeout
+        for process in self.processes.values():
+            process.join(max(deadline - time.monotonic(), 0.0))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.processes = {}
+        self.slots.close()
+
+    def kill(self, worker):
+        """Kill a worker outright (to test the supervisor)"""
+        self.processes[worker].kill()
+
+    def stats(self):
+        """Dictionary of the restarts, fast stops, failed workers and which workers are alive"""
+        return {'restarts': dict(self.restarts), 'fast_stops': self.fast_stops, 'failed': list(self.failed),
+                'alive': [worker for worker, process in self.processes.items() if process.is_alive()]}
+
+    def fast_stop(self):
+        """Stop the wheels as fast as we can from this process: a zero command for the wheels worker
+           and, if it's not running, one raw ALL_LED off write to the chip ourselves (on this process's
+           hw.bus(), with no PCA9685 driver or register shadow here to go stale)
+        """
+        self.fast_stops += 1
+        self.stop()
+        wheels = self.processes.get('wheels')
+        if wheels is None or not wheels.is_alive():
+            hw.bus().write_byte_data(self.address, ALL_LED_OFF_H, FULL_OFF)
+
+    def _spawn(self, worker):
+        """Internal: Start (or restart) a worker process"""
+        options = dict(self.options.get(worker, {}))
+        if worker == 'wheels':
+            options.setdefault('address', self.address)
+        process = self._context.Process(target=self.TARGETS[worker], name='robot_kit_' + worker, daemon=True,
+                                        args=(self.slots.name, self.backend, self._stop_event, self.setup),
+                                        kwargs=options)
+        process.start()
+        self.processes[worker] = process
+        self._started_ns[worker] = time.perf_counter_ns()
+
+    def _supervise(self):
+        """Internal: Supervisor thread, restarts dead or hung workers (stopping the wheels first)"""
+        while not self._supervising.wait(self.supervise_interval):
+            now = time.perf_counter_ns()
+            for worker, process in list(self.processes.items()):
+                if worker in self.failed:
+                    continue
+                try:
+                    heartbeat = max(self.slots['heartbeat.' + worker].read()[1][0], self._started_ns[worker])
+                except TimeoutError:
+                    heartbeat = 0  # Died mid heartbeat, the restarted worker repairs the slot
+                hung = now - heartbeat > self.heartbeat_timeout_ns
+                if process.is_alive() and not hung:
+                    continue
+                if hung and process.is_alive():
+                    process.kill()
+                process.join()
+                self.fast_stop()
+                if self.restarts[worker] >= self.max_restarts:
+                    self.failed.append(worker)
+                    continue
+                self.restarts[worker] += 1
+                self._spawn(worker)
+
+
+def _crash():
+    """Internal: A worker setup that dies straight away (for the test)"""
+    os._exit(1)
+
+
+def test():
+    """Test for the Runtime: simulated workers, drive/LED/distance round trips and crash recovery"""
+    from robot_kit import hw  # Not this module's globals, which are __main__'s when run as a script
+    previous = hw.backend()
+    hw.use('sim')
+    try:
+        _test()
+    finally:
+        hw.use(previous)
+        hw.reset()
+
+
+def _test():
+    """Internal: The test body, run on the simulated backends by test()"""
+    from robot_kit import hw  # Not this module's globals, which are __main__'s when run as a script
+    from robot_kit.multiproc import Runtime, Slots, Slot, SEQUENCE, LAYOUT, _crash
+
+    # The seqlock: a reader never sees a torn record while another thread writes flat out
+    slots = Slots()
+    writer_done = threading.Event()
+
+    def write():
+        for value in range(20000):
+            slots.applied.write(value, -value)
+        writer_done.set()
+    threading.Thread(target=write).start()
+    while not writer_done.is_set():
+        sequence, (value, negative) = slots.applied.read()
+        assert value == -negative
+    assert slots.applied.read() == (40000, (19999, -19999))
+
+    # A writer that died mid-write: readers time out, and the next writer to attach carries on from even
+    SEQUENCE.pack_into(slots.memory.buf, slots.applied.offset, 40001)
+    try:
+        slots.applied.read(timeout=0.01)
+        assert False, 'Expected a TimeoutError'
+    except TimeoutError:
+        pass
+    writer = Slot(slots.memory.buf, slots.applied.offset, LAYOUT['applied'])
+    writer.write(1, 2)
+    assert slots.applied.read() == (40004, (1, 2))
+    writer.buffer = None
+    slots.close()
+
+    # Two writers in this process (a caller driving and the supervisor's fast stop): every sequence
+    # number a reader sees stands for one record, and no write is lost
+    runtime = Runtime(workers=[])
+    runtime.start()
+    sequence = runtime.slots.drive.read()[0]
+
+    class SlowPayload(struct.Struct):
+        def pack_into(self, buffer, offset, timestamp, linear, *velocity):
+            if linear:
+                time.sleep(0.001)  # Drive commands are slow to write, a stop can land in the middle of one
+            super().pack_into(buffer, offset, timestamp, linear, *velocity)
+            if linear:
+                time.sleep(0.001)
+    runtime.slots.drive.payload = SlowPayload(LAYOUT['drive'])
+    records = {}
+    mixed = []
+    writers_done = threading.Event()
+
+    def read():
+        while not writers_done.is_set():
+            try:
+                seen, values = runtime.slots.drive.read()
+            except TimeoutError as error:  # Left odd, by writes that overlapped
+                mixed.append(error)
+                return
+            if records.setdefault(seen, values) != values:
+                mixed.append((seen, records[seen], values))
+    reader = threading.Thread(target=read)
+    reader.start()
+
+    def drive():
+        for speed in range(1, 201):
+            runtime.drive(speed / 200, 0.0)
+            time.sleep(0.0003)  # Leave the reader some even sequences to see
+    driving = threading.Thread(target=drive)
+    driving.start()
+    stops = 0
+    while driving.is_alive() or not stops:
+        runtime.fast_stop()
+        stops += 1
+        time.sleep(0.0003)
+    driving.join()
+    writers_done.set()
+    reader.join()
+    assert not mixed and runtime.slots.drive.read()[0] == sequence + 2 * (200 + stops), mixed[:3]
+    runtime.shutdown()
+
+    # The kit in three processes
+    runtime = Runtime(heartbeat_timeout=2.0)
+    runtime.start()
+    deadline = time.monotonic() + 5.0
+    readings = {}
+    while len(readings) < 5 and time.monotonic() < deadline:
+        timestamp, distance = runtime.reading
+        if timestamp:
+            readings[timestamp] = distance
+        time.sleep(0.01)
+    distances = sorted(readings.values())
+    assert abs(distances[len(distances) // 2] - 100.0) < 3.0, distances  # The simulated sensor is at 100cm
+    runtime.leds(0, 255, 0)
+    for speed in [0.3, 0.6, 0.9]:
+        runtime.drive(speed, 0.0)
+        time.sleep(0.05)
+    sequence, (command, applied) = runtime.slots.applied.read()
+    print('Drive command applied {:.0f}us after it was sent'.format((applied - command) / 1000))
+    assert sequence and applied > command
+
+    # Kill the wheels: the supervisor stops them (from here, the worker is gone) and restarts the worker
+    runtime.kill('wheels')
+    while runtime.restarts['wheels'] == 0 and time.monotonic() < deadline + 5.0:
+        time.sleep(0.01)
+    stats = runtime.stats()
+    print(stats)
+    assert stats['restarts']['wheels'] == 1 and stats['fast_stops'] >= 1
+    registers = hw.bus().registers(0x40)
+    assert all(registers[0x09 + 4*channel] & 0x10 for channel in range(8))  # Our own ALL_LED off write
+    runtime.shutdown()
+
+    # A worker that can't start: restarted up to max_restarts, then left down with the wheels stopped
+    runtime = Runtime(workers=['leds'], setup=_crash, max_restarts=2, supervise_interval=0.005)
+    runtime.start()
+    while not runtime.failed and time.monotonic() < deadline + 20.0:
+        time.sleep(0.01)
+    assert runtime.failed == ['leds'] and runtime.restarts['leds'] == 2
+    runtime.shutdown()
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
@@ -0,0 +1,155 @@
+"""A reactive safety layer: stop the vehicle when the ultrasonic sensor sees something too close"""
+import time
+import threading
+from robot_kit.histogram import LatencyHistogram
+
+
+class SafeVehicle:
+    """Wraps a Vehicle and an UltrasonicRanger, stopping the vehicle as soon as a reading comes in
+       under the stopping distance for the current forward speed
+       Usage:
+            ranger = UltrasonicRanger(Ultrasonic(), rate_hz=20, filters=MedianFilter(3))
+            ranger.start()
+            vehicle = SafeVehicle(Vehicle(), ranger, min_distance=15.0, braking_distance=30.0)
+            vehicle.forward(0.8)  # Refused (stops instead) if something is within 15 + 30*0.8 cm
+            ...
+            vehicle.stats()  # Guard stops, refusals and the sense to stop latency (ns)
+
+       Note: The guard runs in the ranger's GPIO callback thread, the moment an echo is timed,
+             and shares a lock with the maneuvers so an in-flight forward() is always followed
+             (never overtaken) by the stop. The ranger's filters add to the reaction time (a median
+             of N lags a step change by N/2 readings), so give the guard a short filter.
+    """
+    def __init__(self, vehicle, ranger, min_distance=15.0, braking_distance=30.0):
+        """SafeVehicle Initialization
+        Args:
+               vehicle: the Vehicle to protect
+               ranger: a started (or soon to be started) UltrasonicRanger facing forward
+               min_distance: stopping distance (cm) at zero speed
+               braking_distance: additional stopping distance (cm) at full speed (scaled by speed)
+        """
+        self.vehicle = vehicle
+        self.ranger = ranger
+        self.min_distance = min_distance
+        self.braking_distance = braking_distance
+        self.speed = 0.0  # Current forward speed (turning and backing up don't close on the obstacle)
+        self.latency = LatencyHistogram()  # Sense (echo edge) to stop (bus write done) in ns
+        self.counts = {'guard_stops': 0, 'refused': 0}
+        self._lock = threading.Lock()
+        ranger.add_listener(self._on_reading)
+
+    def stop_distance(self, speed):
+        """The distance (cm) we need to stop from the given forward speed"""
+        return self.min_distance + self.braking_distance * max(speed, 0.0)
+
+    def forward(self, speed):
+        """Move forward at the given speed, unless that would take us too close to an obstacle"""
+        with self._lock:
+            if self.ranger.distance < self.stop_distance(speed):
+                self.counts['refused'] += 1
+                self.speed = 0.0
+                self.vehicle.stop()
+                return False
+            self.speed = speed
+            self.vehicle.forward(speed)
+            return True
+
+    def drive(self, linear, angular, lateral=0.0):
+        """Drive with the given velocities (see Vehicle.drive), unless the forward component would take
+           us too close to an obstacle (then it's dropped, so turning and strafing away still work)
+        """
+        with self._lock:
+            if linear > 0.0 and self.ranger.distance < self.stop_distance(linear):
+                self.counts['refused'] += 1
+                self.speed = 0.0
+                self.vehicle.drive(0.0, angular, lateral)
+                return False
+            self.speed = max(linear, 0.0)
+            self.vehicle.drive(linear, angular, lateral)
+            return True
+
+    def backward(self, speed):
+        with self._lock:
+            self.speed = 0.0
+            self.vehicle.backward(speed)
+
+    def turn_left(self, speed):
+        with self._lock:
+            self.speed = 0.0
+            self.vehicle.turn_left(speed)
+
+    def turn_right(self, speed):
+        with self._lock:
+            self.speed = 0.0
+            self.vehicle.turn_right(speed)
+
+    def stop(self):
+        with self._lock:
+            self.speed = 0.0
+            self.vehicle.stop()
+
+    def stats(self):
+        """Dictionary of guard counters and the sense to stop latency summary (ns)"""
+        stats = dict(self.counts)
+        stats['latency'] = self.latency.summary()
+        return stats
+
+    def _on_reading(self, timestamp_ns, distance):
+        """Internal: Ranger listener, stops the vehicle if this reading is inside the stopping distance"""
+        if self.speed <= 0.0 or distance >= self.stop_distance(self.speed):
+            return
+        with self._lock:
+            if self.speed <= 0.0:
+                return  # Someone else stopped us while we waited for the lock
+            self.vehicle.stop()
+            self.speed = 0.0
+            self.counts['guard_stops'] += 1
+            self.latency.record(time.perf_counter_ns() - timestamp_ns)
+
+
+def test():
+    """Test for the SafeVehicle class: drive at a simulated wall"""
+    from robot_kit.bus import SimulatedBus
+    from robot_kit.gpio import FakeGPIO
+    from robot_kit.vehicle import Vehicle
+    from robot_kit.ultrasonic import Ultrasonic, UltrasonicRanger
+    from robot_kit.filters import MedianFilter
+
+    gpio = FakeGPIO()
+    gpio.attach_sensor(27, 22, distance=100.0)
+    bus = SimulatedBus(realtime=True)
+    ranger = UltrasonicRanger(Ultrasonic(gpio=gpio), rate_hz=25, filters=MedianFilter(3))
+    vehicle = SafeVehicle(Vehicle(bus=bus), ranger, min_distance=15.0, braking_distance=30.0)
+    ranger.start()
+    time.sleep(0.3)
+
+    # Drive at the wall at 50cm/s (stop distance is 15 + 30*0.5 = 30cm)
+    assert vehicle.forward(0.5)
+    distance = 100.0
+    while vehicle.speed > 0 and distance > 0:
+        distance -= 1.0
+        gpio.set_distance(22, distance)
+        vehicle.forward(0.5)  # The planner keeps asking for speed
+        time.sleep(0.02)
+    ranger.stop()
+    stats = vehicle.stats()
+    print('Stopped at {:.0f}cm, guard stops {:d} refused {:d}, sense to stop p50 {:.0f}us max {:.0f}us'.format(
+          distance, stats['guard_stops'], stats['refused'], stats['latency']['p50']/1000, stats['latency']['max']/1000))
+
+    # We stopped (with every wheel PWM register zeroed) before getting inside the stopping distance by much
+    assert vehicle.speed == 0.0 and distance > 20.0
+    assert not any(bus.registers(0x40)[0x06:0x06+4*8])
+    assert stats['guard_stops'] + stats['refused'] >= 1
+
+    # drive() is guarded too: no forward component this close, but we can still turn away
+    refused = stats['refused']
+    assert not vehicle.drive(0.5, 0.3) and vehicle.speed == 0.0 and vehicle.stats()['refused'] == refused + 1
+    assert any(bus.registers(0x40)[0x06:0x06+4*8])  # Turning in place
+    assert vehicle.drive(-0.5, 0.0)  # Backing away is fine
+    vehicle.stop()
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
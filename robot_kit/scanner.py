@@ -0,0 +1,222 @@
+"""Servo swept ultrasonic scanning: the pan servo and the ranging are pipelined, one NumPy polar array per sweep"""
+import time
+import threading
+import numpy as np
+
+
+def angle_to_pulse(angle):
+    """Servo pulse (us) for an angle in degrees (0.09 degrees per us, 0 is 500us and 180 is 2500us)"""
+    return 500 + angle / 0.09
+
+
+def pulse_to_angle(pulse):
+    """Angle in degrees for a servo pulse (us)"""
+    return (pulse - 500) * 0.09
+
+
+class Scanner:
+    """Sweeps the ultrasonic sensor back and forth on the pan servo, ranging at every step
+       Usage:
+            scanner = Scanner(vehicle.wheels.pwm, Ultrasonic(), start=30, stop=150, step=5)
+            distances = scanner.sweep()  # NumPy array of distances (cm, NaN for no echo) at scanner.angles
+            x, y = scanner.to_xy(distances)  # cm forward and to the left of the sensor
+            for timestamp_ns, distances in scanner.sweeps(10):
+                ...
+            scanner.close()
+
+       Pipelining: Each ping goes out as soon as the servo is within 'tolerance' degrees of its
+                   target (the beam is much wider than that), using a settle time that grows with
+                   the size of the move, so the end of the move overlaps the echo. Sweeps alternate
+                   direction so there's never a long flyback move between them. The echoes are
+                   timed with GPIO edge callbacks (like UltrasonicRanger), not by polling.
+
+       Angles: 90 is straight ahead and angles increase to the left (0 is hard right)
+    """
+    def __init__(self, pwm, ultrasonic, channel=8, start=30.0, stop=150.0, step=5.0,
+                 degrees_per_second=400.0, settle=0.005, tolerance=2.0, ping_interval=0.015, max_distance=400.0):
+        """Scanner Initialization
+        Args:
+               pwm: the PCA9685 driving the servo (e.g. vehicle.wheels.pwm, it must run at 50Hz)
+               ultrasonic: the Ultrasonic sensor on the servo
+               channel: PWM channel of the pan servo (8 on the Freenove kit)
+               start, stop, step: the sweep angles (degrees)
+               degrees_per_second: how fast the servo turns (an SG90 does ~600 unloaded)
+               settle: extra time (seconds) for the servo to stop ringing after a move
+               tolerance: how close (degrees) the servo has to be to its target before we ping
+               ping_interval: minimum time between pings (lets stray echoes die down)
+               max_distance: the furthest distance (cm) to wait for an echo from
+        """
+        self.pwm = pwm
+        self.ultrasonic = ultrasonic
+        self.channel = channel
+        self.angles = np.arange(start, stop + step / 2, step)
+        self.degrees_per_second = degrees_per_second
+        self.settle = settle
+        self.tolerance = tolerance
+        self.ping_interval = ping_interval
+        self.stats = {'sweeps': 0, 'pings': 0, 'timeouts': 0}
+        self._angle = None  # Where we last told the servo to go (None: unknown)
+        self._last_ping = 0.0
+        self._reverse = False
+        self.pwm.setPWMFreq(50)
+
+        # Echo timing from the edge callbacks
+        self.gpio = ultrasonic.gpio
+        self.echo_timeout = max_distance * ultrasonic.time_distance_factor + 0.002
+        self._ns_per_cm = ultrasonic.time_distance_factor * 1e9
+        self._echo = threading.Event()
+        self._rise_ns = None
+        self._distance = None
+        self.gpio.add_event_detect(ultrasonic.echo_pin, self.gpio.BOTH, callback=self._on_edge)
+
+    def close(self):
+        """Remove the edge callbacks"""
+        self.gpio.remove_event_detect(self.ultrasonic.echo_pin)
+
+    def settle_time(self, delta):
+        """Seconds from commanding a move of delta degrees until the servo is close enough to ping"""
+        travel = abs(delta) / self.degrees_per_second
+        return max(travel - self.tolerance / self.degrees_per_second, 0.0) + self.settle
+
+    def move(self, angle):
+        """Command the servo to an angle, returns the perf_counter() time it's ready to ping"""
+        delta = 180.0 if self._angle is None else angle - self._angle
+        self.pwm.setServoPulse(self.channel, angle_to_pulse(angle))
+        self._angle = angle
+        return time.perf_counter() + self.settle_time(delta)
+
+    def ping(self, ready):
+        """Wait until ready (and the ping interval), then range once (NaN for no echo)"""
+        ready = max(ready, self._last_ping + self.ping_interval)
+        wait = ready - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        with self.ultrasonic.lock:  # No other ping on this sensor until our echo is back
+            self._last_ping = time.perf_counter()
+            self._echo.clear()
+            self._rise_ns = None
+            self.ultrasonic._send_trigger_pulse()
+            self.stats['pings'] += 1
+            echoed = self._echo.wait(self.echo_timeout)
+        if not echoed:
+            self.stats['timeouts'] += 1
+            return np.nan
+        return self._distance
+
+    def sweep(self):
+        """One sweep (alternating direction), returns the distances in the order of self.angles"""
+        distances = np.empty(len(self.angles))
+        order = range(len(self.angles) - 1, -1, -1) if self._reverse else range(len(self.angles))
+        for index in order:
+            distances[index] = self.ping(self.move(self.angles[index]))
+        self._reverse = not self._reverse
+        self.stats['sweeps'] += 1
+        return distances
+
+    def sweeps(self, count=None):
+        """Generator of (perf_counter_ns timestamp at the end of the sweep, distances) for count sweeps (None for forever)"""
+        sweeps = 0
+        while count is None or sweeps < count:
+            distances = self.sweep()
+            yield time.perf_counter_ns(), distances
+            sweeps += 1
+
+    def _on_edge(self, channel):
+        """Internal: GPIO callback, timestamps the echo edges"""
+        now = time.perf_counter_ns()
+        if self.gpio.input(channel):
+            self._rise_ns = now
+        elif self._rise_ns is not None and not self._echo.is_set():
+            self._distance = (now - self._rise_ns) / self._ns_per_cm
+            self._echo.set()
+
+    def to_xy(self, distances):
+        """Polar distances at self.angles to (x forward, y left) arrays in cm (NaN stays NaN)"""
+        radians = np.radians(self.angles)
+        return distances * np.sin(radians), -distances * np.cos(radians)
+
+
+class SimulatedServo:
+    """A simulated pan servo behind a SimulatedBus: turns toward the pulse in the chip registers at a fixed speed
+       Usage:
+            servo = SimulatedServo(bus, channel=8)
+            gpio.set_distance(22, lambda: room(servo.angle()))  # What the sensor sees depends on where it points
+    """
+    def __init__(self, bus, address=0x40, channel=8, degrees_per_second=500.0, angle=90.0):
+        """SimulatedServo Initialization"""
+        self.registers = bus.registers(address)
+        self.address = address
+        self.reg = 0x06 + 4*channel + 2  # LEDn_OFF_L
+        self.degrees_per_second = degrees_per_second
+        self._move = (angle, angle, time.perf_counter())  # From angle, to angle, start time
+        bus.add_listener(self._on_write)
+
+    @property
+    def target(self):
+        """Where the servo is heading (the angle in the chip registers)"""
+        return self._move[1]
+
+    def angle(self):
+        """Where the servo is pointing right now"""
+        start, target, started = self._move
+        turned = (time.perf_counter() - started) * self.degrees_per_second
+        if turned >= abs(target - start):
+            return target
+        return start + turned if target > start else start - turned
+
+    def _on_write(self, address, reg, data):
+        """Internal: Bus listener, starts a move when our channel's duty changes"""
+        if address != self.address or not reg <= self.reg + 1 < reg + len(data):
+            return
+        off = self.registers[self.reg] | (self.registers[self.reg + 1] & 0x0F) << 8
+        target = pulse_to_angle(off * 20000 / 4096)
+        if target != self._move[1]:
+            self._move = (self.angle(), target, time.perf_counter())
+
+
+def test():
+    """Test for the Scanner: sweep a simulated servo and sensor in a simulated room"""
+    from robot_kit.bus import SimulatedBus
+    from robot_kit.gpio import FakeGPIO
+    from robot_kit.PCA9685 import PCA9685
+    from robot_kit.ultrasonic import Ultrasonic
+
+    def room(angle):
+        """A wall that's closer straight ahead, and nothing in range past 140 degrees"""
+        return None if angle > 140 else 60.0 + 0.5 * abs(angle - 90)
+
+    def seen():
+        """The room where the servo is heading (so the geometry doesn't depend on timing), noting how far off it still is"""
+        misses.append(abs(servo.angle() - servo.target))
+        return room(servo.target)
+
+    bus = SimulatedBus()
+    servo = SimulatedServo(bus, degrees_per_second=500.0)
+    gpio = FakeGPIO()
+    gpio.attach_sensor(27, 22, distance=seen)
+    scanner = Scanner(PCA9685.shared(bus=bus), Ultrasonic(gpio=gpio), start=30, stop=150, step=5)
+    misses = []
+
+    # The sweeps (both directions) see the room, give or take the odd late edge from the fake GPIO thread
+    # (a busy machine delays a few, so each angle has to be right in at least one sweep and most readings right)
+    expected = np.array([np.nan if room(angle) is None else room(angle) for angle in scanner.angles])
+    start = time.perf_counter()
+    sweeps = np.array([distances for timestamp, distances in scanner.sweeps(4)])
+    elapsed = time.perf_counter() - start
+
+    # The settle model only pings once the servo is within tolerance (it turns faster than the model's
+    # degrees_per_second, and a late ping only gets closer)
+    assert len(misses) == 4 * len(scanner.angles) and max(misses) <= scanner.tolerance, max(misses)
+    right = np.where(np.isnan(expected), np.isnan(sweeps), np.abs(sweeps - expected) < 2.0)
+    assert right.any(axis=0).all() and right.mean() > 0.75, sweeps - expected
+    print('{:.2f} sweeps/s ({:d} angles at {:.0f} degrees), {:s}'.format(
+        4 / elapsed, len(scanner.angles), scanner.angles[1] - scanner.angles[0], str(scanner.stats)))
+    x, y = scanner.to_xy(expected)
+    assert abs(x[scanner.angles == 90][0] - 60.0) < 1e-6 and abs(y[scanner.angles == 90][0]) < 1e-6
+    scanner.close()
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
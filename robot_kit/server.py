@@ -0,0 +1,413 @@
+"""Remote control server: drive, LED and telemetry commands over UDP in a compact binary format
+
+   Usage:
+        $ python -m robot_kit.server --port 5005  # On the Pi (--sim for simulated hardware)
+
+        client = await RemoteClient.connect('robot.local', 5005)
+        client.subscribe(10)  # Telemetry at 10Hz
+        client.drive(0.5, 0.1)  # Send these as often as the joystick moves, the server applies the latest
+        telemetry = await client.telemetry()  # Telemetry(sequence, timestamp_ns, distance, linear, angular, lateral)
+        client.close()
+
+   Protocol: One message per datagram, little-endian, starting with a type byte and a 16 bit sequence
+             number (per client, wrapping). Out of order/duplicate messages are dropped.
+             DRIVE      0x01  <BHfff    linear, angular, lateral (see Vehicle.drive)
+             LED        0x02  <BHBBB    red, green, blue
+             SUBSCRIBE  0x03  <BHH      telemetry rate in Hz (0 to unsubscribe)
+             STOP       0x04  <BH
+             TELEMETRY  0x81  <BHqffff  (server to client) last command sequence, perf_counter_ns timestamp,
+                                        distance (cm, NaN without a sensor), applied linear, angular, lateral
+"""
+import sys
+import math
+import time
+import struct
+import asyncio
+import argparse
+import collections
+from robot_kit.aio import AsyncVehicle, AsyncNeoPixelStrip
+
+# Message types and layouts
+DRIVE = 0x01
+LED = 0x02
+SUBSCRIBE = 0x03
+STOP = 0x04
+TELEMETRY = 0x81
+HEADER = struct.Struct('<BH')
+MESSAGES = {
+    DRIVE: struct.Struct('<BHfff'),
+    LED: struct.Struct('<BHBBB'),
+    SUBSCRIBE: struct.Struct('<BHH'),
+    STOP: HEADER,
+    TELEMETRY: struct.Struct('<BHqffff'),
+}
+Telemetry = collections.namedtuple('Telemetry', ['sequence', 'timestamp_ns', 'distance', 'linear', 'angular', 'lateral'])
+STOPPED = (0.0, 0.0, 0.0)
+
+
+def _clamp(value):
+    return min(max(value, -1.0), 1.0)
+
+
+def _finite(values):
+    """Internal: Are all of the values real numbers (no NaN or infinity)"""
+    return all(math.isfinite(value) for value in values)
+
+
+class ControlServer(asyncio.DatagramProtocol):
+    """Receives remote commands and applies them on a fixed rate control tick
+       Usage:
+            server = ControlServer(Vehicle(), ranger=ranger, strip=NeoPixelStrip())
+            await server.start(port=5005)
+            ...
+            await server.close()  # Stops the wheels
+
+       Coalescing: Commands only record the latest requested state; each control tick applies it
+                   with (at most) one Vehicle.drive() and one LED update, however many packets arrived.
+       Watchdog: If the wheels are moving and no drive command has arrived for 'watchdog' seconds they
+                 are stopped (LED and subscribe packets don't count, they don't mean anyone is steering).
+       Errors: A tick whose vehicle or strip call raises stops the wheels, counts an error and carries on.
+    """
+    def __init__(self, vehicle, ranger=None, strip=None, rate_hz=50, watchdog=0.5, subscription_timeout=5.0):
+        """ControlServer Initialization
+        Args:
+               vehicle: the Vehicle to drive
+               ranger: an UltrasonicRanger (started) whose latest distance goes out in the telemetry
+               strip: the NeoPixelStrip for LED commands (None to ignore them)
+               rate_hz: control tick rate
+               watchdog: seconds without a drive command before a moving vehicle is stopped
+               subscription_timeout: seconds without a packet before a client's telemetry stops
+        """
+        self.vehicle = AsyncVehicle(vehicle)
+        self.ranger = ranger
+        self.strip = AsyncNeoPixelStrip(strip) if strip is not None else None
+        self.period = 1.0 / rate_hz
+        self.watchdog = watchdog
+        self.subscription_timeout = subscription_timeout
+        self.velocity = STOPPED  # What the wheels were last told
+        self.stats = {'packets': 0, 'bad': 0, 'stale': 0, 'coalesced': 0, 'updates': 0,
+                      'watchdog_stops': 0, 'telemetry': 0, 'errors': 0}
+        self.transport = None
+        self.port = None
+        self._drive = None  # Latest requested velocity, applied on the next tick
+        self._led = None  # Latest requested color
+        self._clients = {}  # address -> [last sequence, last packet time]
+        self._subscribers = {}  # address -> [period, next send time]
+        self._last_drive = 0.0  # When the latest DRIVE arrived (for the watchdog)
+        self._task = None
+
+    async def start(self, host='0.0.0.0', port=5005):
+        """Start listening (port 0 picks a free one, see self.port) and start the control tick"""
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(lambda: self, local_addr=(host, port))
+        self.port = self.transport.get_extra_info('sockname')[1]
+        self._task = loop.create_task(self._control())
+        return self
+
+    async def close(self):
+        """Stop the control tick and the wheels, and close the socket"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.vehicle.stop()
+        self.velocity = STOPPED
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    def datagram_received(self, data, address):
+        """Record the latest requested state (applied on the next control tick)"""
+        self.stats['packets'] += 1
+        if len(data) < HEADER.size or data[0] not in MESSAGES or len(data) != MESSAGES[data[0]].size:
+            self.stats['bad'] += 1
+            return
+        kind, sequence = HEADER.unpack_from(data)
+        now = time.monotonic()
+        client = self._clients.get(address)
+        if client is not None and not 0 < (sequence - client[0]) & 0xFFFF < 0x8000:
+            self.stats['stale'] += 1
+            return
+        self._clients[address] = [sequence, now]
+
+        if kind == DRIVE:
+            velocity = MESSAGES[DRIVE].unpack(data)[2:]
+            if not _finite(velocity):
+                self.stats['bad'] += 1
+                return
+            if self._drive is not None:
+                self.stats['coalesced'] += 1
+            self._drive = tuple(_clamp(value) for value in velocity)
+            self._last_drive = now
+        elif kind == STOP:
+            self._drive = STOPPED
+        elif kind == LED:
+            self._led = MESSAGES[LED].unpack(data)[2:]
+        elif kind == SUBSCRIBE:
+            rate_hz = MESSAGES[SUBSCRIBE].unpack(data)[2]
+            if rate_hz:
+                self._subscribers[address] = [1.0 / rate_hz, now]
+            else:
+                self._subscribers.pop(address, None)
+        else:
+            self.stats['bad'] += 1
+
+    async def _control(self):
+        """Internal: Control tick, applies the latest commands on absolute deadlines"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            now = time.monotonic()
+            try:
+                await self._tick(now)
+            except Exception as error:
+                await self._stop_after_error(error)
+            self._send_telemetry(now)
+
+            deadline += self.period
+            now = loop.time()
+            if deadline < now:
+                deadline = now
+            await asyncio.sleep(deadline - now)
+
+    async def _tick(self, now):
+        """Internal: Apply the latest drive (or the watchdog stop) and LED commands"""
+        if self._drive is not None:
+            velocity, self._drive = self._drive, None
+            if velocity != self.velocity:
+                await self.vehicle.drive(*velocity)
+                self.velocity = velocity
+                self.stats['updates'] += 1
+        elif self.velocity != STOPPED and now - self._last_drive > self.watchdog:
+            await self.vehicle.stop()
+            self.velocity = STOPPED
+            self.stats['watchdog_stops'] += 1
+        if self._led is not None and self.strip is not None:
+            rgb, self._led = self._led, None
+            await self.strip.on(*rgb)
+
+    async def _stop_after_error(self, error):
+        """Internal: A tick failed, report it and stop the wheels (the control tick keeps running)"""
+        self.stats['errors'] += 1
+        print('ControlServer: tick failed, stopping the wheels: {!r}'.format(error))
+        try:
+            await self.vehicle.stop()
+        except Exception as stop_error:
+            print('ControlServer: stop failed too: {!r}'.format(stop_error))
+        self.velocity = STOPPED
+
+    def _send_telemetry(self, now):
+        """Internal: Send telemetry to every subscriber that's due"""
+        if not self._subscribers:
+            return
+        distance = self.ranger.distance if self.ranger is not None else float('nan')
+        timestamp = time.perf_counter_ns()
+        for address, subscription in list(self._subscribers.items()):
+            sequence, last_packet = self._clients[address]
+            if now - last_packet > self.subscription_timeout:
+                del self._subscribers[address]
+                continue
+            period, due = subscription
+            if now < due:
+                continue
+            subscription[1] = max(due + period, now)
+            self.transport.sendto(MESSAGES[TELEMETRY].pack(TELEMETRY, sequence, timestamp, distance, *self.velocity), address)
+            self.stats['telemetry'] += 1
+
+
+class RemoteClient(asyncio.DatagramProtocol):
+    """Client for a ControlServer (see the module docstring)"""
+    def __init__(self):
+        """RemoteClient Initialization (use RemoteClient.connect())"""
+        self.transport = None
+        self.sequence = 0
+        self.latest = None  # The latest Telemetry
+        self._queue = asyncio.Queue(maxsize=100)
+
+    @classmethod
+    async def connect(cls, host, port=5005):
+        """A client sending to the server at host:port"""
+        loop = asyncio.get_running_loop()
+        _, client = await loop.create_datagram_endpoint(cls, remote_addr=(host, port))
+        return client
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def drive(self, linear, angular, lateral=0.0):
+        """Request a velocity (see Vehicle.drive)"""
+        self._send(DRIVE, linear, angular, lateral)
+
+    def stop(self):
+        """Stop the wheels"""
+        self._send(STOP)
+
+    def led(self, red, green, blue):
+        """Set the LED strip color"""
+        self._send(LED, red, green, blue)
+
+    def subscribe(self, rate_hz):
+        """Receive telemetry at this rate (0 to stop)"""
+        self._send(SUBSCRIBE, rate_hz)
+
+    async def telemetry(self):
+        """Wait for the next Telemetry"""
+        return await self._queue.get()
+
+    def close(self):
+        self.transport.close()
+
+    def datagram_received(self, data, address):
+        if len(data) == MESSAGES[TELEMETRY].size and data[0] == TELEMETRY:
+            self.latest = Telemetry(*MESSAGES[TELEMETRY].unpack(data)[1:])
+            if self._queue.full():
+                self._queue.get_nowait()  # Keep the newest
+            self._queue.put_nowait(self.latest)
+
+    def _send(self, kind, *values):
+        """Internal: Send one message with the next sequence number"""
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        self.transport.sendto(MESSAGES[kind].pack(kind, self.sequence, *values))
+
+
+async def serve(host='0.0.0.0', port=5005, rate_hz=50, watchdog=0.5, leds=True):
+    """Run a ControlServer for the kit (vehicle, ultrasonic sensor and LEDs) until cancelled"""
+    from robot_kit.vehicle import Vehicle
+    from robot_kit.ultrasonic import Ultrasonic, UltrasonicRanger
+
+    ranger = UltrasonicRanger(Ultrasonic())
+    ranger.start()
+    strip = None
+    if leds:
+        from robot_kit.leds import NeoPixelStrip
+        strip = NeoPixelStrip()
+    server = ControlServer(Vehicle(), ranger=ranger, strip=strip, rate_hz=rate_hz, watchdog=watchdog)
+    await server.start(host, port)
+    print('robot_kit server listening on {:s}:{:d}'.format(host, server.port))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+        ranger.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='robot_kit remote control server (UDP)')
+    parser.add_argument('--host', default='0.0.0.0', help='Address to listen on (default 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=5005, help='UDP port (default 5005)')
+    parser.add_argument('--rate', type=int, default=50, help='Control tick rate in Hz (default 50)')
+    parser.add_argument('--watchdog', type=float, default=0.5, help='Stop after this many seconds without drive commands')
+    parser.add_argument('--no-leds', action='store_true', help="Don't drive the LED strip (it needs sudo on the Pi)")
+    parser.add_argument('--sim', action='store_true', help='Run on simulated hardware')
+    args = parser.parse_args()
+
+    if args.sim:
+        from robot_kit import hw
+        hw.use('sim')
+    try:
+        asyncio.run(serve(args.host, args.port, args.rate, args.watchdog, leds=not args.no_leds))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def test():
+    """Test for the ControlServer: drive a simulated kit over localhost"""
+    from robot_kit import hw  # Not this module's globals, which are __main__'s when run as a script
+    previous = hw.backend()
+    hw.use('sim')
+    try:
+        _test()
+    finally:
+        hw.use(previous)
+        hw.reset()
+
+
+def _test():
+    """Internal: The test body, run on the simulated backends by test()"""
+    from robot_kit.bus import SimulatedBus
+    from robot_kit.gpio import FakeGPIO
+    from robot_kit.vehicle import Vehicle
+    from robot_kit.ultrasonic import Ultrasonic, UltrasonicRanger
+    from robot_kit.aio import shutdown_executors
+
+    from robot_kit.leds import NeoPixelStrip
+    bus = SimulatedBus()
+    gpio = FakeGPIO()
+    gpio.attach_sensor(27, 22, distance=70.0)
+    ranger = UltrasonicRanger(Ultrasonic(gpio=gpio), rate_hz=20)
+    ranger.start()
+    strip = NeoPixelStrip()
+
+    async def main():
+        server = await ControlServer(Vehicle(bus=bus), ranger=ranger, strip=strip, rate_hz=50,
+                                     watchdog=0.3).start('127.0.0.1', 0)
+        client = await RemoteClient.connect('127.0.0.1', server.port)
+        client.subscribe(20)
+
+        # A burst of joystick packets is one wheel update
+        for i in range(1, 51):
+            client.drive(i / 100, 0.1)
+        client.led(0, 0, 255)
+        await asyncio.sleep(0.1)
+        print(server.stats)
+        assert server.velocity[0] == 0.5 and abs(server.velocity[1] - 0.1) < 1e-6
+        assert server.stats['updates'] == 1 and server.stats['coalesced'] == 49
+        assert any(bus.registers(0x40)[0x06:0x26]) and strip.get_rgb() == (0, 0, 255)
+
+        # Old packets are dropped
+        client.sequence -= 10
+        client.drive(-1.0, 0.0)
+        await asyncio.sleep(0.05)
+        assert server.stats['stale'] == 1 and server.velocity[0] == 0.5
+        client.sequence += 10  # Back in order
+
+        # Telemetry comes back (keep driving, the watchdog only counts drive commands)
+        client.drive(0.5, 0.1)
+        await asyncio.sleep(0.2)
+        telemetry = client.latest
+        print(telemetry)
+        assert abs(telemetry.distance - 70.0) < 3.0 and abs(telemetry.linear - 0.5) < 1e-6
+
+        # Go quiet and the watchdog stops the wheels
+        await asyncio.sleep(0.4)
+        assert server.velocity == STOPPED and server.stats['watchdog_stops'] == 1
+        assert not any(bus.registers(0x40)[0x06:0x26])
+
+        # LED packets alone don't keep the wheels going
+        client.drive(0.3, 0.0)
+        for _ in range(10):
+            await asyncio.sleep(0.05)
+            client.led(0, 255, 0)
+        assert server.velocity == STOPPED and server.stats['watchdog_stops'] == 2
+
+        # NaN and infinity are bad packets, not speeds
+        client.drive(float('nan'), 0.0)
+        client.drive(0.2, float('inf'))
+        await asyncio.sleep(0.05)
+        assert server.stats['bad'] == 2 and server.velocity == STOPPED
+
+        # A failing drive stops the wheels, and the control tick carries on
+        async def broken_drive(*velocity):
+            raise OSError('I2C bus error')
+        server.vehicle.drive = broken_drive
+        client.drive(0.25, 0.0)
+        await asyncio.sleep(0.05)
+        del server.vehicle.drive
+        client.drive(0.25, 0.0)
+        await asyncio.sleep(0.05)
+        assert server.stats['errors'] == 1 and server.velocity == (0.25, 0.0, 0.0)
+        client.close()
+        await server.close()
+
+    asyncio.run(main())
+    ranger.stop()
+    strip.off()
+    shutdown_executors()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
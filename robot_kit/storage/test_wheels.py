@@ -1,8 +1,7 @@
 # Servo2.py
 # Two servo motors driven by PCA9685 chip
 
-from smbus import SMBus
-from PCA9685 import PWM
+from robot_kit.PCA9685 import PCA9685
 import time
 
 fPWM = 50
@@ -14,22 +13,22 @@ b = 2   # adapt to your servo
 
 def setup():
     global pwm
-    bus = SMBus(1)  # Raspberry Pi revision 2
-    pwm = PWM(bus, i2c_address)
-    pwm.setFreq(fPWM)
+    pwm = PCA9685(i2c_address)  # I2C bus 1 (Raspberry Pi revision 2), see robot_kit.hw
+    pwm.setPWMFreq(fPWM)
 
 
 def setDirection(direction):
     duty = a / 180 * direction + b
-    pwm.setDuty(channel, duty)
+    pwm.setServoPulse(channel, duty / 100 * 1000000 / fPWM)
     print("direction =", direction, "-> duty =", duty)
     time.sleep(1)  # allow to settle
 
 
-print("starting")
-setup()
-for direction in range(0, 181, 10):
-    setDirection(direction)
-direction = 0
-setDirection(0)
-print("done")
+if __name__ == '__main__':
+    print("starting")
+    setup()
+    for direction in range(0, 181, 10):
+        setDirection(direction)
+    direction = 0
+    setDirection(0)
+    print("done")
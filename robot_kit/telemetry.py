@@ -0,0 +1,253 @@
+"""Telemetry: a compact binary ring log of commands and sensor readings, with memory mapped replay"""
+import os
+import mmap
+import time
+import struct
+import threading
+
+# Record kinds
+BUS_WRITE = 1  # index: register, extra: I2C address, value: byte
+WHEEL_SPEED = 2  # index: wheel (see WHEELS), value: speed
+DISTANCE = 3  # index: 0 get_distance(), 1 read_once(), value: distance (cm, NaN for a timeout)
+LED = 4  # value: 0xRRGGBB
+
+WHEELS = ['left_front', 'left_rear', 'right_front', 'right_rear']
+
+MAGIC = b'RKTL'
+HEADER = struct.Struct('<4sHHIQ')  # magic, version, record size, capacity, records written
+HEADER_SIZE = 64
+RECORD = struct.Struct('<qBBHd')  # perf_counter_ns, kind, index, extra, value
+NUMPY_DTYPE = [('time_ns', '<i8'), ('kind', 'u1'), ('index', 'u1'), ('extra', '<u2'), ('value', '<f8')]
+
+
+class Recorder:
+    """Appends fixed size, timestamped records to a preallocated, memory mapped ring file
+       Usage:
+            recorder = Recorder('run.rktl', capacity=100000)
+            recorder.attach(pwm=vehicle.wheels.pwm, wheels=vehicle.wheels, ultrasonic=sensor, strip=leds)
+            ...  # Drive around
+            recorder.close()
+
+            log = TelemetryLog('run.rktl')
+            log.to_numpy()  # Structured array (time_ns, kind, index, extra, value)
+
+       Note: Once capacity records are written the oldest ones are overwritten
+             record() is thread safe, and attach() can be called more than once (detach() undoes them all)
+    """
+    def __init__(self, filename, capacity=65536):
+        """Recorder Initialization"""
+        self.filename = filename
+        self.capacity = capacity
+        self.count = 0
+        self._attached = []
+        self._lock = threading.Lock()
+        with open(filename, 'wb') as fp:
+            fp.truncate(HEADER_SIZE + capacity * RECORD.size)
+        self._file = open(filename, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._write_header()
+
+    def record(self, kind, index, extra, value):
+        """Append a record (no allocation beyond the packed arguments)"""
+        with self._lock:
+            RECORD.pack_into(self._map, HEADER_SIZE + (self.count % self.capacity) * RECORD.size,
+                             time.perf_counter_ns(), kind, index, extra, value)
+            self.count += 1
+            HEADER.pack_into(self._map, 0, MAGIC, 1, RECORD.size, self.capacity, self.count)
+
+    def attach(self, pwm=None, wheels=None, ultrasonic=None, strip=None):
+        """Record the calls on these device instances (their methods are wrapped until detach())"""
+        if pwm is not None:
+            address = pwm.address
+            write, write_block = pwm.write, pwm.writeBlock
+
+            def recorded_write(reg, value):
+                write(reg, value)
+                self.record(BUS_WRITE, reg, address, value)
+
+            def recorded_write_block(reg, data):
+                write_block(reg, data)
+                for offset, value in enumerate(data):
+                    self.record(BUS_WRITE, reg + offset, address, value)
+            self._wrap(pwm, 'write', recorded_write)
+            self._wrap(pwm, 'writeBlock', recorded_write_block)
+        if wheels is not None:
+            set_speeds = wheels.set_speeds
+
+            def recorded_set_speeds(speeds):
+                set_speeds(speeds)
+                for wheel, speed in speeds.items():
+                    self.record(WHEEL_SPEED, WHEELS.index(wheel), 0, speed)
+            self._wrap(wheels, 'set_speeds', recorded_set_speeds)
+        if ultrasonic is not None:
+            get_distance, read_once = ultrasonic.get_distance, ultrasonic.read_once
+
+            def recorded_get_distance():
+                distance = get_distance()
+                self.record(DISTANCE, 0, 0, distance)
+                return distance
+
+            def recorded_read_once():
+                distance = read_once()
+                self.record(DISTANCE, 1, 0, float('nan') if distance is None else distance)
+                return distance
+            self._wrap(ultrasonic, 'get_distance', recorded_get_distance)
+            self._wrap(ultrasonic, 'read_once', recorded_read_once)
+        if strip is not None:
+            on = strip.on
+
+            def recorded_on(red, green, blue):
+                on(red, green, blue)
+                self.record(LED, 0, 0, red << 16 | green << 8 | blue)
+            self._wrap(strip, 'on', recorded_on)
+
+    def detach(self):
+        """Unwrap all of the attached device methods (newest first, so stacked wrappers unwind)"""
+        for device, name, previous in reversed(self._attached):
+            if previous is None:
+                delattr(device, name)
+            else:
+                setattr(device, name, previous)
+        self._attached = []
+
+    def close(self):
+        """Detach, flush and close the log file"""
+        self.detach()
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+    def _wrap(self, device, name, wrapper):
+        """Internal: Shadow a method on one device instance (remembering any shadow already there)"""
+        self._attached.append((device, name, vars(device).get(name)))
+        setattr(device, name, wrapper)
+
+    def _write_header(self):
+        """Internal: Write the file header"""
+        HEADER.pack_into(self._map, 0, MAGIC, 1, RECORD.size, self.capacity, self.count)
+
+
+class TelemetryLog:
+    """Read only, memory mapped view of a Recorder file
+       Usage:
+            log = TelemetryLog('run.rktl')
+            for time_ns, kind, index, extra, value in log:
+                ...
+            records = log.to_numpy()
+            distances = records[records['kind'] == DISTANCE]['value']
+    """
+    def __init__(self, filename):
+        """TelemetryLog Initialization"""
+        self._file = open(filename, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.capacity, self.written = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or record_size != RECORD.size:
+            raise ValueError('{:s} is not a robot_kit telemetry log'.format(filename))
+        self.count = min(self.written, self.capacity)
+        self.first = self.written % self.capacity if self.written > self.capacity else 0  # Oldest slot
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield RECORD.unpack_from(self._map, HEADER_SIZE + ((self.first + i) % self.capacity) * RECORD.size)
+
+    def to_numpy(self):
+        """All of the records (oldest first) as a NumPy structured array
+           Note: Unless the log has wrapped this is a view into the memory map, drop it before close()
+        """
+        import numpy as np
+        records = np.frombuffer(self._map, dtype=NUMPY_DTYPE, count=self.capacity, offset=HEADER_SIZE)
+        if self.first:
+            return np.concatenate([records[self.first:], records[:self.first]])
+        return records[:self.count]
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def replay(log, bus):
+    """Replay the logged register writes onto a bus (e.g. a SimulatedBus) in order"""
+    for time_ns, kind, index, extra, value in log:
+        if kind == BUS_WRITE:
+            bus.write_byte_data(extra, index, int(value))
+
+
+def test():
+    """Test for the telemetry Recorder: record a drive on simulated hardware and replay it"""
+    import tempfile
+    from robot_kit.bus import SimulatedBus
+    from robot_kit.gpio import FakeGPIO
+    from robot_kit.vehicle import Vehicle
+    from robot_kit.ultrasonic import Ultrasonic
+
+    filename = os.path.join(tempfile.mkdtemp(), 'run.rktl')
+    recorder = Recorder(filename, capacity=1000)
+    bus = SimulatedBus()
+    vehicle = Vehicle(bus=bus)
+    gpio = FakeGPIO()
+    gpio.attach_sensor(27, 22, distance=80.0)
+    sensor = Ultrasonic(gpio=gpio)
+
+    # Attaching twice records twice, and detach() still unwinds cleanly
+    recorder.attach(wheels=vehicle.wheels)
+    recorder.attach(wheels=vehicle.wheels)
+    vehicle.wheels.set_speeds({'left_front': 0.0})
+    assert recorder.count == 2
+    recorder.detach()
+    assert 'set_speeds' not in vars(vehicle.wheels)
+    recorder.count = 0
+    recorder.attach(pwm=vehicle.wheels.pwm, wheels=vehicle.wheels, ultrasonic=sensor)
+
+    # A short run
+    for speed in [0.3, 0.5, 0.7]:
+        vehicle.forward(speed)
+        sensor.get_distance()
+    vehicle.turn_left(0.4)
+    recorder.close()
+
+    # Read it back, and replay it on a new bus (we attached after the chip was set up, so compare the PWM channels)
+    log = TelemetryLog(filename)
+    kinds = [record[1] for record in log]
+    assert kinds.count(DISTANCE) == 3 + 15 and WHEEL_SPEED in kinds
+    replay_bus = SimulatedBus()
+    replay(log, replay_bus)
+    assert replay_bus.registers(0x40)[0x06:0x46] == bus.registers(0x40)[0x06:0x46]
+    print('{:d} records'.format(len(log)))
+    try:
+        records = log.to_numpy()
+        print('Distances: {:s}'.format(str(records[(records['kind'] == DISTANCE) & (records['index'] == 0)]['value'])))
+        del records  # A view into the log's memory map
+    except ImportError:
+        print('NumPy not installed, skipping to_numpy()')
+
+    log.close()
+    vehicle.stop()
+
+    # Wrap around keeps the newest records
+    recorder = Recorder(filename, capacity=10)
+    start = time.perf_counter_ns()
+    for i in range(25):
+        recorder.record(LED, 0, 0, i)
+    print('{:.2f}us per record()'.format((time.perf_counter_ns() - start) / 25 / 1000))
+    recorder.close()
+    assert [record[4] for record in TelemetryLog(filename)] == list(range(15, 25))
+
+    # Threads recording at once never share a slot
+    recorder = Recorder(filename, capacity=4000)
+    threads = [threading.Thread(target=lambda base=base: [recorder.record(LED, 0, 0, base + i) for i in range(1000)])
+               for base in range(0, 4000, 1000)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.close()
+    assert sorted(record[4] for record in TelemetryLog(filename)) == list(range(4000))
+
+
+if __name__ == '__main__':
+
+    # Run the test
+    test()
@@ -1,48 +1,94 @@
 """Ultrasonic Sensor Class"""
 import time
-import RPi.GPIO as GPIO
+import threading
+from robot_kit import hw
+from robot_kit.filters import MedianFilter
+from robot_kit.histogram import LatencyHistogram
 
 
 class Ultrasonic:
     """Ultrasonic Sensor Class"""
-    def __init__(self):
-        GPIO.setwarnings(False)
-        self.trigger_pin = 27
-        self.echo_pin = 22
+    def __init__(self, trigger_pin=27, echo_pin=22, gpio=None):
+        """Ultrasonic Initialization
+        Args:
+               trigger_pin: BCM pin wired to the sensor's trigger (the kit's sensor is on 27)
+               echo_pin: BCM pin wired to the sensor's echo (the kit's sensor is on 22)
+               gpio: the GPIO module to use (defaults to robot_kit.hw, RPi.GPIO on the Pi)
+        """
+        self.gpio = hw.gpio() if gpio is None else gpio
+        self.gpio.setwarnings(False)
+        self.trigger_pin = trigger_pin
+        self.echo_pin = echo_pin
         self.time_distance_factor = 0.000058  # Time to Centimeters conversion
         self.timeout_distance = 1000  # Distance to return when echo timeout occurs
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.trigger_pin, GPIO.OUT)
-        GPIO.setup(self.echo_pin, GPIO.IN)
+        self.lock = threading.RLock()  # One ping at a time (overlapping pings corrupt each other's echoes)
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setup(self.trigger_pin, self.gpio.OUT)
+        self.gpio.setup(self.echo_pin, self.gpio.IN)
 
     def get_distance(self):
-        distance_readings = []
-        for i in range(5):
+        with self.lock:
+            distance_readings = []
+            for i in range(5):
+                distance = self.read_once()
+                # Check for timeout
+                if distance is None:
+                    return self.timeout_distance
+                distance_readings.append(distance)
+            min_distance = min(distance_readings)
+            return min_distance
+
+    def read_once(self):
+        """Send a single ping and return the distance (None if the echo timed out)"""
+        with self.lock:
             self._send_trigger_pulse()
             pulse_len = self._wait_for_echo()
-            # Check for timeout
-            if pulse_len == -1:
-                return self.timeout_distance
-            else:  # Convert pulse time to distance
-                distance_readings.append(pulse_len/self.time_distance_factor)
-        min_distance = min(distance_readings)
-        return min_distance
+        if pulse_len == -1:
+            return None
+        return pulse_len/self.time_distance_factor
+
+    def stream(self, rate_hz=20, filters=None, count=None):
+        """Generator of (perf_counter_ns timestamp, distance) readings at a fixed rate
+        Args:
+               rate_hz: pings per second (on absolute deadlines, so the rate doesn't drift)
+               filters: a filter stage or robot_kit.filters.FilterChain (None for raw readings)
+               count: number of readings to yield (None for forever)
+        Note: Missed echoes the filters don't fill in come out as timeout_distance
+        """
+        period_ns = int(1e9 / rate_hz)
+        deadline = time.perf_counter_ns()
+        readings = 0
+        while count is None or readings < count:
+            timestamp = time.perf_counter_ns()
+            distance = self.read_once()
+            if filters is not None:
+                distance = filters(distance)
+            yield timestamp, self.timeout_distance if distance is None else distance
+            readings += 1
+
+            # Sleep until the next deadline (skipping any the consumer made us miss)
+            deadline += period_ns
+            now = time.perf_counter_ns()
+            if deadline > now:
+                time.sleep((deadline - now) / 1e9)
+            else:
+                deadline = now
 
     def _send_trigger_pulse(self):
         """Internal Method"""
-        GPIO.output(self.trigger_pin, 1)
+        self.gpio.output(self.trigger_pin, 1)
         time.sleep(0.00015)
-        GPIO.output(self.trigger_pin, 0)
+        self.gpio.output(self.trigger_pin, 0)
 
     def _wait_for_echo(self, max_samples=5000):
         """Internal Method"""
 
         # First we wait for the ON/1 reading (which may timeout)
         for i in range(max_samples):
-            if GPIO.input(self.echo_pin) == 1:
+            if self.gpio.input(self.echo_pin) == 1:
                 # Now we time how long it takes to get the OFF/0 reading
                 start = time.time()
-                while GPIO.input(self.echo_pin) != 0:
+                while self.gpio.input(self.echo_pin) != 0:
                     time.sleep(0.00001)  # 10 microseconds
                 total_time = time.time() - start
                 return total_time
@@ -51,6 +97,381 @@ class Ultrasonic:
         return -1
 
 
+class DistanceCache:
+    """Shares get_distance() readings between callers: recent enough readings are reused, and callers
+       that arrive while a reading is being taken wait for it instead of pinging again (single flight)
+       Usage:
+            cache = DistanceCache(Ultrasonic(), max_age=0.1)
+            cache.get_distance()  # From any number of threads (e.g. the obstacle guard and the logger)
+            cache.get_distance(max_age=0.5)  # This caller is happy with an older reading
+            cache.stats()  # Hits, misses, waits and the wait time percentiles (ns)
+
+       Note: A reading's age counts from when its pings started, so a cached distance is never
+             younger than it claims to be
+    """
+    def __init__(self, ultrasonic, max_age=0.1):
+        """DistanceCache Initialization
+        Args:
+               ultrasonic: the Ultrasonic sensor to read
+               max_age: seconds a reading can be reused for (0 still coalesces concurrent callers)
+        """
+        self.ultrasonic = ultrasonic
+        self.max_age = max_age
+        self.reading = (None, ultrasonic.timeout_distance)  # (perf_counter_ns when the pings started, distance)
+        self.counts = {'hits': 0, 'misses': 0, 'waits': 0}
+        self.wait_latency = LatencyHistogram()  # How long the waiting callers waited (ns)
+        self._condition = threading.Condition()
+        self._measuring = False
+
+    def get_distance(self, max_age=None):
+        """The distance (cm) from a reading no older than max_age seconds (defaults to self.max_age)"""
+        max_age_ns = (self.max_age if max_age is None else max_age) * 1e9
+        with self._condition:
+            timestamp, distance = self.reading
+            if timestamp is not None and time.perf_counter_ns() - timestamp <= max_age_ns:
+                self.counts['hits'] += 1
+                return distance
+
+            # Someone is already pinging: wait for their reading (unless it fails, then we ping,
+            # and count a miss rather than a wait)
+            if self._measuring:
+                waited = time.perf_counter_ns()
+                reading = self.reading
+                while self._measuring:
+                    self._condition.wait()
+                if self.reading is not reading:
+                    self.counts['waits'] += 1
+                    self.wait_latency.record(time.perf_counter_ns() - waited)
+                    return self.reading[1]
+            self._measuring = True
+            self.counts['misses'] += 1
+
+        # Ping outside the condition, so hits don't wait on the sensor
+        started = time.perf_counter_ns()
+        distance = None
+        try:
+            distance = self.ultrasonic.get_distance()
+            return distance
+        finally:
+            with self._condition:
+                if distance is not None:
+                    self.reading = (started, distance)
+                self._measuring = False
+                self._condition.notify_all()
+
+    def stats(self):
+        """Dictionary of the hits, misses, waits, shared rate (calls that didn't ping) and wait time summary (ns)"""
+        with self._condition:
+            stats = dict(self.counts)
+            stats['wait'] = self.wait_latency.summary()
+        calls = stats['hits'] + stats['misses'] + stats['waits']
+        stats['shared_rate'] = (stats['hits'] + stats['waits']) / calls if calls else 0.0
+        return stats
+
+
+class UltrasonicRanger:
+    """Edge driven ranging: triggers on a background schedule and times the echo with GPIO callbacks
+       Usage:
+            ranger = UltrasonicRanger(Ultrasonic(), rate_hz=20)
+            ranger.start()
+            ranger.distance  # Latest filtered distance (no waiting, no bus/GPIO access)
+            ranger.reading   # (perf_counter_ns timestamp, distance) of the latest reading
+            ranger.stop()
+
+            # Any robot_kit.filters stage or chain can replace the default median filter
+            ranger = UltrasonicRanger(Ultrasonic(), filters=FilterChain(TimeoutHold(2), MedianFilter(5)))
+
+       Note: The published reading is replaced (never mutated) by the callback thread,
+             so readers don't need a lock. A ping that gets no echo before the next
+             trigger is a missed reading (timeout_distance unless the filters hold it).
+             Triggers take the sensor's lock, so they never land in the middle of a
+             get_distance() on the same Ultrasonic.
+    """
+    def __init__(self, ultrasonic, rate_hz=20, filters=None):
+        """UltrasonicRanger Initialization
+        Args:
+               ultrasonic: the Ultrasonic sensor to drive
+               rate_hz: trigger rate (the HC-SR04 wants at least 60ms between pings at full range)
+               filters: a robot_kit.filters stage or chain (defaults to a median of 5)
+        """
+        self.ultrasonic = ultrasonic
+        self.gpio = ultrasonic.gpio
+        self.rate_hz = rate_hz
+        self.filters = MedianFilter(5) if filters is None else filters
+        self.reading = (0, ultrasonic.timeout_distance)
+        self.stats = {'pings': 0, 'readings': 0, 'timeouts': 0}
+        self.listeners = []
+        self._ns_per_cm = ultrasonic.time_distance_factor * 1e9
+        self._pending = False
+        self._rise_ns = None
+        self._lock = threading.Lock()  # The pending ping and the filters, between the trigger and callback threads
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def distance(self):
+        """The latest filtered distance (cm)"""
+        return self.reading[1]
+
+    def add_listener(self, callback):
+        """Call callback(timestamp_ns, distance) with every new reading (from the GPIO callback thread)"""
+        self.listeners.append(callback)
+
+    def start(self):
+        """Start the edge callbacks and the trigger thread"""
+        self.gpio.add_event_detect(self.ultrasonic.echo_pin, self.gpio.BOTH, callback=self._on_edge)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop triggering and remove the edge callbacks"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.gpio.remove_event_detect(self.ultrasonic.echo_pin)
+
+    def _run(self):
+        """Internal: Trigger thread, pings on absolute deadlines so the rate doesn't drift"""
+        period_ns = int(1e9 / self.rate_hz)
+        deadline = time.perf_counter_ns()
+        while not self._stop_event.is_set():
+            # The previous ping never came back
+            with self._lock:
+                if self._pending:
+                    self._timeout()
+                self._pending = True
+                self._rise_ns = None
+            self.stats['pings'] += 1
+            with self.ultrasonic.lock:
+                self.ultrasonic._send_trigger_pulse()
+
+            # Sleep until the next deadline (skipping any we've already missed)
+            deadline += period_ns
+            now = time.perf_counter_ns()
+            if deadline < now:
+                deadline = now
+            self._stop_event.wait((deadline - now) / 1e9)
+
+    def _on_edge(self, channel):
+        """Internal: GPIO callback, timestamps the echo edges"""
+        now = time.perf_counter_ns()
+        rising = self.gpio.input(channel)
+        with self._lock:
+            if rising:
+                self._rise_ns = now
+            elif self._pending and self._rise_ns is not None:
+                self._pending = False
+                self.stats['readings'] += 1
+                self._publish(now, (now - self._rise_ns) / self._ns_per_cm)
+
+    def _publish(self, timestamp_ns, distance):
+        """Internal: Filter the new distance (None for a timeout) and publish it (call with the lock held)"""
+        distance = self.filters(distance)
+        reading = (timestamp_ns, self.ultrasonic.timeout_distance if distance is None else distance)
+        self.reading = reading
+        for listener in self.listeners:
+            listener(*reading)
+
+    def _timeout(self):
+        """Internal: No echo before the next ping (call with the lock held)"""
+        self.stats['timeouts'] += 1
+        self._pending = False
+        self._publish(time.perf_counter_ns(), None)
+
+
+class UltrasonicArray:
+    """Several ultrasonic sensors ranging in interleaved time slots, timed with GPIO edge callbacks
+       Usage:
+            array = UltrasonicArray([Ultrasonic(27, 22), Ultrasonic(23, 24), Ultrasonic(5, 6)])
+            array.start()
+            array.distances  # Latest distance for each sensor, e.g. (42.0, 118.5, 1000)
+            array.readings   # ((perf_counter_ns timestamp, distance), ...) for each sensor
+            array.stop()
+
+            # Sensors facing away from each other can share a slot (twice the rate for each)
+            array = UltrasonicArray([front, left, back, right], groups=[[0, 2], [1, 3]])
+
+       Schedule: Each slot triggers one group of sensors and lasts until all of their echoes are
+                 back, or until an echo from max_distance would have returned (the rest are
+                 timeouts), plus guard_ms either way (for stray and far reflections to die down).
+                 The next slot starts right away, so the aggregate rate is as high as the distances
+                 allow while only one group's sound is ever in the air.
+
+       Note: The published readings tuple is replaced (never mutated), so readers don't need a lock.
+             Each trigger takes its sensor's lock, so a get_distance() on the same sensor waits its turn.
+    """
+    def __init__(self, sensors, groups=None, max_distance=400.0, guard_ms=5.0, filters=None):
+        """UltrasonicArray Initialization
+        Args:
+               sensors: list of Ultrasonic sensors (on the same GPIO module, each on its own pins)
+               groups: lists of sensor indices that are triggered together (default: one at a time)
+               max_distance: the furthest distance (cm) to wait for an echo from
+               guard_ms: quiet time after the last echo of a slot before the next slot triggers
+               filters: function returning a new robot_kit.filters stage/chain for each sensor (None for raw)
+        """
+        self.sensors = sensors
+        self.gpio = sensors[0].gpio
+        self.groups = groups or [[index] for index in range(len(sensors))]
+        self.slot_ns = int((max_distance * sensors[0].time_distance_factor + 0.002) * 1e9)
+        self.guard_ns = int(guard_ms * 1e6)
+        self.filters = [filters() if filters else None for _ in sensors]
+        self.readings = tuple((0, sensor.timeout_distance) for sensor in sensors)
+        self.stats = {'cycles': 0, 'pings': 0, 'readings': 0, 'timeouts': 0}
+        self.listeners = []
+        self._echo_index = {sensor.echo_pin: index for index, sensor in enumerate(sensors)}
+        self._ns_per_cm = [sensor.time_distance_factor * 1e9 for sensor in sensors]
+        self._pending = [False] * len(sensors)
+        self._rise_ns = [None] * len(sensors)
+        self._remaining = 0
+        self._lock = threading.Lock()  # The pending pings, the filters and the stats, between the trigger and callback threads
+        self._slot_done = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def distances(self):
+        """The latest (filtered) distance for each sensor (cm)"""
+        return tuple(distance for _, distance in self.readings)
+
+    def add_listener(self, callback):
+        """Call callback(index, timestamp_ns, distance) with every new reading"""
+        self.listeners.append(callback)
+
+    def start(self):
+        """Start the edge callbacks and the trigger thread"""
+        for sensor in self.sensors:
+            self.gpio.add_event_detect(sensor.echo_pin, self.gpio.BOTH, callback=self._on_edge)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='robot_kit_ultrasonic_array', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop triggering and remove the edge callbacks"""
+        self._stop_event.set()
+        self._slot_done.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for sensor in self.sensors:
+            self.gpio.remove_event_detect(sensor.echo_pin)
+
+    def _run(self):
+        """Internal: Trigger thread, steps through the slots back to back"""
+        while not self._stop_event.is_set():
+            for group in self.groups:
+                with self._lock:
+                    self._slot_done.clear()
+                    self._remaining = len(group)
+                    for index in group:
+                        self._rise_ns[index] = None
+                        self._pending[index] = True
+                    self.stats['pings'] += len(group)
+                for index in group:
+                    with self.sensors[index].lock:
+                        self.sensors[index]._send_trigger_pulse()
+
+                # Wait for the echoes (or the longest one we care about), then let the air settle
+                self._slot_done.wait(self.slot_ns / 1e9)
+                self._stop_event.wait(self.guard_ns / 1e9)
+                if self._stop_event.is_set():
+                    return  # Stopped mid slot, those pings didn't time out
+                with self._lock:
+                    for index in group:
+                        if self._pending[index]:
+                            self._pending[index] = False
+                            self.stats['timeouts'] += 1
+                            self._publish(index, time.perf_counter_ns(), None)
+            with self._lock:
+                self.stats['cycles'] += 1
+
+    def _on_edge(self, channel):
+        """Internal: GPIO callback, timestamps the echo edges"""
+        now = time.perf_counter_ns()
+        index = self._echo_index[channel]
+        rising = self.gpio.input(channel)
+        with self._lock:
+            if rising:
+                self._rise_ns[index] = now
+            elif self._pending[index] and self._rise_ns[index] is not None:
+                self._pending[index] = False
+                self.stats['readings'] += 1
+                self._publish(index, now, (now - self._rise_ns[index]) / self._ns_per_cm[index])
+                self._remaining -= 1
+                if not self._remaining:
+                    self._slot_done.set()
+
+    def _publish(self, index, timestamp_ns, distance):
+        """Internal: Filter one sensor's new distance (None for a timeout) and publish the readings (call with the lock held)"""
+        if self.filters[index] is not None:
+            distance = self.filters[index](distance)
+        distance = self.sensors[index].timeout_distance if distance is None else distance
+        readings = list(self.readings)
+        readings[index] = (timestamp_ns, distance)
+        self.readings = tuple(readings)
+        for listener in self.listeners:
+            listener(index, timestamp_ns, distance)
+
+
+def test_cache():
+    """Test for the DistanceCache on a FakeGPIO sensor (no Pi needed, robot_kit.gpio's test runs it)"""
+    import time
+    from robot_kit.gpio import FakeGPIO
+
+    # Two consumers (say a guard and a logger) sharing readings: one set of pings per reading
+    gpio = FakeGPIO()
+    gpio.attach_sensor(27, 22, distance=40.0)
+    cache = DistanceCache(Ultrasonic(gpio=gpio), max_age=0.05)
+    distances = []
+
+    def consumer(interval):
+        for _ in range(10):
+            distances.append(cache.get_distance())
+            time.sleep(interval)
+    consumers = [threading.Thread(target=consumer, args=(interval,)) for interval in [0.01, 0.013]]
+    for thread in consumers:
+        thread.start()
+    for thread in consumers:
+        thread.join()
+    stats = cache.stats()
+    print('cache: {:d} hits {:d} misses {:d} waits ({:.0%} shared, wait p50 {:.1f}ms)'.format(
+        stats['hits'], stats['misses'], stats['waits'], stats['shared_rate'], stats['wait']['p50'] / 1e6))
+    assert len(set(distances)) <= stats['misses'] and abs(sorted(distances)[10] - 40.0) < 5.0, distances
+    assert len(gpio.triggers) == 5 * stats['misses'] and stats['misses'] < 20 and stats['waits'] > 0
+    assert stats['hits'] + stats['misses'] + stats['waits'] == 20
+
+    # A waiter whose reading failed pings for itself: that's a miss, not a wait
+    class FlakySensor:
+        timeout_distance = 1000
+
+        def __init__(self):
+            self.calls = 0
+
+        def get_distance(self):
+            self.calls += 1
+            time.sleep(0.05)
+            if self.calls == 1:
+                raise OSError('GPIO error')
+            return 42.0
+    cache = DistanceCache(FlakySensor())
+    results = []
+
+    def flaky_consumer():
+        try:
+            results.append(cache.get_distance())
+        except OSError:
+            results.append(None)
+    consumers = [threading.Thread(target=flaky_consumer) for _ in range(2)]
+    for thread in consumers:
+        thread.start()
+        time.sleep(0.01)
+    for thread in consumers:
+        thread.join()
+    stats = cache.stats()
+    assert sorted(results, key=str) == [42.0, None] and stats['misses'] == 2 and stats['waits'] == 0, stats
+
+
 def test():
     """Test for the Ultrasonic class"""
     import time
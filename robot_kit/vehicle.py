@@ -15,40 +15,66 @@ class Vehicle:
             vehicle.turn_left(1.0)  # Turn left at full speed
             vehicle.turn_right(0.5)  # Turn right at half speed
 
+            # Velocity commands (one batched wheel update each, fine to send at 50+ Hz)
+            vehicle.drive(0.6, 0.2)  # Arc gently to the left
+            vehicle.drive(0.0, -0.5)  # Spin right in place
+            vehicle.drive(0.0, 0.0, lateral=0.5)  # Strafe right (mecanum wheels only)
+
             # Note: When using a 'low speed' (anything less then 0.3 or so the motors don't
                     seem to respond well. I'm assuming this is because their might be some
                     flaws in the example code that drives the PCA9685/PWM device
     """
-    def __init__(self):
-        """Vehicle Initialization"""
-        self.chip_address = 0x40
-        self.wheels = Wheels(address=self.chip_address)
+    # Wheel speed = linear*a + angular*b + lateral*c (angular is positive to the left, lateral to the right)
+    MIXING = {
+        'left_front': (1.0, -1.0, 1.0),
+        'left_rear': (1.0, -1.0, -1.0),
+        'right_front': (1.0, 1.0, -1.0),
+        'right_rear': (1.0, 1.0, 1.0),
+    }
+
+    def __init__(self, address=0x40, bus=None):
+        """Vehicle Initialization
+        Args:
+               address: I2C address of the PCA9685 chip
+               bus: a robot_kit.bus backend (defaults to I2C bus 1 from robot_kit.hw)
+        """
+        self.chip_address = address
+        self.wheels = Wheels(address=self.chip_address, bus=bus)
+
+    def drive(self, linear, angular, lateral=0.0):
+        """Drive with the given velocities, all four wheels go out in one batched update
+        Args:
+               linear: forward speed (-1.0 to 1.0)
+               angular: turning speed, positive turns left (-1.0 to 1.0)
+               lateral: sideways speed, positive moves right (mecanum wheels only, -1.0 to 1.0)
+        Note: If a wheel would need more than full speed, all of the wheels are scaled down
+              together, so the vehicle keeps the commanded arc (just slower)
+        """
+        speeds = {wheel: linear*a + angular*b + lateral*c for wheel, (a, b, c) in self.MIXING.items()}
+        peak = max(abs(speed) for speed in speeds.values())
+        if peak > 1.0:
+            speeds = {wheel: speed / peak for wheel, speed in speeds.items()}
+        self.wheels.set_speeds(speeds)
 
     def forward(self, speed):
         """Move the vehicle forward at the given speed"""
-        self.wheels.all(speed)
+        self.drive(speed, 0.0)
 
     def backward(self, speed):
         """Move the vehicle forward at the given speed"""
-        self.wheels.all(-speed)
+        self.drive(-speed, 0.0)
 
     def stop(self):
         """Stop ALL of the vehicle"""
-        self.wheels.all(0.0)
+        self.drive(0.0, 0.0)
 
     def turn_left(self, speed):
         """Turn left using alternate directions on vehicle"""
-        self.wheels.left_front(-speed)
-        self.wheels.left_rear(-speed)
-        self.wheels.right_front(speed)
-        self.wheels.right_rear(speed)
+        self.drive(0.0, speed)
 
     def turn_right(self, speed):
         """Turn left using alternate directions on vehicle"""
-        self.wheels.left_front(speed)
-        self.wheels.left_rear(speed)
-        self.wheels.right_front(-speed)
-        self.wheels.right_rear(-speed)
+        self.drive(0.0, -speed)
 
     def cleanup(self):
         """Method that's called when class is destroyed"""
@@ -66,6 +92,8 @@ def test():
     time.sleep(0.5)
     vehicle.turn_right(0.5)
     time.sleep(0.5)
+    vehicle.drive(0.5, 0.25)
+    time.sleep(0.5)
     vehicle.stop()
 
     vehicle.cleanup()
@@ -1,5 +1,6 @@
 """A lightweight wrapper around the four servo motors driven by a PCA9685 chip"""
 from robot_kit.PCA9685 import PCA9685
+import math
 import time
 
 
@@ -20,11 +21,20 @@ class Wheels:
             # Note: When using a 'low speed' (anything less then 0.3 or so the motors don't
                     seem to respond well. I'm assuming this is because their might be some
                     flaws in the example code that drives the PCA9685/PWM device
+                    (see robot_kit.calibration for per wheel dead zone compensation)
     """
-    def __init__(self, address=0x40):
-        """Wheels Initialization"""
+    SPEED_STEPS = 4095  # Lookup table resolution (entries per unit of speed, each direction: one per 12 bit duty step)
+
+    def __init__(self, address=0x40, bus=None, calibration=None):
+        """Wheels Initialization
+        Args:
+               address: I2C address of the PCA9685 chip
+               bus: a robot_kit.bus backend (defaults to I2C bus 1 from robot_kit.hw)
+                    Wheels on the same bus and address share one PCA9685 driver (see PCA9685.shared)
+               calibration: a robot_kit.calibration.WheelCalibration (defaults to a plain linear duty)
+        """
         self.address = address
-        self.pwm = PCA9685(0x40, debug=True)
+        self.pwm = PCA9685.shared(self.address, bus=bus)
         self.pwm.setPWMFreq(50)
 
         # So these channels are taken from example code
@@ -36,15 +46,45 @@ class Wheels:
                 'right_rear': [5, 4]
                 }
 
+        # Speed -> duty lookup table (see _speed_index), one per wheel
+        self.set_calibration(calibration)
+
     def all(self, speed):
         """Move all of the wheels at the given speed"""
-        for wheel in ['left_front', 'left_rear', 'right_front', 'right_rear']:
-            self._set_wheel_speed(wheel, speed)
+        self.set_speeds({wheel: speed for wheel in self._wheel_channels})
 
     def stop(self):
         """Stop ALL of the wheels"""
-        for wheel in ['left_front', 'left_rear', 'right_front', 'right_rear']:
-            self._set_wheel_speed(wheel, 0.0)
+        self.set_speeds({wheel: 0.0 for wheel in self._wheel_channels})
+
+    def set_calibration(self, calibration):
+        """Switch to the duty lookup tables compiled from a WheelCalibration (None for plain linear)"""
+        if calibration is None:
+            table = [self._convert_range((index - self.SPEED_STEPS)/self.SPEED_STEPS) for index in range(2*self.SPEED_STEPS + 1)]
+            self._duty_tables = {wheel: table for wheel in self._wheel_channels}
+        else:
+            self._duty_tables = calibration.compile(self.SPEED_STEPS, list(self._wheel_channels))
+
+    def set_speeds(self, speeds):
+        """Set several wheels at once with a single batched PWM update
+        Args:
+               speeds: dict of wheel name -> float (range -1.0 to 1.0, clamped, NaN raises ValueError
+                       before any wheel changes)
+        """
+        updates = {}
+        for wheel, speed in speeds.items():
+            self._add_wheel_duty(updates, wheel, speed)
+        self.pwm.submit(updates)
+
+    def set_duties(self, duties):
+        """Set several wheels to raw PWM duties with one batched update (used for calibration)
+        Args:
+               duties: dict of wheel name -> int duty (range -4095 to 4095, the sign is the direction)
+        """
+        updates = {}
+        for wheel, duty in duties.items():
+            self._add_duty(updates, wheel, duty)
+        self.pwm.submit(updates)
 
     # Note: From this point on are testing methods, in normal operation
     #       you probably shouldn't turn/operation/stop an individual wheel
@@ -78,7 +118,7 @@ class Wheels:
 
     def test_wheels(self):
         """Testing: A method to test ALL wheels individually"""
-        for wheel in ['left_front', 'left_rear', 'right_front', 'right_rear']:
+        for wheel in self._wheel_channels:
             self.test_wheel(wheel)
 
     def test_wheel(self, wheel):
@@ -111,22 +151,39 @@ class Wheels:
         # Convert to 12bit (4096-1) range
         return int(value*4095)
 
+    def _speed_index(self, speed):
+        """Internal: Index of a speed in the duty lookup tables (clamped to -1 to 1, NaN is rejected)"""
+        if math.isnan(speed):
+            raise ValueError('Wheel speed is NaN')
+        speed = min(max(speed, -1.0), 1.0)
+        index = int(speed*self.SPEED_STEPS + self.SPEED_STEPS + 0.5)
+        return min(max(index, 0), 2*self.SPEED_STEPS)
+
     def _set_wheel_speed(self, wheel, speed):
         """Internal: This is an internal method to reduce copy/paste code"""
+        self.set_speeds({wheel: speed})
 
-        # Look up wheel PWM channels
-        channels = self._wheel_channels[wheel]
+    def _add_wheel_duty(self, updates, wheel, speed):
+        """Internal: Add the PWM (on, off) values for a wheel speed to a batched update"""
 
         # Convert speed to duty load
-        duty = self._convert_range(speed)
+        index = self._speed_index(speed)  # A NaN speed raises here, before anything is queued
+        if not -1.0 <= speed <= 1.0:
+            self._convert_range(speed)  # Just for the clamp warning
+        self._add_duty(updates, wheel, self._duty_tables[wheel][index])
+
+    def _add_duty(self, updates, wheel, duty):
+        """Internal: Add the PWM (on, off) values for a signed wheel duty to a batched update"""
+        channels = self._wheel_channels[wheel]
 
         # Based on positive/negative value of duty we set one channel to 0 and one channel to duty value
+        # Note: Both channels go out in the same block write, so the chip latches them together
         if duty > 0:
-            self.pwm.setMotorPwm(channels[0], 0)
-            self.pwm.setMotorPwm(channels[1], duty)
+            updates[channels[0]] = (0, 0)
+            updates[channels[1]] = (0, duty)
         else:
-            self.pwm.setMotorPwm(channels[1], 0)
-            self.pwm.setMotorPwm(channels[0], abs(duty))
+            updates[channels[1]] = (0, 0)
+            updates[channels[0]] = (0, abs(duty))
 
     def cleanup(self):
         """Method that's called when class is destroyed"""
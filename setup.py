@@ -38,6 +38,7 @@ setup(
         'adafruit-circuitpython-neopixel',
     ],
     extras_require={
+        'numpy': ['numpy'],
     },
     license='Apache',
     keywords='Robotics, Python',